@@ -0,0 +1,157 @@
+"""Adaptive per-URL sample counts driven by confidence interval width."""
+#################################################
+#
+# Description:  Decide which URL to load next so samples go to the URLs
+#               whose metric estimate is least certain, stop the URLs
+#               that converged and respect a total time budget.
+#################################################
+import math
+
+from harness_timers import monotonic
+from streaming_stats import MetricStats
+
+# two-sided normal quantiles for the supported confidence levels
+Z_VALUES = {0.90: 1.6449, 0.95: 1.9600, 0.99: 2.5758}
+# two-sided Student t quantiles for 1 to 30 degrees of freedom
+T_TABLE = {
+    0.90: (6.3138, 2.9200, 2.3534, 2.1318, 2.0150, 1.9432, 1.8946, 1.8595,
+           1.8331, 1.8125, 1.7959, 1.7823, 1.7709, 1.7613, 1.7531, 1.7459,
+           1.7396, 1.7341, 1.7291, 1.7247, 1.7207, 1.7171, 1.7139, 1.7109,
+           1.7081, 1.7056, 1.7033, 1.7011, 1.6991, 1.6973),
+    0.95: (12.7062, 4.3027, 3.1824, 2.7764, 2.5706, 2.4469, 2.3646, 2.3060,
+           2.2622, 2.2281, 2.2010, 2.1788, 2.1604, 2.1448, 2.1314, 2.1199,
+           2.1098, 2.1009, 2.0930, 2.0860, 2.0796, 2.0739, 2.0687, 2.0639,
+           2.0595, 2.0555, 2.0518, 2.0484, 2.0452, 2.0423),
+    0.99: (63.6567, 9.9248, 5.8409, 4.6041, 4.0321, 3.7074, 3.4995, 3.3554,
+           3.2498, 3.1693, 3.1058, 3.0545, 3.0123, 2.9768, 2.9467, 2.9208,
+           2.8982, 2.8784, 2.8609, 2.8453, 2.8314, 2.8188, 2.8073, 2.7969,
+           2.7874, 2.7787, 2.7707, 2.7633, 2.7564, 2.7500)}
+
+
+def t_value(confidence, df):
+    """Student t quantile.
+
+    Exact (from T_TABLE) up to 30 degrees of freedom, then the
+    Cornish-Fisher expansion around the normal, within 0.001 there.
+    """
+    z = Z_VALUES[confidence]
+    if df < 1:
+        return float('inf')
+    table = T_TABLE[confidence]
+    if df <= len(table):
+        return table[int(df) - 1]
+    return z + (z ** 3 + z) / (4.0 * df) + \
+        (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96.0 * df ** 2)
+
+
+class _UrlState(object):
+    """Samples and attempts seen for one URL."""
+
+    def __init__(self):
+        """Doc string."""
+        self.stats = MetricStats(quantiles=())
+        self.attempts = 0
+
+
+class AdaptiveScheduler(object):
+    """Hands out (url, run_number) items until every URL has converged.
+
+    A URL has converged once it has min_samples values of metric and the
+    half width of the confidence interval of the mean, relative to the
+    mean, is at most target_ci.  A URL is also dropped after max_samples
+    attempts; nothing is handed out once time_budget seconds have passed.
+    """
+
+    def __init__(self, urls, metric="Page Load", target_ci=0.05,
+                 min_samples=3, max_samples=30, time_budget=None,
+                 confidence=0.95):
+        """Doc string."""
+        if confidence not in Z_VALUES:
+            raise ValueError("confidence must be one of {0}".format(
+                sorted(Z_VALUES)))
+        self.urls = list(urls)
+        self.metric = metric
+        self.target_ci = target_ci
+        self.min_samples = max(2, min_samples)
+        self.max_samples = max(self.min_samples, max_samples)
+        self.time_budget = time_budget
+        self.confidence = confidence
+        self.state = dict((url, _UrlState()) for url in self.urls)
+        self._started = None
+
+    def relative_ci(self, url):
+        """Relative half width of the CI of the mean, inf if unknown."""
+        stats = self.state[url].stats
+        if stats.count < 2 or stats.mean <= 0:
+            return float('inf')
+        half_width = t_value(self.confidence, stats.count - 1) * \
+            stats.stddev / math.sqrt(stats.count)
+        return half_width / stats.mean
+
+    def converged(self, url):
+        """Check whether a URL reached its target CI width."""
+        return self.state[url].stats.count >= self.min_samples and \
+            self.relative_ci(url) <= self.target_ci
+
+    def finished(self, url):
+        """Check whether a URL gets no more samples."""
+        return self.converged(url) or \
+            self.state[url].attempts >= self.max_samples
+
+    def budget_exhausted(self):
+        """Check the total time budget."""
+        return bool(self.time_budget) and self._started is not None and \
+            monotonic() - self._started >= self.time_budget
+
+    def next_item(self):
+        """Return the next (url, run_number) to measure, or None when done.
+
+        URLs below min_samples come first, fewest attempts first; after
+        that the URL with the widest CI relative to the target wins.
+        """
+        if self._started is None:
+            self._started = monotonic()
+        if self.budget_exhausted():
+            return None
+
+        candidates = [url for url in self.urls if not self.finished(url)]
+        if not candidates:
+            return None
+
+        warming = [url for url in candidates
+                   if self.state[url].stats.count < self.min_samples]
+        if warming:
+            url = min(warming, key=lambda u: self.state[u].attempts)
+        else:
+            url = max(candidates, key=self.relative_ci)
+
+        run_number = self.state[url].attempts
+        self.state[url].attempts += 1
+        return url, run_number
+
+    def record(self, url, value):
+        """Record the metric of a load, value is None for failed loads."""
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            self.state[url].stats.add(value)
+
+    def format_report(self):
+        """Return the per-URL sample counts and final CI widths."""
+        header = "| {0:30.25} | {1:>7} | {2:>7} | {3:>10} | {4:>9} |".format(
+            "URL", "Samples", "Loads", "Rel. CI", "Converged")
+        line = "=" * len(header)
+        lines = ["Adaptive sampling on {0} ({1:.0%} CI, target {2:.1%}):"
+                 .format(self.metric, self.confidence, self.target_ci),
+                 line, header, line]
+        for url in self.urls:
+            state = self.state[url]
+            rel_ci = self.relative_ci(url)
+            lines.append(
+                "| {0:30.25} | {1:7d} | {2:7d} | {3:>10} | {4:>9} |".format(
+                    url.strip(), state.stats.count, state.attempts,
+                    "N/A" if math.isinf(rel_ci) else "{0:.1%}".format(rel_ci),
+                    "yes" if self.converged(url) else "no"))
+        lines.append(line)
+        if self.budget_exhausted():
+            lines.append("Time budget of {0}s exhausted".format(
+                self.time_budget))
+        return "\n".join(lines)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""Use environment Python variable."""
+#################################################
+#
+# Description:  Browserless probe of the backend timings (DNS, TCP, TLS
+#               and time to first byte) of many URLs with asyncio.
+#               Writes rows with the same columns as the browser scripts,
+#               the browser-only columns are "N/A". Needs Python 3.
+#################################################
+import asyncio
+import socket
+import ssl
+import sys
+import time
+from optparse import OptionParser
+from urllib.parse import urlsplit
+
+from harness_timers import monotonic
+from result_sink import ResultSink, FORMATS, file_extension
+
+_FileName = "backend_probe.py"
+PROBE_TIMEOUT = 15
+# same schema as chrome_loadtest.py / ff_loadtest.py
+csv_columns = ["url", "run", "DNS Resolution", "TCP Connection",
+               "SSL Handshake", "Backend Time", "DOM Loading",
+               "DOM Ready", "Frontend Time", "Page Load"]
+BROWSER_ONLY_COLUMNS = ["DOM Loading", "DOM Ready", "Frontend Time",
+                        "Page Load"]
+
+
+def _ms(seconds):
+    return int(round(seconds * 1000))
+
+
+async def probe(url, run_number, ssl_context=None, timeout=PROBE_TIMEOUT):
+    """Measure DNS, TCP connect, TLS handshake and TTFB of one URL.
+
+    Backend Time is counted from the start of the DNS lookup to the first
+    response byte, like responseStart - navigationStart in the browser.
+    Each phase (lookup, connect, handshake, request to first byte) raises
+    asyncio.TimeoutError after timeout seconds.
+    """
+    loop = asyncio.get_running_loop()
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+    started = monotonic()
+    infos = await asyncio.wait_for(
+        loop.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM),
+        timeout)
+    resolved = monotonic()
+
+    family, socktype, proto, _, address = infos[0]
+    sock = socket.socket(family, socktype, proto)
+    sock.setblocking(False)
+    writer = None
+    try:
+        await asyncio.wait_for(loop.sock_connect(sock, address), timeout)
+        connected = monotonic()
+
+        if secure:
+            context = ssl_context or ssl.create_default_context()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(sock=sock, ssl=context,
+                                        server_hostname=parts.hostname),
+                timeout)
+        else:
+            reader, writer = await asyncio.open_connection(sock=sock)
+        handshaken = monotonic()
+
+        host = parts.hostname if parts.port is None else parts.netloc
+        writer.write(("GET {0} HTTP/1.1\r\nHost: {1}\r\n"
+                      "User-Agent: browser_pageloadspeed-probe\r\n"
+                      "Accept: */*\r\nConnection: close\r\n\r\n").format(
+                          path, host).encode('ascii'))
+        await asyncio.wait_for(writer.drain(), timeout)
+        first_byte = await asyncio.wait_for(reader.read(1), timeout)
+        responded = monotonic()
+        if not first_byte:
+            raise ConnectionError("connection closed before any response")
+    finally:
+        if writer is not None:
+            writer.close()
+        else:
+            sock.close()
+
+    row = {"url": url, "run": str(run_number),
+           "DNS Resolution": _ms(resolved - started),
+           "TCP Connection": _ms(connected - resolved),
+           "SSL Handshake": _ms(handshaken - connected) if secure else 0,
+           "Backend Time": _ms(responded - started)}
+    for column in BROWSER_ONLY_COLUMNS:
+        row[column] = "N/A"
+    return row
+
+
+class BackendProber(object):
+    """Probes many URLs concurrently with global and per-host limits."""
+
+    def __init__(self, concurrency=100, per_host=4, ssl_context=None,
+                 timeout=PROBE_TIMEOUT):
+        """Doc string."""
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self._host_limits = {}
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
+
+    async def _probe_one(self, limit, url, run_number):
+        # wait for the host first, so a busy host holds no global slot
+        async with self._host_limit(url), limit:
+            try:
+                return await probe(url, run_number, self.ssl_context,
+                                   self.timeout)
+            except (OSError, asyncio.TimeoutError, ssl.SSLError,
+                    ValueError) as e:
+                print("Could not probe {0}: {1!r}".format(url, e))
+                return None
+
+    async def probe_all(self, urls, run_number):
+        """Probe every URL once, return the rows in input order."""
+        # semaphores belong to the running loop, build them per round
+        self._host_limits = {}
+        limit = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(
+            *[self._probe_one(limit, url, run_number) for url in urls])
+
+    def run(self, urls, run_number=0):
+        """Synchronous wrapper around probe_all."""
+        return asyncio.run(self.probe_all(urls, run_number))
+
+
+def print_row(row):
+    """Print the backend columns of a row to stdout."""
+    print("| {url:30.25} | {DNS Resolution:9d} ms | {TCP Connection:9d} ms "
+          "| {SSL Handshake:9d} ms | {Backend Time:9d} ms |".format(**row))
+
+
+if __name__ == "__main__":
+
+    parser = OptionParser(
+        usage="Usage: {0} --file=<urls> [--iterations=<iterations>] "
+              "[--interval=<seconds>]".format(_FileName))
+    parser.add_option("-f", "--file",
+                      dest="url_file",
+                      help="input file with URLs list")
+    parser.add_option("-n", "--iterations",
+                      dest="iterations",
+                      help="number of probe rounds, 0 runs forever",
+                      default='1')
+    parser.add_option("--interval",
+                      dest="interval",
+                      help="seconds between the start of two rounds",
+                      default='60')
+    parser.add_option("-c", "--concurrency",
+                      dest="concurrency",
+                      help="maximum probes in flight",
+                      default='100')
+    parser.add_option("--per-host",
+                      dest="per_host",
+                      help="maximum probes in flight per host",
+                      default='4')
+    parser.add_option("--insecure",
+                      dest="insecure",
+                      action='store_true',
+                      help="do not verify TLS certificates",
+                      default=False)
+    parser.add_option("--csv",
+                      dest="csv",
+                      action='store_true',
+                      help="write output to a results file",
+                      default=False)
+    parser.add_option("--output-format",
+                      dest="output_format",
+                      choices=list(FORMATS),
+                      help="output file format: csv, jsonl or columnar",
+                      default='csv')
+
+    (options, args) = parser.parse_args()
+
+    if not options.url_file:   # if filename is not given
+        parser.error('Filename not given')
+
+    try:
+        with open(options.url_file, 'r') as url_file:
+            urls = [line.strip() for line in url_file if line.strip()]
+    except IOError as e:
+        print("I/O error({0}): {1}".format(e.errno, e.strerror))
+        exit(2)
+
+    ssl_context = None
+    if options.insecure:
+        ssl_context = ssl._create_unverified_context()
+
+    prober = BackendProber(int(options.concurrency), int(options.per_host),
+                           ssl_context)
+    sink = None
+    if options.csv:
+        filename = "perftimings_probe_" + str(int(time.time())) + \
+            file_extension(options.output_format)
+        sink = ResultSink(filename, csv_columns, options.output_format)
+
+    iterations = int(options.iterations)
+    run_number = 0
+    try:
+        while not iterations or run_number < iterations:
+            round_started = monotonic()
+            for row in prober.run(urls, run_number):
+                if row is None:
+                    continue
+                if sink:
+                    sink.write(row)
+                else:
+                    print_row(row)
+            if sink:
+                sink.flush()
+            run_number += 1
+            if not iterations or run_number < iterations:
+                time.sleep(max(0, float(options.interval) -
+                               (monotonic() - round_started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if sink:
+            sink.close()
+
+    sys.exit(0)
@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+"""Vectorized analysis of large sets of result files with NumPy."""
+#################################################
+#
+# Description:  Load result files, the raw Navigation Timing records
+#               written with --raw-timings or the rows of the metrics,
+#               into NumPy columns with NaN for missing values, derive
+#               the metrics of calc_timers on whole columns and summarise
+#               and histogram them per URL, without one Python object per
+#               row.  Columnar files are memory mapped; CSV and JSON Lines
+#               are parsed in Python and are the slow path.
+#
+#   batch_analysis.py perftimings_chrome_*_raw.cols
+#   batch_analysis.py --metric="Page Load" --histogram results/*.csv
+#################################################
+import array
+import csv
+import json
+import mmap
+import sys
+from optparse import OptionParser
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from metrics_export import MS_BUCKETS
+from resource_timing import TIMING_FIELDS
+from result_sink import ResultSink, FORMATS, TEXT_COLUMNS, \
+    iter_columnar, _NUMBER
+from streaming_stats import SUMMARY_QUANTILES, summary_columns, \
+    format_summary
+
+# the metrics of calc_timers, in the order of the results files
+derived_metrics = ["DNS Resolution", "TCP Connection", "SSL Handshake",
+                   "Backend Time", "DOM Loading", "DOM Ready",
+                   "Frontend Time", "Page Load"]
+DEFAULT_GROUP_BY = "url"
+MISSING_LABEL = u"N/A"
+# bytes of padded strings factorized at a time by _Factorizer.add_packed
+PACKED_BYTES = 1 << 24
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("batch analysis needs NumPy, pip install numpy")
+
+
+def _cell_float(value):
+    """Map a CSV or JSON cell to a float, "N/A" and blanks become NaN."""
+    if value is None or isinstance(value, bool):
+        return float('nan')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+class _Factorizer(object):
+    """Turns a stream of strings into int32 codes and a list of labels."""
+
+    def __init__(self):
+        """Doc string."""
+        self.codes = array.array('i')
+        self.packed = []
+        self.index = {}
+        self.labels = []
+
+    def add(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.labels)
+            self.labels.append(value)
+        self.codes.append(code)
+
+    def _add_unique(self, values, first, inverse):
+        # new labels are numbered in order of first appearance, as in add
+        mapping = numpy.empty(len(values), numpy.int32)
+        for i in numpy.argsort(first).tolist():
+            value = bytes(values[i])
+            code = self.index.get(value)
+            if code is None:
+                code = self.index[value] = len(self.labels)
+                self.labels.append(value)
+            mapping[i] = code
+        self.packed.append(mapping[inverse])
+
+    def add_packed(self, payload, lengths):
+        """Add the strings packed back to back in payload, a uint8 array.
+
+        The strings are padded into a fixed width bytes array and
+        factorized with numpy.unique, so the only Python loop is over
+        the distinct values. Strings must not end in NUL bytes.
+        """
+        ends = numpy.cumsum(lengths, dtype=numpy.int64)
+        width = max(1, int(lengths.max())) if len(lengths) else 1
+        step = max(1, PACKED_BYTES // width)
+        for first in range(0, len(lengths), step):
+            part = lengths[first:first + step]
+            start = int(ends[first] - part[0])
+            end = int(ends[first + len(part) - 1])
+            padded = numpy.zeros((len(part), width), numpy.uint8)
+            padded[numpy.arange(width) < part[:, None]] = \
+                payload[start:end]
+            values, seen, inverse = numpy.unique(
+                padded.view('S{0}'.format(width)).ravel(),
+                return_index=True, return_inverse=True)
+            self._add_unique(values, seen, inverse.ravel())
+
+    def result(self):
+        labels = [label.decode('utf-8') if isinstance(label, bytes)
+                  else label for label in self.labels]
+        codes = numpy.frombuffer(self.codes, dtype=numpy.intc)\
+            .astype(numpy.int32)
+        if self.packed:
+            codes = numpy.concatenate([codes] + self.packed)
+        return codes, labels
+
+
+class Columns(object):
+    """Result rows held as whole columns.
+
+    numbers maps column names to float64 arrays, NaN for missing values;
+    strings maps them to (int32 codes, labels), the value of row i being
+    labels[codes[i]].
+    """
+
+    def __init__(self, numbers, strings, size):
+        """Doc string."""
+        self.numbers = numbers
+        self.strings = strings
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, column):
+        return column in self.numbers or column in self.strings
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Stack the rows of several Columns.
+
+        Columns missing from a part read NaN, or MISSING_LABEL, there.
+        """
+        _require_numpy()
+        numbers, strings = {}, {}
+        size = sum(len(part) for part in parts)
+        for name in set().union(*[part.numbers for part in parts]):
+            numbers[name] = numpy.concatenate([
+                part.numbers[name] if name in part.numbers
+                else numpy.full(len(part), numpy.nan) for part in parts])
+        for name in set().union(*[part.strings for part in parts]):
+            index, labels, pieces = {}, [], []
+            for part in parts:
+                codes, part_labels = part.strings.get(
+                    name, (numpy.zeros(len(part), numpy.int32),
+                           [MISSING_LABEL]))
+                # recode the labels of the part into the merged ones
+                mapping = numpy.empty(len(part_labels), numpy.int32)
+                for code, label in enumerate(part_labels):
+                    if label not in index:
+                        index[label] = len(labels)
+                        labels.append(label)
+                    mapping[code] = index[label]
+                pieces.append(mapping[codes])
+            strings[name] = (numpy.concatenate(pieces), labels)
+        return cls(numbers, strings, size)
+
+
+def _load_columnar(path, numbers, strings):
+    """Read a stdlib columnar file through a memory map."""
+    with open(path, 'rb') as col_file:
+        data = mmap.mmap(col_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        columns, blocks = iter_columnar(data)
+    except ValueError:
+        data.close()
+        raise ValueError("{0} is not a columnar results file".format(path))
+    pieces = {}
+    factors = {}
+    lengths = payload = None
+    size = 0
+    for nrows, chunks in blocks:
+        size += nrows
+        for column in columns:
+            chunk = chunks[column]
+            if chunk[0] == _NUMBER:
+                if numbers is None or column in numbers:
+                    pieces.setdefault(column, []).append(numpy.frombuffer(
+                        data, numpy.float64, nrows, chunk[1]))
+            elif column in strings:
+                factor = factors.setdefault(column, _Factorizer())
+                lengths = numpy.frombuffer(data, numpy.uintc, nrows,
+                                           chunk[1])
+                payload = numpy.frombuffer(
+                    data, numpy.uint8, int(lengths.sum(dtype=numpy.int64)),
+                    chunk[2])
+                factor.add_packed(payload, lengths)
+    # the one copy, out of the mapping, of the columns asked for
+    result = Columns(
+        dict((column, numpy.concatenate(chunks_of))
+             for column, chunks_of in pieces.items()),
+        dict((column, factor.result())
+             for column, factor in factors.items()), size)
+    # the views into the mapping must be gone before it is closed
+    del pieces, lengths, payload
+    data.close()
+    return result
+
+
+def _load_parquet(path, numbers, strings):
+    table = pyarrow.parquet.read_table(path)
+    result_numbers, result_strings = {}, {}
+    for column in table.column_names:
+        values = table.column(column)
+        if pyarrow.types.is_floating(values.type):
+            if numbers is None or column in numbers:
+                result_numbers[column] = values.to_numpy()
+        elif column in strings:
+            encoded = values.combine_chunks().dictionary_encode()
+            codes = encoded.indices.to_numpy(zero_copy_only=False)
+            labels = encoded.dictionary.to_pylist()
+            if encoded.null_count:
+                codes = numpy.where(encoded.is_null().to_numpy(
+                    zero_copy_only=False), len(labels), codes)
+                labels.append(MISSING_LABEL)
+            result_strings[column] = (codes.astype(numpy.int32), labels)
+    return Columns(result_numbers, result_strings, table.num_rows)
+
+
+def _load_rows(rows, header, numbers, strings):
+    """Columns of parsed CSV or JSON Lines rows (lists in header order)."""
+    wanted = [(i, name) for i, name in enumerate(header)
+              if name in strings or
+              (numbers is None or name in numbers)]
+    values = dict((name, array.array('d')) for _, name in wanted
+                  if name not in strings)
+    factors = dict((name, _Factorizer()) for _, name in wanted
+                   if name in strings)
+    size = 0
+    for row in rows:
+        size += 1
+        for i, name in wanted:
+            cell = row[i] if i < len(row) else None
+            if name in factors:
+                factors[name].add(MISSING_LABEL if cell is None
+                                  else u'{0}'.format(cell))
+            else:
+                values[name].append(_cell_float(cell))
+    return Columns(
+        dict((name, numpy.frombuffer(column, numpy.float64).copy())
+             for name, column in values.items()),
+        dict((name, factor.result()) for name, factor in factors.items()),
+        size)
+
+
+def _load_csv(path, numbers, strings):
+    if sys.version_info[0] < 3:
+        csv_file = open(path, 'rb')
+    else:
+        csv_file = open(path, 'r', newline='')
+    with csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, [])
+        return _load_rows(reader, header, numbers, strings)
+
+
+def _load_jsonl(path, numbers, strings):
+    with open(path) as jsonl_file:
+        first = jsonl_file.readline()
+        if not first.strip():
+            return Columns({}, {}, 0)
+        header = list(json.loads(first))
+
+        def rows():
+            yield [json.loads(first).get(name) for name in header]
+            for line in jsonl_file:
+                if line.strip():
+                    record = json.loads(line)
+                    yield [record.get(name) for name in header]
+        return _load_rows(rows(), header, numbers, strings)
+
+
+def load(path, numbers=None, strings=(DEFAULT_GROUP_BY,)):
+    """Load a results file (.cols, .parquet, .csv or .jsonl) as Columns.
+
+    numbers are the numeric columns to keep, None for all; strings the
+    text columns to keep, as codes.  Columns the file lacks are skipped.
+    """
+    _require_numpy()
+    strings = frozenset(strings)
+    if path.endswith('.cols'):
+        return _load_columnar(path, numbers, strings)
+    if path.endswith('.parquet'):
+        if pyarrow is None:
+            raise ImportError("reading {0} needs pyarrow".format(path))
+        return _load_parquet(path, numbers, strings)
+    if path.endswith('.jsonl'):
+        return _load_jsonl(path, numbers, strings)
+    return _load_csv(path, numbers, strings)
+
+
+def load_many(paths, numbers=None, strings=(DEFAULT_GROUP_BY,)):
+    """Load and stack several results files, see load()."""
+    return Columns.concatenate([load(path, numbers, strings)
+                                for path in paths])
+
+
+def derive_metrics(columns):
+    """Compute the metrics of calc_timers from raw records, whole columns.
+
+    Returns {metric: float64 array}.  A timestamp of 0, an event the page
+    never reached, gives NaN where calc_timers writes "N/A" or a negative
+    time; SSL Handshake is 0 without a TLS connection, as there.
+    """
+    _require_numpy()
+    missing = [field for field in TIMING_FIELDS
+               if field not in columns.numbers]
+    if missing:
+        raise ValueError("not raw timing records, {0} missing".format(
+            ", ".join(missing)))
+    raw = columns.numbers
+
+    def reached(field):
+        values = raw[field]
+        return numpy.where(values > 0, values, numpy.nan)
+
+    start = reached("navigationStart")
+    response = reached("responseStart")
+    load_end = reached("loadEventEnd")
+    return {
+        "DNS Resolution": raw["domainLookupEnd"] - raw["domainLookupStart"],
+        "TCP Connection": raw["connectEnd"] - raw["connectStart"],
+        "SSL Handshake": numpy.where(
+            raw["secureConnectionStart"] > 0,
+            raw["connectEnd"] - raw["secureConnectionStart"], 0.0),
+        "Backend Time": response - start,
+        "DOM Loading": reached("domLoading") - start,
+        "DOM Ready": reached("domComplete") - start,
+        "Frontend Time": load_end - response,
+        "Page Load": load_end - start,
+    }
+
+
+def metric_columns(columns, metrics=None):
+    """Return {metric: array} of a raw records or a results Columns."""
+    if "navigationStart" in columns.numbers:
+        values = derive_metrics(columns)
+    else:
+        values = columns.numbers
+    metrics = metrics or [metric for metric in derived_metrics
+                          if metric in values]
+    unknown = [metric for metric in metrics if metric not in values]
+    if unknown:
+        raise ValueError("no {0} column in the results".format(
+            ", ".join(unknown)))
+    return dict((metric, values[metric]) for metric in metrics)
+
+
+def _sorted_groups(codes, values, groups):
+    """Drop the NaNs and sort the values by (group, value).
+
+    Returns the sorted values with the count and start index of every
+    group in them.
+    """
+    valid = ~numpy.isnan(values)
+    codes, values = codes[valid], values[valid]
+    order = numpy.lexsort((values, codes))
+    counts = numpy.bincount(codes, minlength=groups)
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    return values[order], counts, starts
+
+
+def group_summary(codes, labels, values, metric,
+                  quantiles=SUMMARY_QUANTILES, group_by=DEFAULT_GROUP_BY):
+    """Return the summary rows of one metric, one per group.
+
+    The rows have the summary_columns, the group label under group_by
+    rather than url.  Groups without a value are left out; quantiles
+    interpolate linearly between the closest ranks.
+    """
+    _require_numpy()
+    groups = len(labels)
+    ordered, counts, starts = _sorted_groups(codes, values, groups)
+    codes = numpy.repeat(numpy.arange(groups), counts)
+    present = counts > 0
+    safe = numpy.maximum(counts, 1)
+    means = numpy.bincount(codes, weights=ordered, minlength=groups) / safe
+    # two passes, the squared deviations from each group's mean
+    deviations = ordered - numpy.repeat(means, counts)
+    m2 = numpy.bincount(codes, weights=deviations * deviations,
+                        minlength=groups)
+    stddevs = numpy.sqrt(numpy.where(counts > 1,
+                                     m2 / numpy.maximum(safe - 1, 1), 0.0))
+    lasts = starts + safe - 1
+
+    columns = {"count": counts, "mean": numpy.round(means, 1),
+               "stddev": numpy.round(stddevs, 1)}
+    if len(ordered):
+        columns["min"] = ordered[numpy.minimum(starts, len(ordered) - 1)]
+        columns["max"] = ordered[numpy.minimum(lasts, len(ordered) - 1)]
+        for q in quantiles:
+            rank = starts + (counts - 1).clip(0) * (q / 100.0)
+            low = numpy.floor(rank).astype(numpy.int64)
+            high = numpy.minimum(low + 1, lasts)
+            low = numpy.minimum(low, len(ordered) - 1)
+            high = numpy.minimum(high, len(ordered) - 1)
+            columns["p{0}".format(q)] = numpy.round(
+                ordered[low] + (ordered[high] - ordered[low]) *
+                (rank - low), 1)
+
+    rows = []
+    for group in numpy.flatnonzero(present).tolist():
+        row = {group_by: labels[group], "metric": metric}
+        for name, column in columns.items():
+            row[name] = column[group].item()
+        rows.append(row)
+    return rows
+
+
+def group_histogram(codes, labels, values, bounds=MS_BUCKETS):
+    """Count the values of each group in buckets.
+
+    Bucket i holds the values up to bounds[i], past the previous bound;
+    the last one the values above bounds[-1].  Returns a
+    (len(labels), len(bounds) + 1) array, NaNs are not counted.
+    """
+    _require_numpy()
+    valid = ~numpy.isnan(values)
+    buckets = numpy.searchsorted(numpy.asarray(bounds, numpy.float64),
+                                 values[valid], side='left')
+    width = len(bounds) + 1
+    flat = codes[valid].astype(numpy.int64) * width + buckets
+    return numpy.bincount(flat, minlength=len(labels) * width)\
+        .reshape(len(labels), width)
+
+
+def format_histogram(labels, counts, metric, bounds=MS_BUCKETS):
+    """Return group_histogram counts as a printable table."""
+    titles = ["<={0}".format(bound) for bound in bounds] + \
+        [">{0}".format(bounds[-1])]
+    header = "| {0:30.25} | ".format(metric) + \
+        " | ".join("{0:>7}".format(title) for title in titles) + " |"
+    line = "=" * len(header)
+    lines = [line, header, line]
+    for group in numpy.flatnonzero(counts.sum(axis=1)).tolist():
+        lines.append("| {0:30.25} | ".format(labels[group]) + " | ".join(
+            "{0:7d}".format(count) for count in counts[group].tolist()) +
+            " |")
+    lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+
+    parser = OptionParser(
+        usage="Usage: %prog [--metric=<name>] [--group-by=<column>] "
+              "[--histogram] [--output=<file>] <results files>")
+    parser.add_option("--metric",
+                      dest="metrics",
+                      action='append',
+                      help="metric to analyse, repeatable, default those "
+                           "of calc_timers")
+    parser.add_option("--group-by",
+                      dest="group_by",
+                      help="text column to group the rows by, e.g. View",
+                      default=DEFAULT_GROUP_BY)
+    parser.add_option("--histogram",
+                      dest="histogram",
+                      action='store_true',
+                      help="also print the per-group histograms",
+                      default=False)
+    parser.add_option("--output",
+                      dest="output",
+                      help="write the summary rows to this file")
+    parser.add_option("--output-format",
+                      dest="output_format",
+                      choices=list(FORMATS),
+                      help="format of --output: csv, jsonl or columnar",
+                      default='csv')
+
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('no results file given')
+
+    wanted = set(TIMING_FIELDS) | set(options.metrics or derived_metrics)
+    try:
+        columns = load_many(args, wanted, [options.group_by])
+        metrics = metric_columns(columns, options.metrics)
+    except (IOError, ValueError, ImportError) as e:
+        print("Cannot analyse the results: {0}".format(e))
+        sys.exit(2)
+    if options.group_by not in columns.strings:
+        parser.error('no {0} column in the results'.format(options.group_by))
+    codes, labels = columns.strings[options.group_by]
+
+    order = options.metrics or [metric for metric in derived_metrics
+                                if metric in metrics]
+    rows = []
+    for metric in order:
+        rows.extend(group_summary(codes, labels, metrics[metric], metric,
+                                  group_by=options.group_by))
+    position = dict((label, i) for i, label in enumerate(labels))
+    rows.sort(key=lambda row: (position[row[options.group_by]],
+                               order.index(row["metric"])))
+    print("{0} rows from {1} files".format(len(columns), len(args)))
+    print(format_summary(rows, group_by=options.group_by))
+    if options.histogram:
+        for metric in order:
+            print(format_histogram(
+                labels, group_histogram(codes, labels, metrics[metric]),
+                metric))
+
+    if options.output:
+        text_columns = TEXT_COLUMNS | frozenset([options.group_by])
+        with ResultSink(options.output,
+                        [options.group_by] + summary_columns[1:],
+                        options.output_format,
+                        text_columns=text_columns) as sink:
+            for row in rows:
+                sink.write(row)
+
+    sys.exit(0)
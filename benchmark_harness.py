@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+"""Benchmark of the load test harness against the local fixture server."""
+#################################################
+#
+# Description:  Run the PerfTimings of chrome_loadtest.py or ff_loadtest.py
+#               in every execution mode against fixture pages with known
+#               delays, and report the throughput (loads per minute), the
+#               harness overhead and the error of the measured timings
+#               against the injected delays.  Given the report of an
+#               earlier run as a baseline, exit non-zero when a mode got
+#               slower, so regressions of the tool itself are caught.
+#
+#   benchmark_harness.py --browser=chrome --output=bench.json
+#   benchmark_harness.py --browser=chrome --baseline=bench.json
+#################################################
+import contextlib
+import csv
+import functools
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from optparse import OptionParser
+
+from adaptive_sampling import AdaptiveScheduler
+from distributed import Coordinator, run_agents
+from fixture_server import FixtureServer, FixturePage
+from harness_timers import monotonic
+from network_shaping import ShapingProxy, parse_profile
+from parallel_runner import ParallelRunner
+from replay_server import ReplayServer
+from streaming_stats import MetricStats
+
+LOADTESTS = {'chrome': 'chrome_loadtest', 'firefox': 'ff_loadtest'}
+EXECUTION_MODES = ["sequential", "push", "pool", "fast-startup", "threads",
+                   "processes", "adaptive", "repeat-view", "vitals",
+                   "replay", "shaping", "distributed"]
+# the browser of these modes does not see the delays of the fixture pages
+UNTIMED_MODES = ("replay", "shaping")
+REPEAT_VIEWS = 1
+DEFAULT_NETWORK = "cable"
+benchmark_columns = ["Mode", "Loads", "Failures", "Loads/min",
+                     "Overhead p50", "Overhead p90", "Backend Error",
+                     "Page Load Error", "Page Load Error p90"]
+DEFAULT_TOLERANCE = 0.10
+# overhead changes below this many ms are noise
+OVERHEAD_SLACK = 2
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Send what the harness prints to /dev/null."""
+    if not enabled:
+        yield
+        return
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+@contextlib.contextmanager
+def tool_params(loadtest, **params):
+    """Set ToolParams of loadtest for the duration of the block."""
+    saved = dict((name, loadtest.ToolParams[name]) for name in params)
+    loadtest.ToolParams.update(params)
+    try:
+        yield
+    finally:
+        loadtest.ToolParams.update(saved)
+
+
+def proxy_params(loadtest, server):
+    """Return the ToolParams sending all browser traffic through server.
+
+    server is a ReplayServer or a ShapingProxy.  Loopback traffic, that
+    of the fixture server, goes through it too.
+    """
+    if 'extra_prefs' in loadtest.ToolParams:
+        prefs = dict(loadtest.ToolParams['extra_prefs'])
+        prefs.update(server.firefox_prefs())
+        return {'extra_prefs': prefs, 'accept_insecure_certs': True}
+    # Chrome replays through host resolver rules, which only cover the
+    # default ports, so both replay modes use the forward proxy here
+    return {'extra_args': loadtest.ToolParams['extra_args'] + [
+        "--proxy-server=" + server.proxy_address,
+        "--proxy-bypass-list=<-loopback>", "--ignore-certificate-errors"]}
+
+
+@contextlib.contextmanager
+def mode_proxy(loadtest, mode, urls, network):
+    """Start the proxy the browsers of mode go through, yield its params.
+
+    The replay mode first records one load of every URL into a scratch
+    archive, unmeasured, and then replays it.  Other modes than replay
+    and shaping yield no params.
+    """
+    if mode == "shaping":
+        server = ShapingProxy(parse_profile(network)).start()
+    elif mode == "replay":
+        archive = tempfile.mkdtemp(prefix='replay-', dir=os.getcwd())
+        with ReplayServer(archive, 'record') as recorder:
+            with tool_params(loadtest, **proxy_params(loadtest, recorder)):
+                pt = loadtest.new_perf_timings()
+                try:
+                    pt.run(urls, 1, True)
+                finally:
+                    pt.close()
+        server = ReplayServer(archive).start()
+    else:
+        yield {}
+        return
+    try:
+        yield proxy_params(loadtest, server)
+    finally:
+        server.stop()
+
+
+def run_mode(loadtest, mode, urls, iterations, workers,
+             network=DEFAULT_NETWORK):
+    """Run the harness over urls in one execution mode.
+
+    Returns the rows of the results file and the wall time of the run in
+    seconds.  Must run in a scratch directory, the results file is
+    written to the current one.  network is the profile of the shaping
+    mode.
+    """
+    kwargs = {}
+    if mode == "push":
+        kwargs['completion'] = 'push'
+    elif mode == "repeat-view":
+        kwargs['repeat_views'] = REPEAT_VIEWS
+    elif mode == "vitals":
+        kwargs['web_vitals'] = True
+    elif mode == "shaping":
+        kwargs['network'] = str(parse_profile(network))
+    factory = functools.partial(loadtest.new_perf_timings, mode == "pool",
+                                **kwargs)
+    runner = None
+    if mode in ("threads", "processes"):
+        runner = ParallelRunner(factory, workers,
+                                'thread' if mode == "threads" else 'process')
+    scheduler = None
+    if mode == "adaptive":
+        # never converges, so every URL gets exactly iterations loads
+        scheduler = AdaptiveScheduler(urls, "Page Load", 0.0, iterations,
+                                      iterations)
+    fast = mode == "fast-startup"
+    params = {'headless': fast, 'lean': fast}
+    if 'web_vitals' in loadtest.ToolParams:
+        # Chrome installs the observers when it opens a tab
+        params['web_vitals'] = mode == "vitals"
+
+    with mode_proxy(loadtest, mode, urls, network) as proxy:
+        params.update(proxy)
+        with tool_params(loadtest, **params):
+            agents = None
+            if mode == "distributed":
+                # local agents, started once the coordinator has the work
+                runner = Coordinator("127.0.0.1:0").start()
+                agents = threading.Thread(target=run_agents, args=(
+                    "127.0.0.1:{0}".format(runner.port), factory,
+                    workers))
+                agents.daemon = True
+                agents.start()
+            pt = factory()
+            started = monotonic()
+            try:
+                pt.run(urls, iterations, True, runner, scheduler)
+                elapsed = monotonic() - started
+            finally:
+                pt.close()
+                if agents is not None:
+                    agents.join()
+    with open(pt.output_prefix + '.csv') as results:
+        rows = list(csv.DictReader(results))
+    return rows, elapsed
+
+
+def expected_loads(mode, urls, iterations):
+    """Return the number of result rows a run of mode should produce."""
+    views = 1 + REPEAT_VIEWS if mode == "repeat-view" else 1
+    return len(urls) * iterations * views
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def summarize(mode, rows, elapsed, pages, loads):
+    """Return the report row of one mode.
+
+    pages maps every URL to its FixturePage, loads is the number of loads
+    that were asked for.  Errors are the measured minus the injected
+    timings, in ms, of the first views; they are N/A for the modes whose
+    browser does not see the injected delays.
+    """
+    overhead, backend, page_load, page_load_abs = \
+        MetricStats(), MetricStats(), MetricStats(), MetricStats()
+    for row in rows:
+        page = pages[row["url"]]
+        value = _number(row.get("Harness Overhead"))
+        if value is not None:
+            overhead.add(value)
+        if mode in UNTIMED_MODES or _number(row.get("Repeat")):
+            continue
+        value = _number(row.get("Backend Time"))
+        if value is not None:
+            backend.add(value - page.expected_backend())
+        value = _number(row.get("Page Load"))
+        if value is not None and value > 0:
+            error = value - page.expected_page_load()
+            page_load.add(error)
+            page_load_abs.add(abs(error))
+
+    def rounded(value, count):
+        return round(value, 1) if count else "N/A"
+    return {"Mode": mode, "Loads": len(rows),
+            "Failures": loads - len(rows),
+            "Loads/min": round(60.0 * len(rows) / elapsed, 1)
+            if elapsed else "N/A",
+            "Overhead p50": rounded(overhead.quantile(50), overhead.count),
+            "Overhead p90": rounded(overhead.quantile(90), overhead.count),
+            "Backend Error": rounded(backend.mean, backend.count),
+            "Page Load Error": rounded(page_load.mean, page_load.count),
+            "Page Load Error p90": rounded(page_load_abs.quantile(90),
+                                           page_load_abs.count)}
+
+
+def compare_reports(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return the regressions of current against baseline as strings.
+
+    A mode regressed when its throughput fell, or its median overhead
+    grew, by more than tolerance (relative).
+    """
+    regressions = []
+    previous = dict((row["Mode"], row) for row in baseline)
+    for row in current:
+        old = previous.get(row["Mode"])
+        if old is None:
+            continue
+        new_rate, old_rate = _number(row["Loads/min"]), \
+            _number(old["Loads/min"])
+        if new_rate is not None and old_rate and \
+                new_rate < old_rate * (1 - tolerance):
+            regressions.append("{0}: throughput {1} < {2} loads/min".format(
+                row["Mode"], new_rate, old_rate))
+        new_cost, old_cost = _number(row["Overhead p50"]), \
+            _number(old["Overhead p50"])
+        if new_cost is not None and old_cost is not None and \
+                new_cost > old_cost + abs(old_cost) * tolerance + \
+                OVERHEAD_SLACK:
+            regressions.append("{0}: overhead {1} > {2} ms".format(
+                row["Mode"], new_cost, old_cost))
+    return regressions
+
+
+_LINE = "{0:13} | {1:>5} | {2:>8} | {3:>9} | {4:>12} | {5:>12} " \
+    "| {6:>13} | {7:>15} | {8:>19}"
+
+
+def format_header():
+    """Return the header lines of the report table."""
+    header = _LINE.format(*benchmark_columns)
+    return header + "\n" + "-" * len(header)
+
+
+def format_row(row):
+    """Return one report row as a table line."""
+    return _LINE.format(*[row[column] for column in benchmark_columns])
+
+
+if __name__ == "__main__":
+
+    parser = OptionParser(
+        usage="Usage: %prog [--browser=chrome|firefox] [--mode=<mode>] "
+              "[--output=<report.json>] [--baseline=<report.json>]")
+    parser.add_option("--browser",
+                      dest="browser",
+                      choices=list(LOADTESTS),
+                      help="chrome or firefox",
+                      default='chrome')
+    parser.add_option("--mode",
+                      dest="modes",
+                      action='append',
+                      choices=EXECUTION_MODES,
+                      help="execution mode to benchmark, repeatable, "
+                           "default all of them")
+    parser.add_option("-n", "--iterations",
+                      dest="iterations",
+                      help="loads of every fixture page per mode",
+                      default='3')
+    parser.add_option("--pages",
+                      dest="pages",
+                      help="number of distinct fixture pages",
+                      default='4')
+    parser.add_option("-w", "--workers",
+                      dest="workers",
+                      help="workers of the threads, processes and "
+                           "distributed modes",
+                      default='2')
+    parser.add_option("--network",
+                      dest="network",
+                      help="network profile of the shaping mode, default "
+                           "%default",
+                      default=DEFAULT_NETWORK)
+    parser.add_option("--ttfb",
+                      dest="ttfb",
+                      help="time to first byte of the pages in ms",
+                      default='100')
+    parser.add_option("--size",
+                      dest="size",
+                      help="HTML size of the pages in bytes",
+                      default='20000')
+    parser.add_option("--resources",
+                      dest="resources",
+                      help="sub-resources per page",
+                      default='4')
+    parser.add_option("--res-ttfb",
+                      dest="res_ttfb",
+                      help="time to first byte of the sub-resources in ms",
+                      default='20')
+    parser.add_option("--redirects",
+                      dest="redirects",
+                      help="redirects in front of every page",
+                      default='1')
+    parser.add_option("--https",
+                      dest="https",
+                      action='store_true',
+                      help="also serve every page over HTTPS",
+                      default=False)
+    parser.add_option("--output",
+                      dest="output",
+                      help="write the report to this JSON file")
+    parser.add_option("--baseline",
+                      dest="baseline",
+                      help="JSON report of an earlier run to compare with")
+    parser.add_option("--tolerance",
+                      dest="tolerance",
+                      help="relative slowdown tolerated against the "
+                           "baseline",
+                      default=str(DEFAULT_TOLERANCE))
+    parser.add_option("-v", "--verbose",
+                      dest="verbose",
+                      action='store_true',
+                      help="keep the output of the harness",
+                      default=False)
+
+    (options, args) = parser.parse_args()
+
+    try:
+        parse_profile(options.network)
+    except ValueError as e:
+        parser.error(str(e))
+
+    loadtest = importlib.import_module(LOADTESTS[options.browser])
+    if options.https:
+        if options.browser == 'chrome':
+            loadtest.ToolParams['extra_args'].append(
+                "--ignore-certificate-errors")
+        else:
+            loadtest.ToolParams['accept_insecure_certs'] = True
+
+    page = FixturePage(int(options.ttfb), int(options.size),
+                       int(options.resources), int(options.res_ttfb),
+                       redirects=int(options.redirects))
+    iterations = int(options.iterations)
+    scratch = tempfile.mkdtemp(prefix='plt-harness-')
+    cwd = os.getcwd()
+    report = []
+    with FixtureServer(https=options.https) as server:
+        pages = {}
+        for page_id in range(int(options.pages)):
+            pages[server.url(page, page_id)] = page
+            if options.https:
+                pages[server.url(page, page_id, https=True)] = page
+        urls = sorted(pages)
+        os.chdir(scratch)
+        print(format_header())
+        try:
+            for mode in options.modes or EXECUTION_MODES:
+                with quiet(not options.verbose):
+                    rows, elapsed = run_mode(loadtest, mode, urls,
+                                             iterations,
+                                             int(options.workers),
+                                             options.network)
+                report.append(summarize(
+                    mode, rows, elapsed, pages,
+                    expected_loads(mode, urls, iterations)))
+                print(format_row(report[-1]))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({"browser": options.browser,
+                       "fixture": dict(page.__dict__, pages=len(urls)),
+                       "modes": report}, output, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            regressions = compare_reports(report, json.load(baseline)["modes"],
+                                          float(options.tolerance))
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        sys.exit(1 if regressions else 0)
+
+    sys.exit(0)
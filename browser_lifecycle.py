@@ -0,0 +1,216 @@
+"""Browser process lifecycle manager with a watchdog and leak protection."""
+#################################################
+#
+# Description:  Track the processes of every WebDriver session, always
+#               tear sessions down (quit, then kill whatever survived),
+#               kill loads that hang past their timeout and sessions
+#               going over their memory or CPU time limit.
+#################################################
+import contextlib
+import threading
+
+import proctree
+from harness_timers import monotonic
+
+WATCHDOG_GRACE = 10
+WATCHDOG_INTERVAL = 1.0
+QUIT_TIMEOUT = 30
+
+
+class _TrackedSession(object):
+    """Processes seen for one driver and its watchdog state."""
+
+    def __init__(self, driver):
+        """Doc string."""
+        self.driver = driver
+        self.pid = proctree.driver_pid(driver)
+        # pid -> identity, so a recycled pid is never killed
+        self.processes = {}
+        self.deadline = None
+        self.kill_reason = None
+        self.refresh()
+        self.base_cpu = self.cpu_time()
+
+    def refresh(self):
+        """Remember every process currently below the driver."""
+        if not self.pid:
+            return
+        for pid in [self.pid] + proctree.descendants(self.pid):
+            if pid not in self.processes:
+                identity = proctree.process_identity(pid)
+                if identity is not None:
+                    self.processes[pid] = identity
+
+    def alive(self, browser_only=False):
+        """Return the remembered pids that still run as the same process."""
+        return [pid for pid, identity in self.processes.items()
+                if not (browser_only and pid == self.pid) and
+                proctree.process_identity(pid) == identity and
+                proctree.is_running(pid)]
+
+    def rss(self):
+        return sum(proctree.process_rss(pid) for pid in self.alive())
+
+    def cpu_time(self):
+        return sum(proctree.process_cpu_time(pid) for pid in self.alive())
+
+
+class BrowserLifecycle(object):
+    """Owns the teardown of WebDriver sessions.
+
+    track() registers a freshly launched driver, watch() arms the watchdog
+    around a step that must finish in time and teardown() quits a driver
+    then kills every process of its tree that outlived the quit.  The
+    watchdog kills the browser processes (not the driver server) so the
+    pending WebDriver command fails with a WebDriverException.
+
+    memory_limit_mb and cpu_limit (seconds) are per session; 0 disables.
+    on_teardown(driver) is called once a driver's processes are gone,
+    e.g. to remove its profile directory.
+
+    Processes can only be tracked with psutil or /proc: without them the
+    limits raise ValueError and the report leaves the leak and watchdog
+    counters out rather than showing zeros.
+    """
+
+    def __init__(self, memory_limit_mb=0, cpu_limit=0, grace=WATCHDOG_GRACE,
+                 interval=WATCHDOG_INTERVAL, quit_timeout=QUIT_TIMEOUT,
+                 on_teardown=None):
+        """Doc string."""
+        self.tracking = proctree.tracking_available()
+        if not self.tracking and (memory_limit_mb or cpu_limit):
+            raise ValueError("memory and CPU limits need psutil on a "
+                             "system without /proc")
+        self.on_teardown = on_teardown
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        self.cpu_limit = cpu_limit
+        self.grace = grace
+        self.interval = interval
+        self.quit_timeout = quit_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'sessions': 0, 'leaked': 0, 'reclaimed': 0,
+                      'watchdog_kills': 0, 'limit_kills': 0,
+                      'quit_timeouts': 0}
+
+    def track(self, driver):
+        """Register a new driver, return it."""
+        session = _TrackedSession(driver)
+        with self._lock:
+            self._sessions[id(driver)] = session
+            self.stats['sessions'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watchdog)
+                self._thread.daemon = True
+                self._thread.start()
+        return driver
+
+    @contextlib.contextmanager
+    def watch(self, driver, seconds):
+        """Kill the browser if the block runs past seconds plus the grace."""
+        session = self._session(driver)
+        if session is not None:
+            session.deadline = monotonic() + seconds + self.grace
+        try:
+            yield
+        finally:
+            if session is not None:
+                session.deadline = None
+
+    def kill_reason(self, driver):
+        """Return why the watchdog killed a driver's browser, or None."""
+        session = self._session(driver)
+        return session.kill_reason if session is not None else None
+
+    def teardown(self, driver):
+        """Quit a driver and kill whatever is left of its process tree."""
+        with self._lock:
+            session = self._sessions.pop(id(driver), None)
+        if session is not None:
+            session.refresh()
+
+        # a hung browser can block quit() forever, give it a bounded time
+        quitter = threading.Thread(target=_quiet_quit, args=(driver,))
+        quitter.daemon = True
+        quitter.start()
+        quitter.join(self.quit_timeout)
+        if quitter.is_alive():
+            self._add('quit_timeouts', 1)
+
+        if session is not None:
+            leaked = session.alive()
+            if leaked:
+                reclaimed = sum(proctree.process_rss(pid) for pid in leaked)
+                proctree.kill_processes(leaked)
+                self._add('leaked', len(leaked))
+                self._add('reclaimed', reclaimed)
+        if self.on_teardown is not None:
+            self.on_teardown(driver)
+
+    def close(self):
+        """Stop the watchdog and tear down the drivers still tracked."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval * 2)
+        with self._lock:
+            drivers = [s.driver for s in self._sessions.values()]
+        for driver in drivers:
+            self.teardown(driver)
+
+    def _session(self, driver):
+        with self._lock:
+            return self._sessions.get(id(driver))
+
+    def _kill(self, session, reason, counter):
+        session.kill_reason = reason
+        session.deadline = None
+        proctree.kill_processes(session.alive(browser_only=True))
+        self._add(counter, 1)
+
+    def _watchdog(self):
+        """Check deadlines and resource limits every interval."""
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                sessions = list(self._sessions.values())
+            for session in sessions:
+                if session.kill_reason:
+                    continue
+                session.refresh()
+                deadline = session.deadline
+                if deadline is not None and monotonic() > deadline:
+                    self._kill(session, "hung load", 'watchdog_kills')
+                elif self.memory_limit and \
+                        session.rss() > self.memory_limit:
+                    self._kill(session, "memory limit", 'limit_kills')
+                elif self.cpu_limit and \
+                        session.cpu_time() - session.base_cpu > \
+                        self.cpu_limit:
+                    self._kill(session, "CPU time limit", 'limit_kills')
+
+    def _add(self, key, value):
+        with self._lock:
+            self.stats[key] += value
+
+    def format_report(self):
+        """Return the leak and watchdog counters as a printable line."""
+        stats = dict(self.stats)
+        if not self.tracking:
+            return ("Browser lifecycle: {sessions} sessions, "
+                    "{quit_timeouts} quit timeouts, leaked processes and "
+                    "watchdog kills unavailable (no psutil or /proc)"
+                    ).format(**stats)
+        stats['reclaimed_mb'] = stats['reclaimed'] / (1024.0 * 1024.0)
+        return ("Browser lifecycle: {sessions} sessions, {leaked} leaked "
+                "processes killed, {reclaimed_mb:.1f} MB reclaimed, "
+                "{watchdog_kills} watchdog kills, {limit_kills} limit kills, "
+                "{quit_timeouts} quit timeouts").format(**stats)
+
+
+def _quiet_quit(driver):
+    """Quit a driver, ignoring errors from an already dead browser."""
+    try:
+        driver.quit()
+    except Exception:
+        pass
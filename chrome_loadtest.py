@@ -4,11 +4,16 @@
 #
 # Description:  Run Chrome performance tests using the Navigation API
 #################################################
-import sys
 import os
+import sys
 import time
-import csv
-import random
+import shutil
+import tempfile
+import functools
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
 from optparse import OptionParser
 
 
@@ -17,65 +22,362 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.common.exceptions import WebDriverException, TimeoutException
 
+from browser_lifecycle import BrowserLifecycle, WATCHDOG_GRACE
+from driver_pool import DriverPool, DEFAULT_MAX_LOADS, \
+    DEFAULT_MAX_RSS_GROWTH_MB
+from result_sink import ResultSink, FORMATS, FSYNC_POLICIES, \
+    file_extension
+from parallel_runner import ParallelRunner, check_capacity, \
+    default_workers, host_load_columns
+from distributed import Coordinator, run_agents, parse_address, \
+    LEASE_SECONDS
+from harness_timers import PhaseTimer, PhaseProfile, phase_columns, \
+    monotonic, profiled
+from streaming_stats import ResultAggregator, summary_columns
+from adaptive_sampling import AdaptiveScheduler
+from results_db import ResultsDB
+from metrics_export import MetricsExporter
+from url_source import UrlSource, Checkpoint, parse_shard, \
+    DEFAULT_SHUFFLE_CHUNK
+from replay_server import ReplayServer
+from network_shaping import ShapingProxy, parse_profile, NETWORK_COLUMN
+from fast_startup import ProfileTemplate, CLONE_METHODS, CHROME_LEAN_ARGS, \
+    benchmark_startup, format_startup_benchmark
+from resource_timing import ResourceTimingStore, NAVIGATION_FIELDS, \
+    RESOURCE_FIELDS, RESOURCE_TIMING_KEY, RAW_TIMING_KEY, TIMING_FIELDS, \
+    raw_timing_columns
+from page_scripts import LOAD_COMPLETE_SCRIPT, NAVIGATION_TIMING_SCRIPT, \
+    READY_STATE_SCRIPT, RESOURCE_TIMING_SCRIPT, CACHE_STATS_SCRIPT, \
+    VITALS_OBSERVER_SCRIPT, VITALS_COLLECT_SCRIPT
+from web_vitals import vitals_columns, vitals_values, \
+    DEFAULT_VITALS_WINDOW, DEFAULT_VITALS_QUIET
+from resource_usage import UsageSampler, usage_columns, \
+    DEFAULT_USAGE_INTERVAL
+from proctree import driver_pid, tracking_available
+
 PAGE_WAIT_TIMEOUT = 15
+PAGE_LOAD_TIMEOUT = 60
 _FileName = "chrome_loadtest.py"
 csv_columns = ["url", "run", "DNS Resolution", "TCP Connection",
                "SSL Handshake", "Backend Time", "DOM Loading",
                "DOM Ready", "Frontend Time", "Page Load"]
+harness_columns = ["WebDriver Commands", "Harness Overhead"]
+FIRST_VIEW = "first-view"
+REPEAT_VIEW = "repeat-view"
+cache_columns = ["View", "Repeat", "Cache Hits %", "Revalidated %",
+                 "Cache Bytes %"]
 
 ToolParams = {
     'incognito_opt': '--incognito',
     'headless_opt': '--headless',
-    'nogpu_opt': '--disable_gpu',
+    'nogpu_opt': '--disable-gpu',
     'perf_timings_out_file': '/tmp/perf_timings.out',
-    'error_out_file': '/tmp/perf_timings.error'
+    'error_out_file': '/tmp/perf_timings.error',
+    'extra_args': [],
+    'web_vitals': False,
+    'network_conditions': None,
+    'headless': False,
+    'lean': False,
+    'profile_template': None
 }
 
 
+def start_browser(profile_dir=None):
+    """Start a Chrome WebDriver session.
+
+    The session runs on profile_dir if given, else on a clone of the
+    profile template if one is set, else on a profile of its own.
+    """
+    chrome_options = Options()
+
+    # add option to start Chrome in Incognito mode
+    # comment this line if you want to test normal Chrome mode
+    chrome_options.add_argument("--incognito")
+
+    # fast startup: no window, no GPU process, no background services
+    if ToolParams['headless']:
+        chrome_options.add_argument(ToolParams['headless_opt'])
+        chrome_options.add_argument(ToolParams['nogpu_opt'])
+    if ToolParams['lean']:
+        for arg in CHROME_LEAN_ARGS:
+            chrome_options.add_argument(arg)
+
+    template = ToolParams['profile_template']
+    if profile_dir is None and template is not None:
+        profile_dir = template.clone()
+    else:
+        template = None
+    if profile_dir:
+        chrome_options.add_argument("--user-data-dir=" + profile_dir)
+
+    # e.g. route the traffic to the record/replay server
+    for arg in ToolParams['extra_args']:
+        chrome_options.add_argument(arg)
+
+    try:
+        driver = webdriver.Chrome(chrome_options=chrome_options)
+    except Exception:
+        if template is not None:
+            template.discard(profile_dir)
+        raise
+    if template is not None:
+        template.attach(driver, profile_dir)
+    prepare_tab(driver)
+    return driver
+
+
+def prepare_tab(driver):
+    """Apply the DevTools settings of the run to the current tab."""
+    if ToolParams['network_conditions']:
+        # DevTools throttling of the network profile
+        driver.set_network_conditions(**ToolParams['network_conditions'])
+    if ToolParams['web_vitals']:
+        # runs before any page script of every document of the tab
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument",
+                               {"source": VITALS_OBSERVER_SCRIPT})
+
+
+def set_timeouts(driver):
+    """Set the page load and script timeouts used by the measurements."""
+    # set page load time out to 60 seconds
+    driver.set_script_timeout(PAGE_WAIT_TIMEOUT)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+
+
+def launch_driver():
+    """Start a Chrome WebDriver session set up for the measurements."""
+    driver = start_browser()
+    set_timeouts(driver)
+    return driver
+
+
+def build_profile(path):
+    """Let Chrome lay out a new profile in path, for a profile template."""
+    driver = start_browser(profile_dir=path)
+    try:
+        driver.get("about:blank")
+    finally:
+        driver.quit()
+
+
+def release_profile(driver):
+    """Remove the template profile clone of a torn down driver."""
+    if ToolParams['profile_template'] is not None:
+        ToolParams['profile_template'].release(driver)
+
+
+def _page_origins(driver):
+    """Return the origins of the current page and of its resources."""
+    try:
+        urls = driver.execute_script(
+            "return [location.href].concat(performance"
+            ".getEntriesByType('resource').map(function (e) {"
+            " return e.name; }));") or []
+    except WebDriverException:
+        urls = [driver.current_url]
+    origins = set()
+    for url in urls:
+        parts = urlparse(url)
+        if parts.scheme in ("http", "https"):
+            origins.add("{0}://{1}".format(parts.scheme, parts.netloc))
+    return origins
+
+
+def _open_context_tab(driver):
+    """Open an about:blank tab in a new browser context.
+
+    Returns (context id, window handle), or None when the browser or the
+    driver cannot do it.
+    """
+    before = set(driver.window_handles)
+    try:
+        context = driver.execute_cdp_cmd(
+            "Target.createBrowserContext", {})["browserContextId"]
+    except (WebDriverException, KeyError):
+        return None
+    try:
+        target = driver.execute_cdp_cmd(
+            "Target.createTarget", {"url": "about:blank",
+                                    "browserContextId": context})["targetId"]
+        # ChromeDriver window handles are (or end with) the target id
+        handles = [h for h in driver.window_handles if h not in before]
+        handle = [h for h in handles if h.endswith(target)] or handles
+        driver.switch_to.window(handle[0])
+    except (WebDriverException, KeyError, IndexError):
+        driver.execute_cdp_cmd("Target.disposeBrowserContext",
+                               {"browserContextId": context})
+        return None
+    return context, handle[0]
+
+
+def reset_driver(driver):
+    """Bring a pooled Chrome session back to a clean incognito state.
+
+    Every load gets an about:blank tab in a new browser context, with its
+    own cache, cookies and storage like a new incognito window, and the
+    context of the previous load is disposed of.  When no context can be
+    created, the HTTP cache, every cookie and the storage of every origin
+    the previous page used are cleared instead.
+    """
+    previous = getattr(driver, "browser_context_id", None)
+    opened = _open_context_tab(driver)
+    origins = _page_origins(driver) if opened is None else ()
+    keep = opened[1] if opened else driver.window_handles[0]
+    for handle in driver.window_handles:
+        if handle != keep:
+            driver.switch_to.window(handle)
+            driver.close()
+    driver.switch_to.window(keep)
+
+    if opened:
+        if previous:
+            driver.execute_cdp_cmd("Target.disposeBrowserContext",
+                                   {"browserContextId": previous})
+        driver.browser_context_id = opened[0]
+        prepare_tab(driver)
+        return
+
+    driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    for origin in origins:
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+            "origin": origin, "storageTypes": "all"})
+    driver.get("about:blank")
+
+
 class PerfTimings(object):
     """Collects Peformance Timings for a set of URLs."""
 
-    def __init__(self):
+    def __init__(self, driver_pool=None, completion='poll', quiet_window=0,
+                 resource_timing=False, slowest=10, lifecycle=None,
+                 repeat_views=0, web_vitals=False,
+                 vitals_window=DEFAULT_VITALS_WINDOW,
+                 vitals_quiet=DEFAULT_VITALS_QUIET, network=None,
+                 usage_interval=0, raw_timings=False):
         """Doc string."""
+        self.raw_timings = raw_timings
+        self.raw_sink = None
+        self.network = network
+        self.usage_interval = usage_interval
+        self.web_vitals = web_vitals
+        self.vitals_window = vitals_window
+        self.vitals_quiet = vitals_quiet
+        self.repeat_views = repeat_views
+        self.view_rows = []
+        self.driver_pool = driver_pool
+        self.lifecycle = lifecycle or BrowserLifecycle()
+        self.completion = completion
+        self.quiet_window = quiet_window
+        self.resource_timing = resource_timing
+        self.slowest = slowest
+        self.resource_store = ResourceTimingStore(slowest)
+        self.webdriver_commands = 0
         self.current_url = ""
         self.test_urls = []
         self.calc_timings = {}
+        self.phase_profile = PhaseProfile()
+        metric_columns = csv_columns + \
+            (vitals_columns if web_vitals else []) + \
+            (usage_columns if usage_interval else [])
+        self.aggregator = ResultAggregator(metric_columns[2:])
+        self.output_columns = metric_columns + harness_columns + \
+            phase_columns
+        if network:
+            self.output_columns = self.output_columns + [NETWORK_COLUMN]
+        if repeat_views:
+            # first and repeat views are summarised apart
+            self.aggregator = ResultAggregator(
+                metric_columns[2:] + cache_columns[2:], group_by="View")
+            self.output_columns = self.output_columns + cache_columns
+        self.sink_options = {'fmt': 'csv'}
+        self.sink = None
+        self.output_prefix = None
+        self.checkpoint = None
+        self.results_db = None
+        self.exporter = None
+
+    def open_output_file(self):
+        """Open the results sink that stays open for the whole run."""
+        # define unique results file for this run
+        ts = int(time.time())
+        self.output_prefix = "perftimings_chrome_" + str(ts)
+        filename = self.output_prefix + \
+            file_extension(self.sink_options.get('fmt', 'csv'))
+        self.sink = ResultSink(filename, self.output_columns,
+                               **self.sink_options)
+        if self.raw_timings:
+            self.raw_sink = ResultSink(
+                self.output_prefix + "_raw" +
+                file_extension(self.sink_options.get('fmt', 'csv')),
+                raw_timing_columns, **self.sink_options)
+        if self.resource_timing:
+            self.resource_store.open(self.output_prefix,
+                                     **self.sink_options)
 
-    def results_to_output_file(self, csv_filename):
-        """Write performance timings collected to a CSV file."""
-        if os.path.exists(csv_filename):
-            # append_write = 'a' # append if already exists
-            with open(csv_filename, 'a') as results_file:
-                csvwriter = csv.DictWriter(
-                    results_file, fieldnames=csv_columns)
-                csvwriter.writerow(self.calc_timings)
+    def close_output_file(self):
+        """Flush and close the results sink."""
+        if self.sink:
+            self.sink.close()
+            self.sink = None
+        if self.raw_sink:
+            self.raw_sink.close()
+            self.raw_sink = None
+        self.resource_store.close()
+        if self.checkpoint is not None:
+            self.checkpoint.commit()
 
+    def results_to_output_file(self):
+        """Queue the performance timings collected for the results sink."""
+        self.sink.write(dict(self.calc_timings))
+
+    def print_summary(self):
+        """Print the per-URL statistics and the harness phase profile.
+
+        When the results go to a file the per-URL summary is exported
+        next to it in the same format, like the resource waterfalls were
+        while they arrived; otherwise the slowest resources of each page
+        are printed.
+        """
+        print self.aggregator.format()
+        print self.phase_profile.format()
+        if self.output_prefix:
+            fmt = self.sink_options.get('fmt', 'csv')
+            summary_file = self.output_prefix + "_summary" + \
+                file_extension(fmt)
+            with ResultSink(summary_file, summary_columns, fmt) as sink:
+                for row in self.aggregator.summary_rows():
+                    sink.write(row)
         else:
-            # append_write = 'w' # make a new file if not
-            with open(csv_filename, 'wb') as results_file:
-                csvwriter = csv.DictWriter(
-                    results_file, fieldnames=csv_columns)
-                csvwriter.writeheader()
-                csvwriter.writerow(self.calc_timings)
+            for page in range(len(self.resource_store)):
+                print self.resource_store.format_slowest(page)
 
     @classmethod
     def print_header(cls):
         """Print the header columns to stdout."""
-        print "=" * 123
+        print "=" * 141
         header = "|               URL              |   DNS Res.   |"
         header += "   TCP Conn.  | SSL Handshake | Backend Time |"
-        header += " Frontend Time | Page Load |"
+        header += " Frontend Time | Page Load | Cmds | Overhead |"
         print header
-        print "=" * 123
+        print "=" * 141
 
     def print_output(self):
         """Print performance timers for each URL to stdout."""
         print ("| {url:30.25} | {DNS Resolution:9d} ms | {TCP Connection:9d} "
-               " ms | {SSL Handshake:9d} ms  | {Backend Time:9d} ms "
-               "| {Frontend Time:10d} ms "
-               "| {Page Load:6d} ms |").format(**self.calc_timings)
+               " ms | {SSL Handshake:9d} ms  | {Backend Time!s:>9} ms "
+               "| {Frontend Time!s:>10} ms "
+               "| {Page Load!s:>6} ms | {WebDriver Commands:4d} "
+               "| {Harness Overhead!s:>5} ms |").format(**dict(
+                   self.calc_timings, url=self.display_url()))
 
-        print "=" * 123
+        print "=" * 141
+
+    def display_url(self):
+        """Return the url of the current row as shown on the console."""
+        if self.calc_timings.get("View") == REPEAT_VIEW:
+            return "[repeat {0}] {1}".format(self.calc_timings["Repeat"],
+                                             self.calc_timings["url"])
+        return self.calc_timings["url"]
 
     def collect_navigation_timings(self, url, run_number):
         """
@@ -83,58 +385,218 @@ class PerfTimings(object):
 
         For the received url, start the chroeme driver and calls Javascript to
         retrieve the navigation timing data ince the url has been loaded.
+        With repeat views the url is then loaded again repeat_views times
+        in the same session, with a warm HTTP cache; every view leaves one
+        row in view_rows.  With a usage interval the browser processes are
+        sampled during every view.
 
         """
         self.current_url = url
         self.calc_timings.clear()
+        self.view_rows = []
+        timer = PhaseTimer()
 
-        chrome_options = Options()
+        if self.driver_pool:
+            with timer.phase("Launch"):
+                driver = self.driver_pool.acquire()
+        else:
+            with timer.phase("Launch"):
+                driver = self.lifecycle.track(start_browser())
+            with timer.phase("Timeouts"):
+                set_timeouts(driver)
 
-        # add option to start Chrome in Incognito mode
-        # comment this line if you want to test normal Chrome mode
-        chrome_options.add_argument("--incognito")
+        for view in range(1 + self.repeat_views):
+            if view:
+                timer = PhaseTimer()
+            sampler = None
+            if self.usage_interval:
+                sampler = UsageSampler(driver_pid(driver),
+                                       self.usage_interval).start()
+            measured = self.measure_view(driver, run_number, timer, view)
+            usage = sampler.stop() if sampler else None
+            if not measured:
+                # the driver is gone, keep the views measured so far
+                return bool(self.view_rows)
+            if usage:
+                self.calc_timings.update(usage)
+            self.view_rows.append(self.calc_timings)
 
-        driver = webdriver.Chrome(chrome_options=chrome_options)
+        # Hand the WebDriver back to the pool or close it and return True
+        with timer.phase("Quit"):
+            if self.driver_pool:
+                self.driver_pool.release(driver)
+            else:
+                self.lifecycle.teardown(driver)
+        self.calc_timings.update(timer.columns())
+        return True
 
-        # set page load time out to 60 seconds
-        driver.set_page_load_timeout(60)
+    def measure_view(self, driver, run_number, timer, view=0):
+        """Load the current url in driver and leave its row in calc_timings.
 
+        View 0 is the first view; later views first park the session on
+        about:blank so the url is navigated to again from the warm cache.
+        Returns False, once the driver has been discarded, on failure.
+        """
         # Short routine to verify if the document is fully loaded
         def doc_ready(driver):
             """Check readyState value for the page."""
             try:
-                result = driver.execute_script("return document.readyState")
+                self.webdriver_commands += 1
+                result = driver.execute_script(READY_STATE_SCRIPT)
                 return True if (result == "complete") else False
 
             except WebDriverException:
                 return False
 
+        self.webdriver_commands = 0
+        tmp_nav_timings = None
         try:
+            if view:
+                self.webdriver_commands += 1
+                with self.lifecycle.watch(driver, PAGE_LOAD_TIMEOUT):
+                    driver.get("about:blank")
+            started = monotonic()
             # Get the URL and wait until the document is in complete state
             # This is particularly useful in case of redirections as the get
             # would return without having the final page fully loaded
-            driver.get(self.current_url)
-            WebDriverWait(driver, PAGE_WAIT_TIMEOUT).until(doc_ready)
+            # The watchdog kills the browser if a step hangs past its
+            # own timeout, which turns into a WebDriverException here
+            self.webdriver_commands += 1
+            with timer.phase("Get"), \
+                    self.lifecycle.watch(driver, PAGE_LOAD_TIMEOUT):
+                driver.get(self.current_url)
+            with timer.phase("Wait"), \
+                    self.lifecycle.watch(driver, PAGE_WAIT_TIMEOUT):
+                if self.completion == 'push':
+                    tmp_nav_timings = self.wait_load_complete(driver)
+                if tmp_nav_timings is None:
+                    WebDriverWait(driver, PAGE_WAIT_TIMEOUT).until(doc_ready)
         except TimeoutException:
             # If there's a timeout still follow to collect the metrics
             pass
         except WebDriverException:
             print "Could not open page for {0}".format(self.current_url)
+            self.discard_driver(driver)
             return False
 
-        # Pull the performance timing data
-        tmp_nav_timings = driver.execute_script(
-            "return window.performance.timing")
+        try:
+            with self.lifecycle.watch(driver, PAGE_WAIT_TIMEOUT):
+                # Pull the performance timing data
+                if tmp_nav_timings is None:
+                    self.webdriver_commands += 1
+                    with timer.phase("Script"):
+                        tmp_nav_timings = driver.execute_script(
+                            NAVIGATION_TIMING_SCRIPT)
+                elapsed = int((monotonic() - started) * 1000)
+
+                # Pull the Navigation Timing 2 and Resource Timing entries
+                resources = None
+                if self.resource_timing:
+                    self.webdriver_commands += 1
+                    with timer.phase("Script"):
+                        resources = driver.execute_script(
+                            RESOURCE_TIMING_SCRIPT, NAVIGATION_FIELDS,
+                            RESOURCE_FIELDS)
+
+                # Count what the HTTP cache served, from transfer sizes
+                cache_stats = None
+                if self.repeat_views:
+                    self.webdriver_commands += 1
+                    with timer.phase("Script"):
+                        cache_stats = driver.execute_script(
+                            CACHE_STATS_SCRIPT)
+
+                # Read the Core Web Vitals seen by the observer injected
+                # before navigation, waiting only while entries still come
+                vitals = None
+                if self.web_vitals:
+                    self.webdriver_commands += 1
+                    with timer.phase("Script"):
+                        vitals = driver.execute_async_script(
+                            VITALS_COLLECT_SCRIPT, self.vitals_window,
+                            self.vitals_quiet)
+        except WebDriverException:
+            print "Could not read timings for {0}".format(self.current_url)
+            self.discard_driver(driver)
+            return False
         tmp_nav_timings['url'] = str(self.current_url).strip()
         tmp_nav_timings['run'] = str(run_number).strip()
 
         # Caculate the timers
-        self.calc_timers(tmp_nav_timings)
-
-        # Close selenium WebDriver and return True
-        driver.quit()
+        with timer.phase("Calc"):
+            self.calc_timers(tmp_nav_timings)
+        self.calc_timings["WebDriver Commands"] = self.webdriver_commands
+        page_load = self.calc_timings["Page Load"]
+        # a timed-out load has "N/A", which Python 2 orders above numbers
+        if isinstance(page_load, (int, long, float)) and page_load > 0:
+            self.calc_timings["Harness Overhead"] = elapsed - page_load
+        else:
+            self.calc_timings["Harness Overhead"] = "N/A"
+        if self.repeat_views:
+            self.calc_timings.update(cache_columns_for(view, cache_stats))
+        if self.web_vitals:
+            self.calc_timings.update(vitals_values(vitals))
+        if self.network:
+            self.calc_timings[NETWORK_COLUMN] = self.network
+        self.calc_timings.update(timer.columns())
+        if resources is not None:
+            self.calc_timings[RESOURCE_TIMING_KEY] = resources
+        if self.raw_timings:
+            self.calc_timings[RAW_TIMING_KEY] = dict(
+                (field, tmp_nav_timings.get(field))
+                for field in TIMING_FIELDS)
         return True
 
+    def discard_driver(self, driver):
+        """Tear down a driver after a failed load."""
+        reason = self.lifecycle.kill_reason(driver)
+        if reason:
+            print "Browser killed by the watchdog: {0}".format(reason)
+        if self.driver_pool:
+            self.driver_pool.release(driver, failed=True)
+        else:
+            self.lifecycle.teardown(driver)
+
+    def wait_load_complete(self, driver):
+        """Wait in-page for the load to complete, return the timings.
+
+        A single execute_async_script resolves once loadEventEnd is set
+        (and the network went quiet, if a quiet window is configured) and
+        carries back the Navigation Timing payload. Returns None when the
+        document navigated away under the script, e.g. on a JS redirect,
+        so the caller falls back to polling readyState.
+        """
+        self.webdriver_commands += 1
+        try:
+            return driver.execute_async_script(
+                LOAD_COMPLETE_SCRIPT, self.quiet_window)
+        except TimeoutException:
+            raise
+        except WebDriverException:
+            return None
+
+    def measure(self, url, run_number):
+        """Collect the timings for one load, return the rows of its views."""
+        if self.collect_navigation_timings(url, run_number):
+            return [dict(row) for row in self.view_rows]
+        return []
+
+    def close(self):
+        """Release the output file and browser sessions of this instance."""
+        self.close_output_file()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+        if self.results_db:
+            self.results_db.close()
+        if self.exporter:
+            self.exporter.close()
+            print self.exporter.format_report()
+        if self.driver_pool:
+            self.driver_pool.close()
+            print self.driver_pool.format_savings_report()
+        self.lifecycle.close()
+        print self.lifecycle.format_report()
+
     def calc_timers(self, tmp_nav_timings):
         """Calculate the navigation timings.
 
@@ -167,16 +629,77 @@ class PerfTimings(object):
                 tmp_nav_timings["navigationStart"]
         else:
             tmp_timings["DOM Ready"] = "N/A"
-        tmp_timings["Page Load"] = tmp_nav_timings["loadEventEnd"] - \
-            tmp_nav_timings["navigationStart"]
-        tmp_timings["Backend Time"] = tmp_nav_timings["responseStart"] - \
-            tmp_nav_timings["navigationStart"]
-        tmp_timings["Frontend Time"] = tmp_nav_timings["loadEventEnd"] - \
-            tmp_nav_timings["responseStart"]
+        # a load that timed out never set loadEventEnd (or responseStart)
+        if tmp_nav_timings["loadEventEnd"] > 0:
+            tmp_timings["Page Load"] = tmp_nav_timings["loadEventEnd"] - \
+                tmp_nav_timings["navigationStart"]
+        else:
+            tmp_timings["Page Load"] = "N/A"
+        if tmp_nav_timings["responseStart"] > 0:
+            tmp_timings["Backend Time"] = tmp_nav_timings["responseStart"] - \
+                tmp_nav_timings["navigationStart"]
+        else:
+            tmp_timings["Backend Time"] = "N/A"
+        if tmp_nav_timings["loadEventEnd"] > 0 and \
+                tmp_nav_timings["responseStart"] > 0:
+            tmp_timings["Frontend Time"] = tmp_nav_timings["loadEventEnd"] - \
+                tmp_nav_timings["responseStart"]
+        else:
+            tmp_timings["Frontend Time"] = "N/A"
 
         self.calc_timings = tmp_timings
 
-    def run(self, test_urls, iterations, csv_output):
+    def emit_result(self, csv_output):
+        """Fold the current result into the run statistics and output it."""
+        resources = self.calc_timings.pop(RESOURCE_TIMING_KEY, None)
+        if resources is not None:
+            self.resource_store.add_page(self.calc_timings["url"],
+                                         self.calc_timings["run"], resources)
+        raw = self.calc_timings.pop(RAW_TIMING_KEY, None)
+        if raw is not None and self.raw_sink:
+            self.raw_sink.write(dict(raw, url=self.calc_timings["url"],
+                                     run=self.calc_timings["run"]))
+        self.phase_profile.add(self.calc_timings)
+        self.aggregator.add(self.calc_timings)
+        if self.results_db:
+            self.results_db.add(self.calc_timings)
+        if self.exporter:
+            self.exporter.observe(self.calc_timings)
+        if csv_output:
+            self.results_to_output_file()
+        else:
+            self.print_output()
+
+        # only checkpoint loads whose rows already reached the results file
+        if self.checkpoint is not None:
+            self.checkpoint.mark(self.calc_timings["url"],
+                                 self.calc_timings["run"])
+            if not self.sink or \
+                    self.checkpoint.pending >= self.sink.batch_size:
+                if self.sink:
+                    self.sink.flush()
+                if self.raw_sink:
+                    self.raw_sink.flush()
+                self.resource_store.flush()
+                self.checkpoint.commit()
+
+    def emit_views(self, csv_output):
+        """Emit the row of every view of the last collected load."""
+        for row in self.view_rows:
+            self.calc_timings = row
+            self.emit_result(csv_output)
+
+    def pending_items(self, iterations):
+        """Yield the (url, run_number) loads not in the checkpoint yet."""
+        for x in range(0, int(iterations)):
+            for url in self.test_urls:
+                if self.checkpoint is not None and \
+                        self.checkpoint.done(url, x):
+                    continue
+                yield url, x
+
+    def run(self, test_urls, iterations, csv_output, runner=None,
+            scheduler=None):
         """Run for each url the collection of performane timings.
 
         This is the main method exposed for the PerfTimings class
@@ -185,45 +708,176 @@ class PerfTimings(object):
         Nothing.
 
         Args:
-        test_urls from the input file with URLS to test
+        test_urls: URLs to test, iterated again for every iteration
         iterations: Number of iterations to do for each URL
         csv_output: Optional arg to write output to csv file.
+        runner: Optional ParallelRunner to spread the loads over workers.
+        scheduler: Optional AdaptiveScheduler picking the loads instead of
+        a fixed number of iterations.
 
         """
         self.test_urls = test_urls
 
+        if runner:
+            self.run_parallel(iterations, csv_output, runner)
+            return
+
+        if scheduler:
+            self.run_adaptive(csv_output, scheduler)
+            return
+
+        if not csv_output:
+            self.print_header()
+        else:
+            self.open_output_file()
+
+        for url, x in self.pending_items(iterations):
+            if self.collect_navigation_timings(url, x):
+                self.emit_views(csv_output)
+        self.close_output_file()
+
+        self.print_summary()
+
+    def run_parallel(self, iterations, csv_output, runner):
+        """Run the collection over the workers of a ParallelRunner.
+
+        Each row also records the host load average and CPU steal seen
+        when the sample was taken.
+        """
+        self.output_columns = self.output_columns + host_load_columns
+        if not csv_output:
+            self.print_header()
+        else:
+            self.open_output_file()
+
+        for _seq, _worker, rows in runner.run(
+                self.pending_items(iterations)):
+            self.view_rows = rows
+            self.emit_views(csv_output)
+        self.close_output_file()
+
+        self.print_summary()
+
+    def run_adaptive(self, csv_output, scheduler):
+        """Sample each URL until its metric converges.
+
+        The scheduler decides which URL to load next and when to stop,
+        based on the confidence interval of the chosen metric.
+        """
         if not csv_output:
             self.print_header()
-            if iterations == '1':
-                for url in self.test_urls:
-                    if self.collect_navigation_timings(url, 0):
-                        self.print_output()
-                    else:
-                        continue
-            else:
-                for x in range(0, int(iterations)):
-                    for url in self.test_urls:
-                        if self.collect_navigation_timings(url, x):
-                            self.print_output()
-                        else:
-                            continue
         else:
-            # define unique results file for this run_number
-            ts = int(time.time())
-            filename = "perftimings_chrome_" + str(ts) + ".csv"
-            if iterations == '1':
-                for url in self.test_urls:
-                    if self.collect_navigation_timings(url, 0):
-                        self.results_to_output_file(filename)
-                    else:
-                        continue
+            self.open_output_file()
+
+        item = scheduler.next_item()
+        while item:
+            url, x = item
+            if self.collect_navigation_timings(url, x):
+                # the first view decides convergence
+                scheduler.record(url,
+                                 self.view_rows[0].get(scheduler.metric))
+                self.emit_views(csv_output)
             else:
-                for x in range(0, int(iterations)):
-                    for url in self.test_urls:
-                        if self.collect_navigation_timings(url, x):
-                            self.results_to_output_file(filename)
-                        else:
-                            continue
+                scheduler.record(url, None)
+            item = scheduler.next_item()
+        self.close_output_file()
+
+        print scheduler.format_report()
+        self.print_summary()
+
+
+def cache_columns_for(view, cache_stats):
+    """Return the view tag and cache hit ratio columns of one view.
+
+    cache_stats is the result of CACHE_STATS_SCRIPT; ratios are in percent
+    of the entries (or encoded bytes) whose sizes are exposed.
+    """
+    columns = {"View": REPEAT_VIEW if view else FIRST_VIEW, "Repeat": view,
+               "Cache Hits %": "N/A", "Revalidated %": "N/A",
+               "Cache Bytes %": "N/A"}
+    if cache_stats and cache_stats[0]:
+        entries, hits, revalidated, total_bytes, cached_bytes = cache_stats
+        columns["Cache Hits %"] = round(100.0 * hits / entries, 1)
+        columns["Revalidated %"] = round(100.0 * revalidated / entries, 1)
+        if total_bytes:
+            columns["Cache Bytes %"] = round(
+                100.0 * cached_bytes / total_bytes, 1)
+    return columns
+
+
+def new_perf_timings(reuse_browser=False, recycle_loads=DEFAULT_MAX_LOADS,
+                     recycle_rss=DEFAULT_MAX_RSS_GROWTH_MB, memory_limit=0,
+                     cpu_limit=0, watchdog_grace=WATCHDOG_GRACE, **kwargs):
+    """Build a PerfTimings, with its own driver pool if asked to.
+
+    Extra keyword arguments are passed on to PerfTimings.
+    """
+    lifecycle = BrowserLifecycle(memory_limit, cpu_limit, watchdog_grace,
+                                 on_teardown=release_profile)
+    driver_pool = None
+    if reuse_browser:
+        driver_pool = DriverPool(lambda: lifecycle.track(launch_driver()),
+                                 reset_driver,
+                                 max_loads=recycle_loads,
+                                 max_rss_growth_mb=recycle_rss,
+                                 teardown=lifecycle.teardown)
+    return PerfTimings(driver_pool, lifecycle=lifecycle, **kwargs)
+
+
+def benchmark_session(pt, url=None):
+    """Launch a session, load url in it if given, and tear it down.
+
+    Returns (launch seconds, quit seconds, page load ms or None), or None
+    when the session failed.
+    """
+    started = monotonic()
+    try:
+        driver = pt.lifecycle.track(start_browser())
+    except WebDriverException:
+        return None
+    launched = monotonic()
+    set_timeouts(driver)
+    page_load = None
+    if url:
+        pt.current_url = url
+        if not pt.measure_view(driver, 0, PhaseTimer()):
+            return None
+        page_load = pt.calc_timings["Page Load"]
+    stopping = monotonic()
+    pt.lifecycle.teardown(driver)
+    return launched - started, monotonic() - stopping, page_load
+
+
+def run_startup_benchmark(sessions, url=None, template=None):
+    """Compare the session creation latency of the launch configurations.
+
+    The template configuration clones template, or a scratch template
+    built for the benchmark and removed afterwards.
+    """
+    scratch = None
+    if template is None:
+        scratch = tempfile.mkdtemp(prefix='plt-benchmark-')
+        template = ProfileTemplate(os.path.join(scratch, 'template'))
+    pt = new_perf_timings()
+
+    def configure(headless, lean, use_template):
+        ToolParams['headless'] = headless
+        ToolParams['lean'] = lean
+        ToolParams['profile_template'] = None
+        if use_template:
+            template.build(build_profile)
+            ToolParams['profile_template'] = template
+
+    try:
+        return benchmark_startup(
+            configure, functools.partial(benchmark_session, pt, url),
+            sessions)
+    finally:
+        pt.lifecycle.close()
+        template.close()
+        ToolParams['profile_template'] = None
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
 
 
 if __name__ == "__main__":
@@ -249,15 +903,293 @@ if __name__ == "__main__":
                       action='store_true',
                       help="write output to CSV file",
                       default=False)
+    parser.add_option("--output-format",
+                      dest="output_format",
+                      choices=list(FORMATS),
+                      help="output file format: csv, jsonl or columnar",
+                      default='csv')
+    parser.add_option("--batch-size",
+                      dest="batch_size",
+                      help="rows buffered before each write to the file",
+                      default='100')
+    parser.add_option("--fsync",
+                      dest="fsync",
+                      choices=list(FSYNC_POLICIES),
+                      help="fsync the output file never, after every batch "
+                           "or on close",
+                      default='never')
+    parser.add_option("--reuse-browser",
+                      dest="reuse_browser",
+                      action='store_true',
+                      help="keep browser sessions warm between page loads",
+                      default=False)
+    parser.add_option("--recycle-loads",
+                      dest="recycle_loads",
+                      help="restart a reused browser after this many loads",
+                      default=str(DEFAULT_MAX_LOADS))
+    parser.add_option("--recycle-rss",
+                      dest="recycle_rss",
+                      help="restart a reused browser once its RSS grew by "
+                           "this many MB",
+                      default=str(DEFAULT_MAX_RSS_GROWTH_MB))
+    parser.add_option("--memory-limit",
+                      dest="memory_limit",
+                      help="kill a browser session whose processes use more "
+                           "than this many MB of RSS, 0 disables",
+                      default='0')
+    parser.add_option("--cpu-limit",
+                      dest="cpu_limit",
+                      help="kill a browser session after this many seconds "
+                           "of CPU time, 0 disables",
+                      default='0')
+    parser.add_option("--watchdog-grace",
+                      dest="watchdog_grace",
+                      help="seconds past the page load or wait timeout "
+                           "before the watchdog kills a hung browser",
+                      default=str(WATCHDOG_GRACE))
+    parser.add_option("--completion",
+                      dest="completion",
+                      choices=['poll', 'push'],
+                      help="detect the end of the load by polling "
+                           "readyState or in-page with one async script",
+                      default='poll')
+    parser.add_option("--quiet-window",
+                      dest="quiet_window",
+                      help="with --completion=push also wait for this many "
+                           "ms without new network requests",
+                      default='0')
+    parser.add_option("--network",
+                      dest="network",
+                      help="network profile: 2G, 3GSlow, 3G, 3GFast, 4G, "
+                           "LTE, DSL, cable, FIOS or "
+                           "down_kbps/up_kbps/rtt_ms[/loss_percent]")
+    parser.add_option("--shaping",
+                      dest="shaping",
+                      choices=['devtools', 'proxy'],
+                      help="enforce the network profile with DevTools "
+                           "throttling or a local shaping proxy (needed "
+                           "for packet loss)",
+                      default='devtools')
+    parser.add_option("--web-vitals",
+                      dest="web_vitals",
+                      action='store_true',
+                      help="also collect FCP, LCP, CLS, TBT and long tasks",
+                      default=False)
+    parser.add_option("--vitals-window",
+                      dest="vitals_window",
+                      help="longest time in ms to wait for the Web Vitals "
+                           "to settle after the load",
+                      default=str(DEFAULT_VITALS_WINDOW))
+    parser.add_option("--vitals-quiet",
+                      dest="vitals_quiet",
+                      help="the Web Vitals are settled once no new entry "
+                           "came for this many ms",
+                      default=str(DEFAULT_VITALS_QUIET))
+    parser.add_option("--sample-usage",
+                      dest="sample_usage",
+                      help="sample the CPU time, memory and threads of the "
+                           "browser every this many ms during each load "
+                           "(e.g. {0})".format(DEFAULT_USAGE_INTERVAL),
+                      default='0')
+    parser.add_option("--repeat-views",
+                      dest="repeat_views",
+                      help="after the cold first view, load each URL again "
+                           "this many times in the same browser session",
+                      default='0')
+    parser.add_option("--fast-startup",
+                      dest="fast_startup",
+                      action='store_true',
+                      help="launch the browser headless, without GPU and "
+                           "background services",
+                      default=False)
+    parser.add_option("--profile-template",
+                      dest="profile_template",
+                      help="start every session on a clone of this "
+                           "template profile directory, built on first use")
+    parser.add_option("--profile-clone",
+                      dest="profile_clone",
+                      choices=list(CLONE_METHODS),
+                      help="how the template profile is cloned: auto, "
+                           "reflink, hardlink or copy",
+                      default='auto')
+    parser.add_option("--startup-benchmark",
+                      dest="startup_benchmark",
+                      help="time this many session launches under each "
+                           "launch configuration, loading the first URL "
+                           "of --file if given, then exit",
+                      default='0')
+    parser.add_option("--shard",
+                      dest="shard",
+                      help="only test the URLs of shard i out of N, as i/N")
+    parser.add_option("--shuffle-chunk",
+                      dest="shuffle_chunk",
+                      help="shuffle the URLs this many at a time, 0 keeps "
+                           "the file order",
+                      default=str(DEFAULT_SHUFFLE_CHUNK))
+    parser.add_option("--seed",
+                      dest="seed",
+                      help="random seed of the URL shuffle")
+    parser.add_option("--checkpoint",
+                      dest="checkpoint",
+                      help="file recording the completed loads, an "
+                           "interrupted run resumes from it")
+    parser.add_option("--db",
+                      dest="db",
+                      help="also store the results in this SQLite history "
+                           "database, see results_db.py compare")
+    parser.add_option("--label",
+                      dest="label",
+                      help="label of this run in the history database, "
+                           "e.g. a release or commit")
+    parser.add_option("--metrics-listen",
+                      dest="metrics_listen",
+                      help="serve per-URL histograms of the results on "
+                           "http://<host:port>/metrics while the test runs")
+    parser.add_option("--statsd",
+                      dest="statsd",
+                      help="also push every result to the StatsD daemon "
+                           "at host[:port] over UDP")
+    parser.add_option("--adaptive",
+                      dest="adaptive",
+                      action='store_true',
+                      help="sample each URL until its metric converges "
+                           "instead of a fixed number of iterations",
+                      default=False)
+    parser.add_option("--adaptive-metric",
+                      dest="adaptive_metric",
+                      choices=csv_columns[2:],
+                      help="metric whose confidence interval is tracked",
+                      default="Page Load")
+    parser.add_option("--target-ci",
+                      dest="target_ci",
+                      help="target CI half width relative to the mean",
+                      default='0.05')
+    parser.add_option("--min-samples",
+                      dest="min_samples",
+                      help="minimum samples per URL in adaptive mode",
+                      default='3')
+    parser.add_option("--max-samples",
+                      dest="max_samples",
+                      help="maximum samples per URL in adaptive mode",
+                      default='30')
+    parser.add_option("--time-budget",
+                      dest="time_budget",
+                      help="stop the adaptive run after this many seconds",
+                      default='0')
+    parser.add_option("--resource-timing",
+                      dest="resource_timing",
+                      action='store_true',
+                      help="also collect Navigation Timing 2 and Resource "
+                           "Timing entries of every load",
+                      default=False)
+    parser.add_option("--raw-timings",
+                      dest="raw_timings",
+                      action='store_true',
+                      help="also write the raw Navigation Timing record of "
+                           "every load, for batch_analysis.py",
+                      default=False)
+    parser.add_option("--slowest",
+                      dest="slowest",
+                      help="number of slowest resources listed per page",
+                      default='10')
+    parser.add_option("--record",
+                      dest="record",
+                      help="record every response into this archive "
+                           "directory",
+                      default=None)
+    parser.add_option("--replay",
+                      dest="replay",
+                      help="serve the page loads from this archive "
+                           "directory",
+                      default=None)
+    parser.add_option("--profile",
+                      dest="profile",
+                      choices=['cprofile', 'sampling'],
+                      help="profile the run loop with cProfile or a "
+                           "sampling profiler",
+                      default=None)
+    parser.add_option("--profile-output",
+                      dest="profile_output",
+                      help="file for the profile data (cProfile stats or "
+                           "collapsed stacks)",
+                      default=None)
+    parser.add_option("-w", "--workers",
+                      dest="workers",
+                      help="number of parallel browser workers "
+                           "(0 picks a CPU-aware default)",
+                      default='1')
+    parser.add_option("--worker-mode",
+                      dest="worker_mode",
+                      choices=['thread', 'process'],
+                      help="run workers as threads or processes",
+                      default='thread')
+    parser.add_option("--unordered",
+                      dest="unordered",
+                      action='store_true',
+                      help="emit parallel results as they complete",
+                      default=False)
+    parser.add_option("--coordinator",
+                      dest="coordinator",
+                      help="hand the loads out to worker agents from this "
+                           "host:port and merge their results")
+    parser.add_option("--agent",
+                      dest="agent",
+                      help="run as a worker agent of the coordinator at "
+                           "host:port, with --workers browsers")
+    parser.add_option("--lease",
+                      dest="lease",
+                      help="seconds an agent keeps a load without a "
+                           "heartbeat before it is handed out again",
+                      default=str(LEASE_SECONDS))
+    parser.add_option("--token",
+                      dest="token",
+                      help="shared secret of the coordinator and its agents")
+    parser.add_option("--oversubscribe",
+                      dest="oversubscribe",
+                      action='store_true',
+                      help="allow more browser workers than the cores can "
+                           "carry",
+                      default=False)
 
     (options, args) = parser.parse_args()
 
-    if not options.url_file:   # if filename is not given
+    # if filename is not given
+    if not options.url_file and not int(options.startup_benchmark) and \
+            not options.agent:
         parser.error('Filename not given')
 
+    # agents send the raw records on to the coordinator's output
+    if options.raw_timings and not options.csv and not options.agent:
+        parser.error('--raw-timings needs --csv')
+
+    # without psutil or /proc no process can be seen (e.g. on MacOSX)
+    if not tracking_available():
+        tracked = [name for name, value in (
+            ('--memory-limit', int(options.memory_limit)),
+            ('--cpu-limit', float(options.cpu_limit)),
+            ('--sample-usage', int(options.sample_usage)),
+            ('--recycle-rss',
+             options.reuse_browser and int(options.recycle_rss)))
+            if value]
+        if tracked:
+            parser.error('{0} need psutil on a system without /proc'
+                         .format(', '.join(tracked)))
+        print "Warning: psutil is not installed and there is no /proc, " \
+            "leaked and hung browser processes will not be killed"
+
+    try:
+        shard = parse_shard(options.shard) if options.shard else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    # the URLs are streamed from the file and shuffled in chunks to avoid
+    # order bias in testing without holding the whole list in memory
+    urls = None
     try:
-        with open(options.url_file, 'r') as url_file:
-            urls = url_file.readlines()
+        if options.url_file:
+            urls = UrlSource(options.url_file, shard,
+                             int(options.shuffle_chunk),
+                             int(options.seed) if options.seed else None)
     except IOError as e:
         print "I/O error({0}): {1}".format(e.errno, e.strerror)
         exit(2)
@@ -265,13 +1197,164 @@ if __name__ == "__main__":
         print "Unexpected error:", sys.exc_info()[0]
         exit(3)
 
-    pt = PerfTimings()
+    replay_server = None
+    if options.record or options.replay:
+        if options.record and options.replay:
+            parser.error('--record and --replay are mutually exclusive')
+        replay_server = ReplayServer(
+            options.record or options.replay,
+            'record' if options.record else 'replay').start()
+        ToolParams['extra_args'] += replay_server.chrome_args()
 
-    # randomly shuffle list of urls to avoid order bias in testing
-    random.shuffle(urls)
+    network_profile = None
+    shaping_proxy = None
+    if options.network:
+        try:
+            network_profile = parse_profile(options.network)
+        except ValueError as e:
+            parser.error(str(e))
+        if options.shaping == 'devtools':
+            if network_profile.loss:
+                parser.error('DevTools throttling has no packet loss, '
+                             'use --shaping=proxy')
+            ToolParams['network_conditions'] = \
+                network_profile.devtools_conditions()
+        else:
+            # in front of the record/replay server when there is one
+            shaping_proxy = ShapingProxy(
+                network_profile, upstream=replay_server and
+                replay_server.proxy_address).start()
+            ToolParams['extra_args'] += shaping_proxy.chrome_args()
+
+    ToolParams['web_vitals'] = options.web_vitals
+
+    ToolParams['headless'] = ToolParams['lean'] = options.fast_startup
+    template = None
+    if options.profile_template:
+        template = ProfileTemplate(options.profile_template,
+                                   options.profile_clone)
+
+    if int(options.startup_benchmark):
+        print format_startup_benchmark(run_startup_benchmark(
+            int(options.startup_benchmark),
+            next(iter(urls), None) if urls else None, template))
+        if shaping_proxy:
+            shaping_proxy.stop()
+        if replay_server:
+            replay_server.stop()
+        exit(0)
+
+    if template is not None:
+        if template.build(build_profile):
+            print "Built the profile template in {0}".format(template.path)
+        ToolParams['profile_template'] = template
+
+    perf_timings_factory = functools.partial(
+        new_perf_timings, options.reuse_browser,
+        int(options.recycle_loads), int(options.recycle_rss),
+        int(options.memory_limit), float(options.cpu_limit),
+        float(options.watchdog_grace),
+        completion=options.completion,
+        quiet_window=int(options.quiet_window),
+        resource_timing=options.resource_timing,
+        slowest=int(options.slowest),
+        repeat_views=int(options.repeat_views),
+        web_vitals=options.web_vitals,
+        vitals_window=int(options.vitals_window),
+        vitals_quiet=int(options.vitals_quiet),
+        network=network_profile and network_profile.name,
+        usage_interval=int(options.sample_usage),
+        raw_timings=options.raw_timings)
+
+    runner = None
+    workers = int(options.workers) or default_workers()
+    if workers > 1:
+        try:
+            check_capacity(workers, options.oversubscribe)
+        except ValueError as e:
+            parser.error(str(e))
+        runner = ParallelRunner(perf_timings_factory, workers,
+                                options.worker_mode,
+                                ordered=not options.unordered)
+
+    if options.agent:
+        try:
+            parse_address(options.agent)
+        except ValueError as e:
+            parser.error(str(e))
+        run_agents(options.agent, perf_timings_factory, workers,
+                   options.worker_mode, options.token)
+        if shaping_proxy:
+            shaping_proxy.stop()
+        if replay_server:
+            replay_server.stop()
+        exit(0)
+
+    if options.coordinator:
+        try:
+            runner = Coordinator(options.coordinator, float(options.lease),
+                                 ordered=not options.unordered,
+                                 token=options.token).start()
+        except ValueError as e:
+            parser.error(str(e))
+
+    pt = perf_timings_factory()
+    pt.sink_options = {'fmt': options.output_format,
+                       'batch_size': int(options.batch_size),
+                       'fsync': options.fsync}
+
+    if options.db:
+        pt.results_db = ResultsDB(options.db)
+        pt.results_db.start_run("chrome", label=options.label)
+
+    if options.metrics_listen or options.statsd:
+        try:
+            pt.exporter = MetricsExporter(
+                pt.aggregator.metrics, options.metrics_listen,
+                options.statsd, pt.aggregator.group_by).start()
+        except ValueError as e:
+            parser.error(str(e))
+        if pt.exporter.address:
+            print "Metrics on http://{0}/metrics".format(
+                pt.exporter.address)
+
+    if options.checkpoint:
+        if options.adaptive:
+            parser.error('--checkpoint cannot be combined with --adaptive')
+        try:
+            pt.checkpoint = Checkpoint(options.checkpoint)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+        if len(pt.checkpoint):
+            print "Resuming: {0} loads already done in {1}".format(
+                len(pt.checkpoint), options.checkpoint)
+
+    scheduler = None
+    if options.adaptive:
+        if options.coordinator:
+            parser.error('--adaptive cannot be combined with --coordinator')
+        if runner:
+            parser.error('--adaptive cannot be combined with --workers')
+        scheduler = AdaptiveScheduler(
+            list(urls), options.adaptive_metric, float(options.target_ci),
+            int(options.min_samples), int(options.max_samples),
+            float(options.time_budget))
 
     # try:
-    pt.run(urls, options.iterations, options.csv)
+    with profiled(options.profile, options.profile_output):
+        pt.run(urls, options.iterations, options.csv, runner,
+               scheduler)
+
+    pt.close()
+    if options.coordinator:
+        print runner.format_report()
+    if template is not None:
+        print template.format_report()
+        template.close()
+    if shaping_proxy:
+        shaping_proxy.stop()
+    if replay_server:
+        replay_server.stop()
 
     # except ValueError as e:
     #    print "ValueError Exception ocurred"
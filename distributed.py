@@ -0,0 +1,461 @@
+"""Coordinator and worker agents spreading the page loads over many hosts."""
+#################################################
+#
+# Description:  The coordinator hands the (url, run) work items out to
+#               worker agents over JSON on HTTP, under leases the agents
+#               keep alive with heartbeats.  Items whose lease expires
+#               (a dead or hung agent) are handed out again, and the rows
+#               streamed back are merged into the coordinator's output.
+#
+#   POST /lease      {"worker", "max"}          -> {"items", "done"}
+#   POST /heartbeat  {"worker", "leases"}       -> {"lost"}
+#   POST /result     {"worker", "seq", "lease", "rows"} -> {"accepted"}
+#################################################
+import collections
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import Request, urlopen, URLError, HTTPError
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.request import Request, urlopen
+    from urllib.error import URLError, HTTPError
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from harness_timers import monotonic
+from parallel_runner import HostLoadSampler
+
+LEASE_SECONDS = 30
+# longest time between heartbeats, agents beat at least 3 times a lease
+HEARTBEAT_INTERVAL = 10
+# heartbeats cannot keep one lease longer, the agent is stuck
+MAX_HOLD_SECONDS = 600
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 1.0
+# agents give up on a coordinator unreachable for this long
+COORDINATOR_TIMEOUT = 30
+REQUEST_TIMEOUT = 10
+TOKEN_HEADER = 'X-PLT-Token'
+
+
+def parse_address(text):
+    """Parse "host:port" into (host, port), raise ValueError if malformed."""
+    host, _, port = text.rpartition(':')
+    try:
+        return host or '0.0.0.0', int(port)
+    except ValueError:
+        raise ValueError("address must look like host:port, got {0!r}"
+                         .format(text))
+
+
+def _native(value):
+    """Turn the unicode strings of decoded JSON into str on Python 2."""
+    if sys.version_info[0] >= 3:
+        return value
+    if isinstance(value, list):
+        return [_native(item) for item in value]
+    if isinstance(value, dict):
+        return dict((_native(k), _native(v)) for k, v in value.items())
+    if not isinstance(value, str) and hasattr(value, 'encode'):
+        return value.encode('utf-8')
+    return value
+
+
+class _CoordinatorHandler(BaseHTTPRequestHandler):
+    """Routes the JSON requests of the agents to the coordinator."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        """Keep the measurement output clean."""
+        pass
+
+    def do_POST(self):
+        coordinator = self.server.coordinator
+        if coordinator.token and \
+                self.headers.get(TOKEN_HEADER) != coordinator.token:
+            self.send_error(403)
+            return
+        action = {'/lease': coordinator.lease,
+                  '/heartbeat': coordinator.heartbeat,
+                  '/result': coordinator.complete}.get(self.path)
+        if action is None:
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = _native(json.loads(
+                self.rfile.read(length).decode('utf-8')))
+            body = json.dumps(action(request)).encode('utf-8')
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, str(e))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _CoordinatorServer(ThreadingMixIn, HTTPServer):
+    """Threaded listener of the coordinator."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, coordinator):
+        """Doc string."""
+        HTTPServer.__init__(self, address, _CoordinatorHandler)
+        self.coordinator = coordinator
+
+
+class Coordinator(object):
+    """Hands work items out to remote worker agents and merges the rows.
+
+    It has the run() interface of ParallelRunner, so PerfTimings writes
+    the merged rows like those of local workers.  Work items are drawn
+    lazily; a lease not renewed within lease_seconds, or held for more
+    than max_hold seconds, is handed out again, up to max_attempts times,
+    after which the load counts as failed.  token, when set, must be sent
+    by every agent.
+    """
+
+    def __init__(self, address, lease_seconds=LEASE_SECONDS,
+                 max_attempts=MAX_ATTEMPTS, ordered=True, token=None,
+                 max_hold=MAX_HOLD_SECONDS):
+        """Doc string."""
+        self.host, self.port = parse_address(address)
+        self.lease_seconds = lease_seconds
+        self.max_hold = max_hold
+        self.max_attempts = max_attempts
+        self.ordered = ordered
+        self.token = token
+        self._lock = threading.Lock()
+        self._items = iter(())
+        self._next = None
+        # agents polling before run() are told to wait, not that it is over
+        self._running = False
+        # seq -> [seq, url, run, attempts, lease tokens] not completed yet
+        self._open = {}
+        # seq -> (lease token, worker, deadline, hold deadline)
+        self._leases = {}
+        self._retry = collections.deque()
+        self._results = queue.Queue()
+        self._workers = {}
+        self._server = None
+        self.stats = {'items': 0, 'results': 0, 'retried': 0, 'failed': 0,
+                      'late': 0}
+
+    def _draw(self):
+        """Return the next item to lease, or None."""
+        while self._retry:
+            seq = self._retry.popleft()
+            if seq in self._open:
+                return self._open[seq]
+        if self._next is None:
+            return None
+        seq, (url, run_number) = self._next
+        self._next = next(self._items, None)
+        item = [seq, url, run_number, 0, []]
+        self._open[seq] = item
+        self.stats['items'] += 1
+        return item
+
+    def lease(self, request):
+        """Lease up to request["max"] items to request["worker"]."""
+        worker = request['worker']
+        now = monotonic()
+        items = []
+        with self._lock:
+            self._workers[worker] = monotonic()
+            for _ in range(max(1, int(request.get('max', 1)))):
+                item = self._draw()
+                if item is None:
+                    break
+                token = uuid.uuid4().hex
+                item[4].append(token)
+                self._leases[item[0]] = (token, worker,
+                                         now + self.lease_seconds,
+                                         now + self.max_hold)
+                items.append({'seq': item[0], 'url': item[1],
+                              'run': item[2], 'lease': token})
+            done = self._running and self._next is None and \
+                not self._open
+        return {'items': items, 'done': done,
+                'lease_seconds': self.lease_seconds}
+
+    def heartbeat(self, request):
+        """Extend the leases an agent still holds, report the lost ones."""
+        deadline = monotonic() + self.lease_seconds
+        lost = []
+        with self._lock:
+            self._workers[request['worker']] = monotonic()
+            for seq, token in request.get('leases', []):
+                lease = self._leases.get(seq)
+                if lease is not None and lease[0] == token:
+                    self._leases[seq] = (token, lease[1],
+                                         min(deadline, lease[3]), lease[3])
+                else:
+                    lost.append(seq)
+        return {'lost': lost}
+
+    def complete(self, request):
+        """Accept the rows of a load, the first result of an item wins.
+
+        A result sent under an expired lease is still taken while no other
+        agent has completed the item.
+        """
+        seq = request['seq']
+        with self._lock:
+            self._workers[request['worker']] = monotonic()
+            item = self._open.get(seq)
+            if item is None or request['lease'] not in item[4]:
+                return {'accepted': False}
+            if self._leases.get(seq, (None,))[0] != request['lease']:
+                self.stats['late'] += 1
+            del self._open[seq]
+            self._leases.pop(seq, None)
+            self.stats['results'] += 1
+        self._results.put((seq, request['worker'], request['rows']))
+        return {'accepted': True}
+
+    def _expire(self):
+        """Hand out again the items whose lease ran out."""
+        now = monotonic()
+        with self._lock:
+            for seq, lease in list(self._leases.items()):
+                if lease[2] > now:
+                    continue
+                del self._leases[seq]
+                item = self._open[seq]
+                item[3] += 1
+                if item[3] >= self.max_attempts:
+                    del self._open[seq]
+                    self.stats['failed'] += 1
+                    self._results.put((seq, None, []))
+                else:
+                    self.stats['retried'] += 1
+                    self._retry.append(seq)
+
+    def _finished(self):
+        with self._lock:
+            return self._next is None and not self._open
+
+    def start(self):
+        """Start listening for agents in a daemon thread."""
+        self._server = _CoordinatorServer((self.host, self.port), self)
+        self.port = self._server.server_address[1]
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """Stop listening."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def run(self, work_items):
+        """Hand out (url, run_number) work items, yield (seq, worker, rows).
+
+        Returns once every item completed or failed; the agents are then
+        told there is no more work.
+        """
+        with self._lock:
+            self._items = enumerate(work_items)
+            self._next = next(self._items, None)
+            self._running = True
+        if self._server is None:
+            self.start()
+
+        pending = {}
+        next_seq = 0
+        next_expiry = monotonic() + POLL_INTERVAL
+        try:
+            while True:
+                # leases also run out while other agents keep reporting
+                if monotonic() >= next_expiry:
+                    self._expire()
+                    next_expiry = monotonic() + POLL_INTERVAL
+                try:
+                    result = self._results.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    self._expire()
+                    next_expiry = monotonic() + POLL_INTERVAL
+                    if self._finished() and self._results.empty():
+                        break
+                    continue
+                if not self.ordered:
+                    yield result
+                    continue
+                pending[result[0]] = result
+                while next_seq in pending:
+                    yield pending.pop(next_seq)
+                    next_seq += 1
+            for seq in sorted(pending):
+                yield pending[seq]
+            # idle agents poll again within POLL_INTERVAL and learn it is
+            # over before the listener goes away
+            time.sleep(2 * POLL_INTERVAL)
+        finally:
+            self.stop()
+
+    def format_report(self):
+        """Return the work distribution counters as a printable line."""
+        return ("Coordinator: {items} items to {workers} workers, "
+                "{results} results ({late} late), {retried} leases "
+                "expired and retried, {failed} failed").format(
+                    workers=len(self._workers), **self.stats)
+
+
+class CoordinatorGone(Exception):
+    """The coordinator could not be reached for COORDINATOR_TIMEOUT."""
+
+
+class WorkerAgent(object):
+    """Leases loads from a coordinator, measures them and sends the rows.
+
+    worker_factory builds the measuring object, like for ParallelRunner:
+    measure(url, run_number) returns the rows of a load, close() releases
+    it.  A heartbeat thread keeps the leases held by the agent alive.
+    """
+
+    def __init__(self, coordinator, worker_factory, name=None, token=None,
+                 batch=1):
+        """Doc string."""
+        host, port = parse_address(coordinator)
+        self.url = "http://{0}:{1}".format(host, port)
+        self.worker_factory = worker_factory
+        self.name = name or "{0}-{1}".format(socket.gethostname(),
+                                             os.getpid())
+        self.token = token
+        self.batch = batch
+        self._held = {}
+        self._interval = HEARTBEAT_INTERVAL
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _call(self, path, payload):
+        """POST payload to the coordinator, retrying while it is away."""
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        data = json.dumps(payload).encode('utf-8')
+        give_up = monotonic() + COORDINATOR_TIMEOUT
+        while True:
+            try:
+                response = urlopen(Request(self.url + path, data, headers),
+                                   timeout=REQUEST_TIMEOUT)
+                try:
+                    return _native(json.loads(
+                        response.read().decode('utf-8')))
+                finally:
+                    response.close()
+            except HTTPError:
+                raise
+            except (URLError, socket.error, ValueError):
+                if monotonic() > give_up:
+                    raise CoordinatorGone(self.url)
+                time.sleep(POLL_INTERVAL)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self._interval):
+            with self._lock:
+                leases = list(self._held.items())
+            if not leases:
+                continue
+            try:
+                self._call('/heartbeat', {'worker': self.name,
+                                          'leases': leases})
+            except (CoordinatorGone, HTTPError):
+                pass
+
+    def run(self):
+        """Measure leased loads until the coordinator has no more work."""
+        sampler = HostLoadSampler()
+        worker = self.worker_factory()
+        heartbeat = None
+        try:
+            while True:
+                reply = self._call('/lease', {'worker': self.name,
+                                              'max': self.batch})
+                if heartbeat is None:
+                    self._interval = min(HEARTBEAT_INTERVAL,
+                                         reply['lease_seconds'] / 3.0)
+                    heartbeat = threading.Thread(target=self._heartbeat)
+                    heartbeat.daemon = True
+                    heartbeat.start()
+                if not reply['items']:
+                    if reply['done']:
+                        break
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                with self._lock:
+                    for item in reply['items']:
+                        self._held[item['seq']] = item['lease']
+                for item in reply['items']:
+                    try:
+                        rows = worker.measure(item['url'], item['run'])
+                    except Exception as e:
+                        print("Agent {0} failed on {1}: {2}".format(
+                            self.name, item['url'], e))
+                        rows = []
+                    if rows:
+                        host_load = sampler.sample()
+                        for row in rows:
+                            row.update(host_load)
+                    self._call('/result', {'worker': self.name,
+                                           'seq': item['seq'],
+                                           'lease': item['lease'],
+                                           'rows': rows})
+                    with self._lock:
+                        del self._held[item['seq']]
+        except CoordinatorGone as e:
+            print("Agent {0}: coordinator {1} is gone".format(self.name, e))
+        except HTTPError as e:
+            print("Agent {0}: coordinator refused the request: {1}".format(
+                self.name, e))
+        finally:
+            self._stop.set()
+            worker.close()
+
+
+def _agent_main(coordinator, worker_factory, name, token):
+    WorkerAgent(coordinator, worker_factory, name, token).run()
+
+
+def run_agents(coordinator, worker_factory, workers=1, mode='thread',
+               token=None):
+    """Run workers agents, each with its own browser, until the work ends.
+
+    mode is 'thread' or 'process', like for ParallelRunner.
+    """
+    new_worker = multiprocessing.Process if mode == 'process' \
+        else threading.Thread
+    prefix = "{0}-{1}".format(socket.gethostname(), os.getpid())
+    agents = []
+    for index in range(workers):
+        agent = new_worker(target=_agent_main,
+                           args=(coordinator, worker_factory,
+                                 "{0}-{1}".format(prefix, index), token))
+        agent.daemon = True
+        agent.start()
+        agents.append(agent)
+    for agent in agents:
+        agent.join()
@@ -0,0 +1,159 @@
+"""Pool of warm WebDriver sessions reused across page loads."""
+#################################################
+#
+# Description:  Keep browser sessions alive between measurements, reset
+#               them to a clean state and recycle them after N loads or
+#               once their memory footprint has grown too much.
+#################################################
+import threading
+import time
+
+import proctree
+
+DEFAULT_MAX_LOADS = 50
+DEFAULT_MAX_RSS_GROWTH_MB = 256
+
+
+class _Session(object):
+    """Bookkeeping for one pooled driver."""
+
+    def __init__(self, driver):
+        """Doc string."""
+        self.driver = driver
+        self.loads = 0
+        self.base_rss = proctree.tree_rss(proctree.driver_pid(driver))
+
+
+class DriverPool(object):
+    """Hands out warm WebDriver sessions and recycles them on a policy.
+
+    launcher is a callable returning a new, configured driver.  reset is a
+    callable that brings a used driver back to a clean state (new private
+    context, no cache, cookies or storage, about:blank); if it raises the
+    session is discarded and a fresh one is launched on next acquire.
+    teardown, if given, replaces driver.quit() to end a session.
+    """
+
+    def __init__(self, launcher, reset, max_loads=DEFAULT_MAX_LOADS,
+                 max_rss_growth_mb=DEFAULT_MAX_RSS_GROWTH_MB, teardown=None):
+        """Doc string."""
+        self.launcher = launcher
+        self.reset = reset
+        self.teardown = teardown
+        self.max_loads = max_loads
+        self.max_rss_growth = max_rss_growth_mb * 1024 * 1024
+        self._idle = []
+        self._busy = {}
+        self._lock = threading.Lock()
+        self.stats = {'loads': 0, 'launches': 0, 'recycles': 0,
+                      'launch_time': 0.0, 'quit_time': 0.0,
+                      'reset_time': 0.0}
+
+    def acquire(self):
+        """Return a clean driver, launching a new one if none is idle."""
+        with self._lock:
+            session = self._idle.pop() if self._idle else None
+
+        if session is not None:
+            started = time.time()
+            try:
+                self.reset(session.driver)
+            except Exception:
+                self._quit(session)
+                session = None
+            finally:
+                self._add('reset_time', time.time() - started)
+
+        if session is None:
+            started = time.time()
+            session = _Session(self.launcher())
+            self._add('launch_time', time.time() - started)
+            self._add('launches', 1)
+
+        with self._lock:
+            self._busy[id(session.driver)] = session
+        return session.driver
+
+    def release(self, driver, failed=False):
+        """Give a driver back after a load.
+
+        Failed sessions and sessions due for recycling are quit instead of
+        being returned to the idle list.
+        """
+        with self._lock:
+            session = self._busy.pop(id(driver), None)
+        if session is None:
+            return
+
+        session.loads += 1
+        self._add('loads', 1)
+
+        if failed or self._needs_recycle(session):
+            self._add('recycles', 1)
+            self._quit(session)
+            return
+
+        with self._lock:
+            self._idle.append(session)
+
+    def close(self):
+        """Quit every driver owned by the pool."""
+        with self._lock:
+            sessions = self._idle + list(self._busy.values())
+            self._idle = []
+            self._busy = {}
+        for session in sessions:
+            self._quit(session)
+
+    def _needs_recycle(self, session):
+        """Check the N loads and RSS growth recycle policy."""
+        if self.max_loads and session.loads >= self.max_loads:
+            return True
+        if self.max_rss_growth and session.base_rss:
+            rss = proctree.tree_rss(proctree.driver_pid(session.driver))
+            if rss - session.base_rss > self.max_rss_growth:
+                return True
+        return False
+
+    def _quit(self, session):
+        """Quit a session, ignoring errors from an already dead browser."""
+        started = time.time()
+        try:
+            if self.teardown:
+                self.teardown(session.driver)
+            else:
+                session.driver.quit()
+        except Exception:
+            pass
+        self._add('quit_time', time.time() - started)
+
+    def _add(self, key, value):
+        with self._lock:
+            self.stats[key] += value
+
+    def savings_report(self):
+        """Estimate the wall-clock time saved versus launch-per-load.
+
+        Launch-per-load pays one launch and one quit for every load; the
+        pool pays for its actual launches, quits and resets.
+        """
+        stats = dict(self.stats)
+        launches = stats['launches'] or 1
+        avg_launch = stats['launch_time'] / launches
+        avg_quit = stats['quit_time'] / launches
+        baseline = stats['loads'] * (avg_launch + avg_quit)
+        pooled = stats['launch_time'] + stats['quit_time'] + \
+            stats['reset_time']
+        stats['avg_launch'] = avg_launch
+        stats['avg_quit'] = avg_quit
+        stats['baseline_time'] = baseline
+        stats['pooled_time'] = pooled
+        stats['saved_time'] = baseline - pooled
+        return stats
+
+    def format_savings_report(self):
+        """Return the savings report as a printable line."""
+        return ("Driver pool: {loads} loads, {launches} launches, "
+                "{recycles} recycles, avg launch {avg_launch:.2f}s, "
+                "reset total {reset_time:.2f}s, saved {saved_time:.1f}s "
+                "vs launch-per-load").format(**self.savings_report())
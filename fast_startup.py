@@ -0,0 +1,349 @@
+"""Fast browser startup: lean launch settings and template profiles."""
+#################################################
+#
+# Description:  Launch settings that cut the startup work of a browser
+#               (headless, no GPU, no background services), template
+#               profile directories cloned for every session by reflink
+#               or hard link instead of being built from scratch, and a
+#               benchmark of the session creation latency of each setup.
+#################################################
+import errno
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from harness_timers import monotonic
+from streaming_stats import MetricStats
+
+# Chrome switches turning off work unrelated to the measured page
+CHROME_LEAN_ARGS = [
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-extensions",
+    "--disable-sync",
+    "--disable-client-side-phishing-detection",
+    "--disable-domain-reliability",
+    "--disable-breakpad",
+    "--disable-features=Translate,MediaRouter,OptimizationHints",
+    "--metrics-recording-only",
+    "--mute-audio",
+    "--password-store=basic",
+    "--use-mock-keychain",
+]
+
+# Firefox preferences doing the same
+FIREFOX_LEAN_PREFS = {
+    "app.normandy.enabled": False,
+    "app.update.auto": False,
+    "app.update.enabled": False,
+    "browser.aboutwelcome.enabled": False,
+    "browser.newtabpage.enabled": False,
+    "browser.safebrowsing.downloads.remote.enabled": False,
+    "browser.safebrowsing.malware.enabled": False,
+    "browser.safebrowsing.phishing.enabled": False,
+    "browser.shell.checkDefaultBrowser": False,
+    "browser.startup.homepage_override.mstone": "ignore",
+    "datareporting.healthreport.uploadEnabled": False,
+    "datareporting.policy.dataSubmissionEnabled": False,
+    "extensions.update.enabled": False,
+    "media.autoplay.default": 5,
+    "network.captive-portal-service.enabled": False,
+    "network.connectivity-service.enabled": False,
+    "toolkit.telemetry.enabled": False,
+}
+
+CLONE_METHODS = ('auto', 'reflink', 'hardlink', 'copy')
+# smaller files are copied, linking them saves nothing
+LINK_MIN_SIZE = 64 * 1024
+# Linux FICLONE ioctl, _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+_SQLITE_MAGIC = b'SQLite format 3\x00'
+# profile locks of the session that built the template
+_LOCK_NAMES = frozenset(['SingletonLock', 'SingletonSocket',
+                         'SingletonCookie', 'lock', '.parentlock',
+                         'parent.lock'])
+_UNSUPPORTED = (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY,
+                errno.EPERM, errno.ENOSYS)
+
+# (name, headless, lean, template) launch configurations benchmarked
+STARTUP_CONFIGS = [
+    ("default", False, False, False),
+    ("headless", True, False, False),
+    ("headless+lean", True, True, False),
+    ("headless+lean+template", True, True, True),
+]
+startup_benchmark_columns = ["Config", "Sessions", "Failures",
+                             "Launch p50", "Launch p90", "Launch min",
+                             "Quit p50", "Page Load p50"]
+
+
+def _clonefile():
+    """Return macOS clonefile(2), or None elsewhere."""
+    if sys.platform != 'darwin':
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        return libc.clonefile
+    except (ImportError, OSError, AttributeError):
+        return None
+
+
+_CLONEFILE = _clonefile()
+
+
+def _fs_path(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding())
+
+
+def reflink(source, target):
+    """Copy-on-write clone of a file, OSError where unsupported."""
+    if _CLONEFILE is not None:
+        import ctypes
+        if _CLONEFILE(_fs_path(source), _fs_path(target), 0) != 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported")
+    with open(source, 'rb') as src:
+        with open(target, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            except IOError as e:
+                raise OSError(e.errno, e.strerror)
+    shutil.copymode(source, target)
+
+
+def _rewritten_in_place(path, name):
+    """Tell whether the browser updates a file in place, not by rename.
+
+    SQLite databases and the append-only LevelDB logs are; a hard link to
+    them would let a session write through to the template.
+    """
+    if name.endswith('.log') or name.startswith('MANIFEST-'):
+        return True
+    with open(path, 'rb') as data:
+        return data.read(len(_SQLITE_MAGIC)) == _SQLITE_MAGIC
+
+
+def _link_read_only(source, target):
+    """Hard link a template file, made read-only first.
+
+    A browser can then only replace the file, which breaks the link,
+    never write through it into the template.
+    """
+    mode = os.stat(source).st_mode
+    if mode & 0o222:
+        os.chmod(source, mode & ~0o222)
+    os.link(source, target)
+
+
+def _clone_file(source, target, name, method):
+    """Clone one file, return the method that worked."""
+    if method in ('auto', 'reflink'):
+        try:
+            reflink(source, target)
+            return 'reflink'
+        except OSError as e:
+            if method == 'reflink' or e.errno not in _UNSUPPORTED:
+                raise
+            if os.path.exists(target):
+                os.remove(target)
+            method = 'hardlink'
+    if method == 'hardlink':
+        if os.path.getsize(source) < LINK_MIN_SIZE or \
+                _rewritten_in_place(source, name):
+            shutil.copy2(source, target)
+            return method
+        try:
+            _link_read_only(source, target)
+            return method
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            method = 'copy'
+    shutil.copy2(source, target)
+    return method
+
+
+def clone_tree(source, target, method='auto'):
+    """Clone the profile directory source into the existing target.
+
+    Lock files and symbolic links (Chrome's Singleton* locks) are left
+    out.  Returns the method that worked, 'auto' resolving to 'reflink'
+    or falling back to 'hardlink' where the filesystem cannot clone.
+    """
+    for root, dirs, files in os.walk(source):
+        relative = os.path.relpath(root, source)
+        destination = os.path.normpath(os.path.join(target, relative))
+        for name in dirs:
+            if not os.path.islink(os.path.join(root, name)):
+                os.mkdir(os.path.join(destination, name))
+        dirs[:] = [name for name in dirs
+                   if not os.path.islink(os.path.join(root, name))]
+        for name in files:
+            path = os.path.join(root, name)
+            if name in _LOCK_NAMES or os.path.islink(path) or \
+                    not stat.S_ISREG(os.stat(path).st_mode):
+                continue
+            method = _clone_file(path, os.path.join(destination, name),
+                                 name, method)
+    return method
+
+
+class ProfileTemplate(object):
+    """Template profile directory cloned once per browser session.
+
+    build() lets the browser lay the profile out once; every session then
+    starts from clone(), which is much cheaper than a browser creating a
+    profile from scratch.  Clones are made next to the template, on the
+    same filesystem, so they can share its blocks.  method is one of
+    CLONE_METHODS; 'auto' settles on the cheapest one that works.
+    """
+
+    def __init__(self, path, method='auto'):
+        """Doc string."""
+        self.path = os.path.abspath(path)
+        self.method = method
+        self._clones = {}
+        self._lock = threading.Lock()
+        self.stats = {'clones': 0, 'clone_time': 0.0}
+
+    def ready(self):
+        """Check whether the template directory was built."""
+        return os.path.isdir(self.path) and bool(os.listdir(self.path))
+
+    def build(self, initialise):
+        """Build the template with initialise(directory) unless it exists.
+
+        Returns True when a template was built.
+        """
+        if self.ready():
+            return False
+        parent = os.path.dirname(self.path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        staging = tempfile.mkdtemp(prefix='plt-template-', dir=parent)
+        try:
+            initialise(staging)
+            if os.path.isdir(self.path):
+                os.rmdir(self.path)
+            os.rename(staging, self.path)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return True
+
+    def clone(self):
+        """Return a new private copy of the template."""
+        started = monotonic()
+        target = tempfile.mkdtemp(prefix='plt-profile-',
+                                  dir=os.path.dirname(self.path))
+        try:
+            self.method = clone_tree(self.path, target, self.method)
+        except Exception:
+            shutil.rmtree(target, ignore_errors=True)
+            raise
+        with self._lock:
+            self.stats['clones'] += 1
+            self.stats['clone_time'] += monotonic() - started
+        return target
+
+    def attach(self, driver, clone):
+        """Remember the clone a driver runs on, see release()."""
+        with self._lock:
+            self._clones[id(driver)] = clone
+
+    def release(self, driver):
+        """Remove the clone of a driver that was torn down."""
+        with self._lock:
+            clone = self._clones.pop(id(driver), None)
+        if clone is not None:
+            self.discard(clone)
+
+    def discard(self, clone):
+        """Remove a clone."""
+        shutil.rmtree(clone, ignore_errors=True)
+
+    def close(self):
+        """Remove the clones still attached."""
+        with self._lock:
+            clones = list(self._clones.values())
+            self._clones = {}
+        for clone in clones:
+            self.discard(clone)
+
+    def format_report(self):
+        """Return the clone counters as a printable line."""
+        clones = self.stats['clones']
+        average = 1000.0 * self.stats['clone_time'] / clones if clones else 0
+        return ("Profile template: {0} clones by {1}, {2:.1f} ms "
+                "each").format(clones, self.method, average)
+
+
+def benchmark_startup(configure, session, sessions,
+                      configs=STARTUP_CONFIGS):
+    """Time sessions browser sessions under each launch configuration.
+
+    configure(headless, lean, template) applies a configuration, session()
+    runs one session and returns (launch seconds, quit seconds, page load
+    ms or None), or None when it failed.  Returns one row per
+    configuration with startup_benchmark_columns.
+    """
+    rows = []
+    for name, headless, lean, template in configs:
+        configure(headless, lean, template)
+        launches, quits, loads = MetricStats(), MetricStats(), MetricStats()
+        failures = 0
+        for _ in range(sessions):
+            result = session()
+            if result is None:
+                failures += 1
+                continue
+            launches.add(result[0] * 1000)
+            quits.add(result[1] * 1000)
+            if isinstance(result[2], (int, float)) and result[2] > 0:
+                loads.add(result[2])
+        rows.append({"Config": name, "Sessions": sessions,
+                     "Failures": failures,
+                     "Launch p50": _ms_value(launches, 50),
+                     "Launch p90": _ms_value(launches, 90),
+                     "Launch min": _ms_value(launches),
+                     "Quit p50": _ms_value(quits, 50),
+                     "Page Load p50": _ms_value(loads, 50)})
+    return rows
+
+
+def _ms_value(stats, q=None):
+    """Return the q percentile, or the minimum, of stats as whole ms."""
+    if not stats.count:
+        return "N/A"
+    return int(round(stats.min if q is None else stats.quantile(q)))
+
+
+def format_startup_benchmark(rows):
+    """Return the benchmark rows as a printable table (times in ms)."""
+    lines = ["{0:24} | {1:>8} | {2:>8} | {3:>10} | {4:>10} | {5:>10} "
+             "| {6:>8} | {7:>13}".format(*startup_benchmark_columns)]
+    lines.append("-" * len(lines[0]))
+    for row in rows:
+        lines.append(
+            "{0:24} | {1:>8} | {2:>8} | {3:>10} | {4:>10} | {5:>10} "
+            "| {6:>8} | {7:>13}".format(
+                *[row[column] for column in startup_benchmark_columns]))
+    return "\n".join(lines)
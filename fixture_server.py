@@ -0,0 +1,210 @@
+"""Local fixture web server with controllable latency for harness tests."""
+#################################################
+#
+# Description:  An HTTP and HTTPS server whose pages are described by
+#               their query string: time to first byte, body size, number
+#               of sub-resources and length of the redirect chain leading
+#               to them, so the harness can be benchmarked against known
+#               delays without the live sites.
+#
+#   /page?ttfb=200&size=20000&resources=4&res_ttfb=20&redirects=2
+#################################################
+import os
+import tempfile
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import urlencode
+    from urlparse import urlsplit, parse_qsl
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlencode, urlsplit, parse_qsl
+
+from replay_server import ensure_certificate, server_ssl_context
+
+# parallel connections per host of the browsers, for the expected timings
+BROWSER_CONNECTIONS = 6
+PAGE_PARAMETERS = ('ttfb', 'size', 'resources', 'res_ttfb', 'res_size',
+                   'redirects')
+
+_PAGE_HEAD = b'<!DOCTYPE html><html><head><title>fixture</title></head><body>'
+_PAGE_TAIL = b'</body></html>'
+
+
+class FixturePage(object):
+    """A fixture page and the timings it should produce.
+
+    Times are in ms and sizes in bytes.  The redirects are answered at
+    once, ttfb delays the final page and res_ttfb each sub-resource.
+    """
+
+    def __init__(self, ttfb=100, size=20000, resources=0, res_ttfb=20,
+                 res_size=2000, redirects=0):
+        """Doc string."""
+        self.ttfb = ttfb
+        self.size = size
+        self.resources = resources
+        self.res_ttfb = res_ttfb
+        self.res_size = res_size
+        self.redirects = redirects
+
+    def path(self, page_id=0):
+        """Return the path of the page, page_id tells copies apart."""
+        query = [(name, getattr(self, name)) for name in PAGE_PARAMETERS]
+        return '/page?' + urlencode(query + [('id', page_id)])
+
+    def expected_backend(self):
+        """Lowest possible Backend Time of the page."""
+        return self.ttfb
+
+    def expected_page_load(self, connections=BROWSER_CONNECTIONS):
+        """Lowest possible Page Load of the page.
+
+        The sub-resources are fetched connections at a time once the page
+        arrived.
+        """
+        waves = (self.resources + connections - 1) // connections
+        return self.ttfb + waves * self.res_ttfb
+
+
+def page_body(page, page_id=0):
+    """Return the HTML of a fixture page, padded to its size."""
+    images = b''.join(
+        '<img src="/res/{0}?ttfb={1}&amp;size={2}&amp;id={3}" alt="">'.format(
+            index, page.res_ttfb, page.res_size, page_id).encode('ascii')
+        for index in range(page.resources))
+    body = _PAGE_HEAD + images
+    padding = page.size - len(body) - len(_PAGE_TAIL) - len(b'<!---->')
+    if padding > 0:
+        body += b'<!--' + b'x' * padding + b'-->'
+    return body + _PAGE_TAIL
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    """Serves /page and its /res/ sub-resources."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        """Do the TLS handshake in the handler thread on HTTPS listeners."""
+        if self.server.ssl_context is not None:
+            self.request = self.server.ssl_context.wrap_socket(
+                self.request, server_side=True)
+        BaseHTTPRequestHandler.setup(self)
+
+    def log_message(self, format, *args):
+        """Keep the measurement output clean."""
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        try:
+            params = dict((name, int(value))
+                          for name, value in parse_qsl(parts.query))
+        except ValueError:
+            self.send_error(400, "parameters must be integers")
+            return
+        page_id = params.pop('id', 0)
+        if parts.path == '/page':
+            page = FixturePage(**dict((name, value)
+                                      for name, value in params.items()
+                                      if name in PAGE_PARAMETERS))
+            if page.redirects > 0:
+                page.redirects -= 1
+                self._send(302, b'', Location=page.path(page_id))
+                return
+            time.sleep(page.ttfb / 1000.0)
+            self._send(200, page_body(page, page_id),
+                       **{'Content-Type': 'text/html; charset=utf-8'})
+        elif parts.path.startswith('/res/'):
+            time.sleep(params.get('ttfb', 0) / 1000.0)
+            self._send(200, b'\0' * params.get('size', 0),
+                       **{'Content-Type': 'application/octet-stream'})
+        else:
+            self.send_error(404)
+
+    def _send(self, status, body, **headers):
+        self.send_response(status)
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+
+class _FixtureServer(ThreadingMixIn, HTTPServer):
+    """Threaded fixture listener."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, ssl_context=None):
+        """Doc string."""
+        HTTPServer.__init__(self, address, _FixtureHandler)
+        self.ssl_context = ssl_context
+
+
+class FixtureServer(object):
+    """Local fixture server on an HTTP and, if asked, an HTTPS port.
+
+    The HTTPS certificate is self-signed, so the browsers must be started
+    with certificate errors ignored.
+    """
+
+    def __init__(self, host='127.0.0.1', http_port=0, https_port=0,
+                 https=False, cert_dir=None):
+        """Doc string."""
+        self.host = host
+        self.http_port = http_port
+        self.https_port = https_port
+        self.https = https
+        self.cert_dir = cert_dir or os.path.join(tempfile.gettempdir(),
+                                                 'plt-fixture')
+        self._servers = []
+
+    def start(self):
+        """Start the listeners in daemon threads."""
+        servers = [_FixtureServer((self.host, self.http_port))]
+        if self.https:
+            if not os.path.isdir(self.cert_dir):
+                os.makedirs(self.cert_dir)
+            context = server_ssl_context(*ensure_certificate(self.cert_dir))
+            servers.append(_FixtureServer((self.host, self.https_port),
+                                          ssl_context=context))
+        self.http_port = servers[0].server_address[1]
+        if self.https:
+            self.https_port = servers[1].server_address[1]
+
+        for server in servers:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self._servers.append(server)
+        return self
+
+    def stop(self):
+        """Stop the listeners."""
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def url(self, page, page_id=0, https=False):
+        """Return the URL of a FixturePage on this server."""
+        if https:
+            return "https://{0}:{1}{2}".format(self.host, self.https_port,
+                                               page.path(page_id))
+        return "http://{0}:{1}{2}".format(self.host, self.http_port,
+                                          page.path(page_id))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
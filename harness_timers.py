@@ -0,0 +1,157 @@
+"""Per-phase timers for the harness side of every measurement."""
+#################################################
+#
+# Description:  Time the harness phases of each load (driver launch,
+#               timeouts, get, wait, script, calc, quit) on a monotonic
+#               clock, aggregate them over the run and optionally profile
+#               the run loop with cProfile or a sampling profiler.
+#################################################
+import collections
+import contextlib
+import sys
+import threading
+import time
+import traceback
+
+from streaming_stats import MetricStats
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    monotonic = time.time
+
+PHASES = ["Launch", "Timeouts", "Get", "Wait", "Script", "Calc", "Quit"]
+phase_columns = ["Phase " + phase for phase in PHASES]
+
+
+class PhaseTimer(object):
+    """Collects the duration in ms of each harness phase of one load."""
+
+    def __init__(self):
+        """Doc string."""
+        self.durations = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase name (adds up if repeated)."""
+        started = monotonic()
+        try:
+            yield
+        finally:
+            elapsed = (monotonic() - started) * 1000.0
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+
+    def columns(self):
+        """Return the phase durations as result row columns."""
+        return dict(("Phase " + phase,
+                     round(self.durations[phase], 1)
+                     if phase in self.durations else "N/A")
+                    for phase in PHASES)
+
+
+class PhaseProfile(object):
+    """Aggregates the phase columns of result rows over a run."""
+
+    def __init__(self):
+        """Doc string."""
+        self.stats = dict((phase, MetricStats(quantiles=(95,)))
+                          for phase in PHASES)
+
+    def add(self, row):
+        """Record the phase columns of a result row."""
+        for phase in PHASES:
+            value = row.get("Phase " + phase)
+            if isinstance(value, (int, float)):
+                self.stats[phase].add(value)
+
+    def summary(self):
+        """Return [(phase, count, mean, p95)] for every timed phase."""
+        return [(phase, self.stats[phase].count, self.stats[phase].mean,
+                 self.stats[phase].quantile(95))
+                for phase in PHASES if self.stats[phase].count]
+
+    def format(self):
+        """Return the aggregate profile as a printable table."""
+        lines = ["Harness phase profile (ms):",
+                 "| {0:10} | {1:>7} | {2:>10} | {3:>10} |".format(
+                     "Phase", "Count", "Mean", "p95")]
+        for phase, count, mean, p95 in self.summary():
+            lines.append("| {0:10} | {1:7d} | {2:10.1f} | {3:10.1f} |".format(
+                phase, count, mean, p95))
+        return "\n".join(lines)
+
+
+class SamplingProfiler(object):
+    """Counts the stacks of the profiled thread every interval seconds."""
+
+    def __init__(self, interval=0.005, thread_id=None):
+        """Doc string."""
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = tuple("{0}:{1}:{2}".format(f[0], f[1], f[2])
+                          for f in traceback.extract_stack(frame))
+            self.stacks[stack] += 1
+
+    def start(self):
+        """Start sampling the current (or the configured) thread."""
+        if self.thread_id is None:
+            self.thread_id = threading.current_thread().ident
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling."""
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, output):
+        """Write the samples as collapsed stacks (flame graph input)."""
+        with open(output, 'w') as out_file:
+            for stack, count in self.stacks.most_common():
+                out_file.write("{0} {1}\n".format(";".join(stack), count))
+
+
+@contextlib.contextmanager
+def profiled(kind=None, output=None):
+    """Profile the enclosed block with 'cprofile' or 'sampling'.
+
+    cProfile stats are dumped to output (pstats format) or printed sorted
+    by cumulative time; the sampling profiler writes collapsed stacks.
+    """
+    if not kind:
+        yield
+        return
+
+    if kind == 'cprofile':
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if output:
+                profiler.dump_stats(output)
+            else:
+                pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+    elif kind == 'sampling':
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            profiler.dump(output or 'perftimings_profile.folded')
+    else:
+        raise ValueError("Unknown profiler {0}".format(kind))
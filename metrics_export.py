@@ -0,0 +1,368 @@
+"""Live export of the result metrics for continuous monitoring."""
+#################################################
+#
+# Description:  Per-URL histograms of the metrics of every result row,
+#               served on a Prometheus text format HTTP endpoint and/or
+#               pushed to StatsD over UDP.  The measurement loop only
+#               appends the row to a bounded queue; a background thread
+#               folds the rows into the histograms and sends the UDP
+#               datagrams, so exporting never waits on a lock, a scrape
+#               or the network.  Scrapes only read the histograms.
+#
+#   GET /metrics  ->  plt_page_load_milliseconds_bucket{url="...",le="500"}
+#################################################
+import bisect
+import collections
+import re
+import socket
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from distributed import parse_address
+
+METRIC_PREFIX = "plt"
+# histogram bounds of the ms timings
+MS_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+PERCENT_BUCKETS = (10, 25, 50, 75, 90, 100)
+# Cumulative Layout Shift, good below 0.1 and poor above 0.25
+SHIFT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50)
+# browser CPU use in % of one core, so above 100 on several cores
+CPU_BUCKETS = (10, 25, 50, 100, 200, 400, 800)
+MB_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000)
+THREAD_BUCKETS = (10, 25, 50, 100, 200, 500)
+UNITLESS_METRICS = {"Cumulative Layout Shift": SHIFT_BUCKETS,
+                    "Long Tasks": COUNT_BUCKETS,
+                    "CPU Avg %": CPU_BUCKETS,
+                    "CPU Peak %": CPU_BUCKETS,
+                    "Threads Avg": THREAD_BUCKETS,
+                    "Threads Peak": THREAD_BUCKETS}
+# unit of the exported name and bounds of the other columns not in ms,
+# keyed by the unit suffix of the column name
+UNIT_SUFFIXES = {" MB": ("megabytes", MB_BUCKETS),
+                 " ms": ("milliseconds", MS_BUCKETS)}
+# rows waiting for the export thread, further rows are dropped
+QUEUE_SIZE = 10000
+FLUSH_INTERVAL = 1.0
+STATSD_PORT = 8125
+# keep the datagrams under a typical MTU
+STATSD_PACKET_SIZE = 1432
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _slug(text):
+    text = text.lower().replace('%', ' percent')
+    return re.sub('[^a-z0-9]+', '_', text).strip('_')
+
+
+def _unit(metric):
+    """Return (column name without its unit, unit or None, bounds)."""
+    if metric in UNITLESS_METRICS:
+        return metric, None, UNITLESS_METRICS[metric]
+    if metric.endswith('%'):
+        return metric, None, PERCENT_BUCKETS
+    for suffix, (unit, bounds) in UNIT_SUFFIXES.items():
+        if metric.endswith(suffix):
+            return metric[:-len(suffix)], unit, bounds
+    return metric, "milliseconds", MS_BUCKETS
+
+
+def metric_name(metric, prefix=METRIC_PREFIX):
+    """Return the exported name of a result column, units included."""
+    base, unit, _ = _unit(metric)
+    name = prefix + "_" + _slug(base)
+    return name + "_" + unit if unit else name
+
+
+def buckets_for(metric):
+    """Return the histogram bounds of a result column."""
+    return _unit(metric)[2]
+
+
+def is_timing(metric):
+    """Tell whether a result column is a time in ms."""
+    return _unit(metric)[1] == "milliseconds"
+
+
+def _label_value(value):
+    return u'{0}'.format(value).replace('\\', '\\\\') \
+        .replace('"', '\\"').replace('\n', '\\n')
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Histogram(object):
+    """Bucket counts, sum and count of one metric of one series."""
+
+    def __init__(self, bounds):
+        """Doc string, bounds are the sorted upper bucket bounds."""
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Count a value in the first bucket whose bound is >= value."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Yield (le, count of values <= le), ending with +Inf."""
+        total = 0
+        for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the histograms on /metrics."""
+
+    def log_message(self, format, *args):
+        """Keep the measurement output clean."""
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.exporter.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    """Threaded scrape listener."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, exporter):
+        """Doc string."""
+        HTTPServer.__init__(self, address, _MetricsHandler)
+        self.exporter = exporter
+
+
+class MetricsExporter(object):
+    """Exports the result rows of a run while it goes on.
+
+    metrics are the numeric row columns exported, each as one histogram
+    per url (and per group_by value, e.g. the view of repeat-view runs).
+    listen is the "host:port" of the scrape endpoint, statsd the
+    "host[:port]" of a StatsD daemon receiving every value as a timer (ms
+    metrics) or histogram sample.  Either may be None.
+    """
+
+    def __init__(self, metrics, listen=None, statsd=None, group_by=None,
+                 prefix=METRIC_PREFIX, queue_size=QUEUE_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        """Doc string."""
+        self.metrics = list(metrics)
+        self.group_by = group_by
+        self.prefix = prefix
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.listen = parse_address(listen) if listen else None
+        self.statsd = None
+        if statsd:
+            if ':' not in statsd:
+                statsd += ':{0}'.format(STATSD_PORT)
+            host, port = parse_address(statsd)
+            self.statsd = ('127.0.0.1' if host == '0.0.0.0' else host, port)
+        self.stats = {'rows': 0, 'dropped': 0, 'datagrams': 0,
+                      'send_errors': 0}
+        # deque appends and pops are atomic, the measurement loop takes
+        # no lock
+        self._pending = collections.deque()
+        self._histograms = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+        self._socket = None
+
+    def start(self):
+        """Open the scrape listener and start the export thread."""
+        if self.listen:
+            self._server = _MetricsServer(self.listen, self)
+            thread = threading.Thread(target=self._server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        if self.statsd:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+        self._thread = threading.Thread(target=self._export_loop)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    @property
+    def address(self):
+        """host:port the scrape endpoint listens on, or None."""
+        if self._server is None:
+            return None
+        return "{0}:{1}".format(*self._server.server_address[:2])
+
+    def observe(self, row):
+        """Queue a result row for export, never blocks.
+
+        The row is copied, the harness reuses its dict for the next load.
+        Rows are dropped, and counted, while the export thread is
+        queue_size rows behind.
+        """
+        if len(self._pending) >= self.queue_size:
+            self.stats['dropped'] += 1
+            return
+        self._pending.append(dict(row))
+
+    def _series(self, row):
+        labels = [("url", row.get("url"))]
+        if self.group_by and row.get(self.group_by) is not None:
+            labels.append((_slug(self.group_by), row[self.group_by]))
+        return tuple(labels)
+
+    def _drain(self):
+        """Fold the queued rows into the histograms, return them."""
+        rows = []
+        while True:
+            try:
+                rows.append(self._pending.popleft())
+            except IndexError:
+                break
+        if not rows:
+            return rows
+        with self._lock:
+            for row in rows:
+                series = self._series(row)
+                for metric in self.metrics:
+                    value = row.get(metric)
+                    if not _is_number(value):
+                        continue
+                    key = (metric, series)
+                    histogram = self._histograms.get(key)
+                    if histogram is None:
+                        histogram = self._histograms[key] = \
+                            Histogram(buckets_for(metric))
+                    histogram.observe(value)
+            self.stats['rows'] += len(rows)
+        return rows
+
+    def _statsd_lines(self, row):
+        url = _slug(u'{0}'.format(row.get("url")))
+        if self.group_by and row.get(self.group_by) is not None:
+            url += "." + _slug(u'{0}'.format(row[self.group_by]))
+        for metric in self.metrics:
+            value = row.get(metric)
+            if not _is_number(value):
+                continue
+            kind = 'ms' if is_timing(metric) else 'h'
+            yield u"{0}.{1}.{2}:{3}|{4}".format(self.prefix, url,
+                                                _slug(metric), value, kind)
+
+    def _push(self, rows):
+        """Send the values of rows to StatsD, several per datagram."""
+        packet = []
+        size = 0
+        for row in rows:
+            for line in self._statsd_lines(row):
+                line = line.encode('utf-8')
+                if packet and size + len(line) + 1 > STATSD_PACKET_SIZE:
+                    self._send(b'\n'.join(packet))
+                    packet, size = [], 0
+                packet.append(line)
+                size += len(line) + 1
+        if packet:
+            self._send(b'\n'.join(packet))
+
+    def _send(self, datagram):
+        try:
+            self._socket.sendto(datagram, self.statsd)
+            self.stats['datagrams'] += 1
+        except socket.error:
+            # a full socket buffer or an unreachable daemon loses the
+            # sample, not the measurement
+            self.stats['send_errors'] += 1
+
+    def _export_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Fold, and push, the rows queued so far.
+
+        Runs on the export thread, and in close() once it has stopped.
+        """
+        rows = self._drain()
+        if rows and self._socket is not None:
+            self._push(rows)
+
+    def render(self):
+        """Return the histograms in the Prometheus text format.
+
+        Called on the scrape threads, it reads what the export thread has
+        folded so far and leaves the queued rows to it.
+        """
+        lines = []
+        with self._lock:
+            families = collections.OrderedDict()
+            for (metric, series), histogram in self._histograms.items():
+                families.setdefault(metric, []).append((series, histogram))
+            for metric in self.metrics:
+                if metric not in families:
+                    continue
+                name = metric_name(metric, self.prefix)
+                lines.append("# HELP {0} {1} of the page loads.".format(
+                    name, metric))
+                lines.append("# TYPE {0} histogram".format(name))
+                for series, histogram in families[metric]:
+                    labels = u",".join(u'{0}="{1}"'.format(
+                        label, _label_value(value))
+                        for label, value in series)
+                    for bound, count in histogram.cumulative():
+                        lines.append(u'{0}_bucket{{{1},le="{2}"}} {3}'.format(
+                            name, labels, bound, count))
+                    lines.append(u'{0}_sum{{{1}}} {2}'.format(
+                        name, labels, histogram.sum))
+                    lines.append(u'{0}_count{{{1}}} {2}'.format(
+                        name, labels, histogram.count))
+            name = self.prefix + "_exporter_dropped_rows_total"
+            lines.append("# HELP {0} Rows dropped while the export thread "
+                         "was behind.".format(name))
+            lines.append("# TYPE {0} counter".format(name))
+            lines.append("{0} {1}".format(name, self.stats['dropped']))
+        return u"\n".join(lines) + u"\n"
+
+    def close(self):
+        """Export the last rows and stop the endpoint."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def format_report(self):
+        """Return the export counters as a printable line."""
+        line = "Metrics export: {0} rows, {1} dropped".format(
+            self.stats['rows'], self.stats['dropped'])
+        if self.statsd:
+            line += ", {0} StatsD datagrams, {1} send errors".format(
+                self.stats['datagrams'], self.stats['send_errors'])
+        return line
@@ -0,0 +1,341 @@
+"""Network condition profiles and a local traffic shaping proxy."""
+#################################################
+#
+# Description:  Named throughput/latency/packet loss profiles and a
+#               forward proxy (CONNECT and absolute URL requests) that
+#               enforces them on any browser pointed at it, so throttled
+#               runs are repeatable whatever the host's network.
+#################################################
+import random
+import socket
+import threading
+import time
+
+try:
+    from SocketServer import ThreadingMixIn, TCPServer, StreamRequestHandler
+    from urlparse import urlsplit
+except ImportError:
+    from socketserver import ThreadingMixIn, TCPServer, StreamRequestHandler
+    from urllib.parse import urlsplit
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+NETWORK_COLUMN = "Network"
+CHUNK_SIZE = 16 * 1024
+CONNECT_TIMEOUT = 30
+# a lost segment costs roughly one retransmission timeout
+MIN_RTO = 0.2
+# loss applies to TCP segments, a read chunk holds several of them
+SEGMENT_SIZE = 1460
+
+
+class NetworkProfile(object):
+    """Link throughput (kbit/s), round trip time (ms) and packet loss (%).
+
+    A throughput of 0 means unlimited.
+    """
+
+    def __init__(self, name, down_kbps, up_kbps, rtt_ms, loss=0.0):
+        """Doc string."""
+        self.name = name
+        self.down_kbps = down_kbps
+        self.up_kbps = up_kbps
+        self.rtt_ms = rtt_ms
+        self.loss = loss
+
+    def devtools_conditions(self):
+        """Keyword arguments of Chrome's set_network_conditions."""
+        def throughput(kbps):
+            # bytes per second, -1 disables the throttling
+            return kbps * 1000 // 8 if kbps else -1
+        return {"offline": False, "latency": self.rtt_ms,
+                "download_throughput": throughput(self.down_kbps),
+                "upload_throughput": throughput(self.up_kbps)}
+
+    def __str__(self):
+        return self.name
+
+
+# WebPageTest connectivity presets
+PRESETS = [
+    NetworkProfile("2G", 280, 256, 800),
+    NetworkProfile("3GSlow", 400, 400, 400),
+    NetworkProfile("3G", 1600, 768, 300),
+    NetworkProfile("3GFast", 1600, 768, 150),
+    NetworkProfile("4G", 9000, 9000, 170),
+    NetworkProfile("LTE", 12000, 12000, 70),
+    NetworkProfile("DSL", 1500, 384, 50),
+    NetworkProfile("cable", 5000, 1000, 28),
+    NetworkProfile("FIOS", 20000, 5000, 4),
+]
+PROFILES = dict((p.name.lower(), p) for p in PRESETS)
+
+
+def parse_profile(text):
+    """Return the profile named text, or a custom one.
+
+    Custom profiles read "down_kbps/up_kbps/rtt_ms[/loss_percent]".
+    Raises ValueError when text is neither.
+    """
+    profile = PROFILES.get(text.lower())
+    if profile is not None:
+        return profile
+    try:
+        values = [float(v) for v in text.split('/')]
+    except ValueError:
+        values = []
+    if len(values) not in (3, 4) or min(values) < 0 or \
+            (len(values) == 4 and values[3] >= 100):
+        raise ValueError(
+            "unknown network profile {0!r}, use one of {1} or "
+            "down_kbps/up_kbps/rtt_ms[/loss_percent]".format(
+                text, ", ".join(p.name for p in PRESETS)))
+    down, up, rtt = int(values[0]), int(values[1]), int(values[2])
+    loss = values[3] if len(values) == 4 else 0.0
+    return NetworkProfile(text, down, up, rtt, loss)
+
+
+class _Link(object):
+    """One direction of the emulated link, shared by all connections."""
+
+    def __init__(self, kbps, one_way_delay, loss):
+        """Doc string."""
+        self.bytes_per_sec = kbps * 1000 / 8.0 if kbps else None
+        self.one_way_delay = one_way_delay
+        self.loss = loss / 100.0
+        self.free_at = 0.0
+        self.lock = threading.Lock()
+
+    def schedule(self, size):
+        """Return (sent, delivered) times of a chunk entering the link now.
+
+        sent is when its last byte left the bottleneck, delivered when it
+        reaches the other end.  Each SEGMENT_SIZE segment of the chunk is
+        lost with the link's probability; lost segments are sent again,
+        and the chunk waits one retransmission timeout for them.
+        """
+        lost = 0
+        if self.loss:
+            segments = -(-size // SEGMENT_SIZE)
+            lost = sum(1 for _ in range(segments)
+                       if random.random() < self.loss)
+        wire = size + lost * SEGMENT_SIZE
+        now = time.time()
+        with self.lock:
+            start = max(now, self.free_at)
+            sent = start + (wire / self.bytes_per_sec
+                            if self.bytes_per_sec else 0.0)
+            self.free_at = sent
+        delivered = sent + self.one_way_delay
+        if lost:
+            delivered += max(MIN_RTO, 2 * self.one_way_delay)
+        return sent, delivered
+
+
+def _pipe(source, destination, link):
+    """Relay source to destination through the link until either closes.
+
+    A reader thread pushes the chunks on a delay line, this thread writes
+    them out once they are due, so latency does not cap the throughput.
+    """
+    line = queue.Queue()
+
+    def read():
+        try:
+            while True:
+                data = source.recv(CHUNK_SIZE)
+                if not data:
+                    break
+                sent, delivered = link.schedule(len(data))
+                line.put((delivered, data))
+                # back pressure: wait for the bottleneck to drain the chunk
+                time.sleep(max(0.0, sent - time.time()))
+        except socket.error:
+            pass
+        line.put(None)
+
+    reader = threading.Thread(target=read)
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            item = line.get()
+            if item is None:
+                break
+            delivered, data = item
+            time.sleep(max(0.0, delivered - time.time()))
+            destination.sendall(data)
+    except socket.error:
+        pass
+    finally:
+        try:
+            destination.shutdown(socket.SHUT_WR)
+        except socket.error:
+            pass
+
+
+class _ShapingHandler(StreamRequestHandler):
+    """Opens the upstream connection and relays both directions."""
+
+    # unbuffered, no byte past the request head may be left in a buffer
+    rbufsize = 0
+
+    def handle(self):
+        head = self._read_head()
+        if not head:
+            return
+        request_line = head.split(b'\r\n', 1)[0].decode('latin-1')
+        try:
+            method, target, version = request_line.split(' ', 2)
+        except ValueError:
+            return
+        server = self.server
+        upstream_addr = server.upstream
+
+        try:
+            if method.upper() == 'CONNECT':
+                host, _, port = target.rpartition(':')
+                upstream = socket.create_connection(
+                    upstream_addr or (host, int(port or 443)),
+                    CONNECT_TIMEOUT)
+                if upstream_addr:
+                    upstream.sendall(head)
+                else:
+                    # the handshake the browser would have paid for
+                    time.sleep(server.profile.rtt_ms / 1000.0)
+                    self.connection.sendall(
+                        b'HTTP/1.1 200 Connection Established\r\n\r\n')
+            else:
+                parts = urlsplit(target)
+                upstream = socket.create_connection(
+                    upstream_addr or (parts.hostname, parts.port or 80),
+                    CONNECT_TIMEOUT)
+                if not upstream_addr:
+                    time.sleep(server.profile.rtt_ms / 1000.0)
+                    head = _origin_form(head, method, parts, version)
+                upstream.sendall(head)
+        except (socket.error, ValueError):
+            return
+
+        for sock in (self.connection, upstream):
+            sock.settimeout(None)
+        uplink = threading.Thread(target=_pipe, args=(
+            self.connection, upstream, server.uplink))
+        uplink.daemon = True
+        uplink.start()
+        _pipe(upstream, self.connection, server.downlink)
+        uplink.join()
+        upstream.close()
+
+    def _read_head(self):
+        """Read the request head, up to and including the blank line."""
+        lines = []
+        while True:
+            line = self.rfile.readline(65537)
+            if not line:
+                return None
+            lines.append(line)
+            if line in (b'\r\n', b'\n'):
+                return b''.join(lines)
+
+
+def _origin_form(head, method, parts, version):
+    """Rewrite an absolute URL request for the origin server.
+
+    The connection is closed after one exchange so that a keep-alive
+    browser does not send its next request, maybe for another host, down
+    the same upstream socket.
+    """
+    path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    lines = head.split(b'\r\n')
+    kept = [line for line in lines[1:] if line and not line.lower()
+            .startswith((b'connection:', b'proxy-connection:',
+                         b'keep-alive:'))]
+    return b'\r\n'.join(
+        ["{0} {1} {2}".format(method, path, version).encode('latin-1')] +
+        kept + [b'Connection: close', b'', b''])
+
+
+class _ShapingServer(ThreadingMixIn, TCPServer):
+    """Threaded listener sharing the two directions of the link."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, profile, upstream):
+        """Doc string."""
+        TCPServer.__init__(self, address, _ShapingHandler)
+        self.profile = profile
+        self.upstream = upstream
+        one_way = profile.rtt_ms / 2000.0
+        self.uplink = _Link(profile.up_kbps, one_way, profile.loss)
+        self.downlink = _Link(profile.down_kbps, one_way, profile.loss)
+
+
+class ShapingProxy(object):
+    """Local forward proxy enforcing a NetworkProfile.
+
+    Every connection crosses the same emulated link: throughput is shared
+    like on a real access link, each direction adds half the RTT and lost
+    packets are approximated as retransmission delays.  upstream, a
+    "host:port" proxy, chains it in front of another proxy such as the
+    record/replay server.
+    """
+
+    def __init__(self, profile, host='127.0.0.1', port=0, upstream=None):
+        """Doc string."""
+        self.profile = profile
+        self.host = host
+        self.port = port
+        self.upstream = None
+        if upstream:
+            up_host, _, up_port = upstream.rpartition(':')
+            self.upstream = (up_host, int(up_port))
+        self._server = None
+
+    def start(self):
+        """Start the listener in a daemon thread."""
+        self._server = _ShapingServer((self.host, self.port), self.profile,
+                                      self.upstream)
+        self.port = self._server.server_address[1]
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """Stop the listener."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def proxy_address(self):
+        """host:port of the proxy listener."""
+        return "{0}:{1}".format(self.host, self.port)
+
+    def chrome_args(self):
+        """Chrome switches sending all traffic through the proxy."""
+        return ["--proxy-server=" + self.proxy_address,
+                "--proxy-bypass-list=<-loopback>"]
+
+    def firefox_prefs(self):
+        """Firefox preferences sending all traffic through the proxy."""
+        return {
+            "network.proxy.type": 1,
+            "network.proxy.http": self.host,
+            "network.proxy.http_port": self.port,
+            "network.proxy.ssl": self.host,
+            "network.proxy.ssl_port": self.port,
+            "network.proxy.no_proxies_on": "",
+            "network.proxy.allow_hijacking_localhost": True}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,202 @@
+"""JavaScript snippets run in the measured page through WebDriver."""
+#################################################
+#
+# Description:  In-page scripts shared by the Chrome and Firefox load
+#               tests.
+#################################################
+
+# execute_async_script: resolves in-page once loadEventEnd is set and,
+# when arguments[0] (ms) is non zero, once no new resource was fetched for
+# that long.  Returns the whole Navigation Timing payload, so waiting for
+# the load and reading the timings costs a single WebDriver round trip.
+LOAD_COMPLETE_SCRIPT = """
+var quietMs = arguments[0];
+var done = arguments[arguments.length - 1];
+var timing = window.performance.timing;
+
+function finish() {
+    done(timing.toJSON());
+}
+
+function whenQuiet() {
+    if (!quietMs) {
+        finish();
+        return;
+    }
+    var seen = performance.getEntriesByType('resource').length;
+    var timer = setInterval(function () {
+        var now = performance.getEntriesByType('resource').length;
+        if (now === seen) {
+            clearInterval(timer);
+            finish();
+        }
+        seen = now;
+    }, quietMs);
+}
+
+function afterLoad() {
+    // loadEventEnd is only set once every load handler has returned
+    if (timing.loadEventEnd > 0) {
+        whenQuiet();
+    } else {
+        setTimeout(afterLoad, 0);
+    }
+}
+
+if (document.readyState === 'complete') {
+    afterLoad();
+} else {
+    window.addEventListener('load', afterLoad);
+}
+"""
+
+NAVIGATION_TIMING_SCRIPT = "return window.performance.timing"
+
+READY_STATE_SCRIPT = "return document.readyState"
+
+# execute_script(RESOURCE_TIMING_SCRIPT, navigation_fields, resource_fields):
+# returns the Navigation Timing 2 entry and every Resource Timing entry
+# as plain lists in field order, which keeps the WebDriver payload small.
+RESOURCE_TIMING_SCRIPT = """
+var navFields = arguments[0];
+var resFields = arguments[1];
+function pick(fields) {
+    return function (entry) {
+        return fields.map(function (f) {
+            var v = entry[f];
+            return v === undefined ? null : v;
+        });
+    };
+}
+var nav = performance.getEntriesByType('navigation')[0];
+return {
+    navigation: nav ? pick(navFields)(nav) : null,
+    resources: performance.getEntriesByType('resource').map(pick(resFields))
+};
+"""
+
+# execute_script(CACHE_STATS_SCRIPT): returns [entries, hits, revalidated,
+# bytes, cached_bytes] over the navigation and resource entries that
+# expose their sizes (cross-origin ones without Timing-Allow-Origin report
+# 0). transferSize is 0 for a body served from the HTTP cache and only
+# covers the headers of a 304 revalidation.
+CACHE_STATS_SCRIPT = """
+var entries = performance.getEntriesByType('navigation')
+    .concat(performance.getEntriesByType('resource'));
+var stats = [0, 0, 0, 0, 0];
+entries.forEach(function (e) {
+    if (!e.decodedBodySize) {
+        return;
+    }
+    stats[0] += 1;
+    stats[3] += e.encodedBodySize;
+    if (e.transferSize === 0) {
+        stats[1] += 1;
+        stats[4] += e.encodedBodySize;
+    } else if (e.transferSize < e.encodedBodySize) {
+        stats[2] += 1;
+        stats[4] += e.encodedBodySize;
+    }
+});
+return stats;
+"""
+
+# Installs PerformanceObserver collectors for the Core Web Vitals in
+# window.__pltVitals. Meant to run before any page script (e.g. through
+# Page.addScriptToEvaluateOnNewDocument); run after the load it only sees
+# the entry types the browser buffers.
+VITALS_OBSERVER_SCRIPT = """
+(function () {
+    if (window.__pltVitals || !window.PerformanceObserver) {
+        return;
+    }
+    var v = window.__pltVitals = {
+        fcp: null, lcp: null, cls: 0, tasks: [], types: [],
+        lastEntry: performance.now(),
+        clsWindow: 0, clsFirst: 0, clsLast: 0
+    };
+    var supported = PerformanceObserver.supportedEntryTypes || [];
+    function observe(type, callback) {
+        if (supported.indexOf(type) < 0) {
+            return;
+        }
+        new PerformanceObserver(function (list) {
+            list.getEntries().forEach(callback);
+            v.lastEntry = performance.now();
+        }).observe({type: type, buffered: true});
+        v.types.push(type);
+    }
+    observe('paint', function (e) {
+        if (e.name === 'first-contentful-paint') {
+            v.fcp = e.startTime;
+        }
+    });
+    observe('largest-contentful-paint', function (e) {
+        v.lcp = e.startTime;
+    });
+    // CLS is the largest session window: shifts less than 1s apart,
+    // at most 5s long, ignoring those right after user input
+    observe('layout-shift', function (e) {
+        if (e.hadRecentInput) {
+            return;
+        }
+        if (v.clsWindow && e.startTime - v.clsLast < 1000 &&
+                e.startTime - v.clsFirst < 5000) {
+            v.clsWindow += e.value;
+        } else {
+            v.clsWindow = e.value;
+            v.clsFirst = e.startTime;
+        }
+        v.clsLast = e.startTime;
+        v.cls = Math.max(v.cls, v.clsWindow);
+    });
+    observe('longtask', function (e) {
+        v.tasks.push([e.startTime, e.duration]);
+    });
+})();
+"""
+
+# execute_async_script(VITALS_COLLECT_SCRIPT, max_wait_ms, quiet_ms):
+# resolves once the observers saw no new entry for quiet_ms (at once if
+# the page already went quiet), or after max_wait_ms. Total Blocking Time
+# sums the part over 50 ms of every long task after First Contentful
+# Paint. Metrics whose entry type is not supported are null.
+VITALS_COLLECT_SCRIPT = """
+var maxWait = arguments[0];
+var quiet = arguments[1];
+var done = arguments[arguments.length - 1];
+var started = performance.now();
+
+function collect(v) {
+    var has = function (type) { return v.types.indexOf(type) >= 0; };
+    var tbt = 0;
+    var fcp = v.fcp || 0;
+    v.tasks.forEach(function (t) {
+        var blocking = t[0] + t[1] - Math.max(t[0], fcp) - 50;
+        if (blocking > 0) {
+            tbt += blocking;
+        }
+    });
+    done({
+        fcp: v.fcp,
+        lcp: v.lcp,
+        cls: has('layout-shift') ? v.cls : null,
+        tbt: has('longtask') ? tbt : null,
+        longTasks: has('longtask') ? v.tasks.length : null
+    });
+}
+
+(function check() {
+    var v = window.__pltVitals;
+    if (!v) {
+        done(null);
+        return;
+    }
+    var now = performance.now();
+    if (now - v.lastEntry >= quiet || now - started >= maxWait) {
+        collect(v);
+    } else {
+        setTimeout(check, Math.min(50, quiet));
+    }
+})();
+"""
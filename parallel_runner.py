@@ -0,0 +1,259 @@
+"""Run page loads concurrently over a pool of independent browser workers."""
+#################################################
+#
+# Description:  Spread (url, run) work items over N thread or process
+#               workers, each owning its own browser, and collect the
+#               results tagged with the host load seen at sample time.
+#################################################
+import multiprocessing
+import os
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+LOAD_AVG = "Load Avg"
+CPU_STEAL = "CPU Steal"
+host_load_columns = [LOAD_AVG, CPU_STEAL]
+
+# A browser under load keeps roughly two cores busy (renderer + browser/GPU)
+CORES_PER_BROWSER = 2
+
+# work items queued ahead per worker, bounds memory on huge URL lists
+QUEUE_DEPTH = 16
+# seconds the results of a dead worker may still be in transit
+LOST_GRACE = 1.0
+
+
+def cpu_count():
+    """Return the number of usable CPUs."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def _free_cores():
+    """Return (cores, load average): the budget of check_capacity."""
+    return cpu_count(), HostLoadSampler().load_avg() or 0.0
+
+
+def default_workers():
+    """Return the most browser workers check_capacity accepts, at least 1."""
+    cores, busy = _free_cores()
+    return max(1, int(min(cores, cores + 1 - busy)) // CORES_PER_BROWSER)
+
+
+def check_capacity(workers, allow_oversubscribe=False):
+    """Refuse a worker count that would oversubscribe the host cores.
+
+    Raises ValueError when the workers, plus the load the host already
+    carries, need more cores than are available.
+    """
+    if allow_oversubscribe:
+        return
+    cores, busy = _free_cores()
+    needed = workers * CORES_PER_BROWSER
+    if needed > cores or needed + busy > cores + 1:
+        raise ValueError(
+            "{0} workers need ~{1} cores but only {2} are available "
+            "(load average {3:.2f})".format(workers, needed, cores, busy))
+
+
+class HostLoadSampler(object):
+    """Samples the 1 minute load average and the CPU steal percentage."""
+
+    def __init__(self):
+        """Doc string."""
+        self._last_cpu = self._read_cpu()
+
+    @staticmethod
+    def _read_cpu():
+        """Return (steal, total) jiffies from /proc/stat, or None."""
+        try:
+            with open('/proc/stat', 'r') as stat_file:
+                fields = [int(f) for f in stat_file.readline().split()[1:]]
+        except (IOError, OSError, ValueError):
+            return None
+        steal = fields[7] if len(fields) > 7 else 0
+        return steal, sum(fields[:8])
+
+    @staticmethod
+    def load_avg():
+        """Return the 1 minute load average, or None if unsupported."""
+        try:
+            return os.getloadavg()[0]
+        except (AttributeError, OSError):
+            return None
+
+    def cpu_steal(self):
+        """Return the CPU steal percentage since the previous call."""
+        current = self._read_cpu()
+        last, self._last_cpu = self._last_cpu, current
+        if current is None or last is None or current[1] == last[1]:
+            return None
+        return 100.0 * (current[0] - last[0]) / (current[1] - last[1])
+
+    def sample(self):
+        """Return the host load columns for a result row."""
+        load_avg = self.load_avg()
+        steal = self.cpu_steal()
+        return {
+            LOAD_AVG: round(load_avg, 2) if load_avg is not None else "N/A",
+            CPU_STEAL: round(steal, 2) if steal is not None else "N/A"}
+
+
+def _worker_loop(worker_id, worker_factory, work_queue, result_queue):
+    """Measure every item of this worker's queue until the None sentinel.
+
+    worker_factory builds the measuring object inside the worker, it must
+    provide measure(url, run_number) returning the list of row dicts of
+    that load (empty when it failed) and close().
+    """
+    sampler = HostLoadSampler()
+    worker = worker_factory()
+    try:
+        while True:
+            item = work_queue.get()
+            if item is None:
+                break
+            seq, url, run_number = item
+            try:
+                rows = worker.measure(url, run_number)
+            except Exception as e:
+                print("Worker {0} failed on {1}: {2}".format(
+                    worker_id, url, e))
+                rows = []
+            if rows:
+                host_load = sampler.sample()
+                for row in rows:
+                    row.update(host_load)
+            result_queue.put((seq, worker_id, rows))
+    finally:
+        worker.close()
+        result_queue.put((None, worker_id, None))
+
+
+class ParallelRunner(object):
+    """Runs work items over N independent browser workers.
+
+    mode is 'thread' or 'process'.  With ordered=True results are yielded
+    in submission order, otherwise as soon as they complete; every result
+    carries its sequence number and the id of the worker that produced it.
+    Work items are consumed lazily, at most queue_depth ahead per worker.
+    In ordered mode the items of a worker that died are yielded as failed
+    loads, with no rows, so that the later results are not held back.
+    """
+
+    def __init__(self, worker_factory, workers=None, mode='thread',
+                 ordered=True, queue_depth=QUEUE_DEPTH):
+        """Doc string."""
+        if mode not in ('thread', 'process'):
+            raise ValueError("mode must be 'thread' or 'process'")
+        self.worker_factory = worker_factory
+        self.workers = workers or default_workers()
+        self.mode = mode
+        self.ordered = ordered
+        self.queue_depth = queue_depth
+
+    def run(self, work_items):
+        """Measure (url, run_number) work items, yield (seq, worker, rows).
+
+        Items are dealt round-robin into one queue per worker so that each
+        browser sees an evenly interleaved share of the URLs.
+        """
+        if self.mode == 'process':
+            new_queue = multiprocessing.Queue
+            new_worker = multiprocessing.Process
+        else:
+            new_queue = queue.Queue
+            new_worker = threading.Thread
+
+        result_queue = new_queue()
+        work_queues = [new_queue(self.queue_depth)
+                       for _ in range(self.workers)]
+
+        def put(worker_id, item):
+            # the items of a dead worker are dropped, not waited on
+            while procs[worker_id].is_alive():
+                try:
+                    work_queues[worker_id].put(item, timeout=1)
+                    return
+                except queue.Full:
+                    continue
+
+        def feed():
+            for seq, (url, run_number) in enumerate(work_items):
+                put(seq % self.workers, (seq, url, run_number))
+                fed[0] = seq + 1
+            for worker_id in range(self.workers):
+                put(worker_id, None)
+
+        procs = []
+        fed = [0]
+        for worker_id, work_queue in enumerate(work_queues):
+            proc = new_worker(target=_worker_loop,
+                              args=(worker_id, self.worker_factory,
+                                    work_queue, result_queue))
+            proc.daemon = True
+            proc.start()
+            procs.append(proc)
+
+        # fork the workers before the feeder thread starts
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+
+        pending = {}
+        next_seq = 0
+        finished = set()
+        dead_since = {}
+
+        def lost(worker_id):
+            """True once no more results of worker_id can come."""
+            if worker_id in finished:
+                return True
+            if procs[worker_id].is_alive():
+                return False
+            # a process killed hard may have flushed its last results
+            noticed = dead_since.setdefault(worker_id, time.time())
+            return time.time() - noticed >= LOST_GRACE
+
+        while len(finished) < len(procs):
+            try:
+                seq, worker_id, rows = result_queue.get(timeout=1)
+            except queue.Empty:
+                # a worker process killed hard never sends its sentinel
+                if not any(proc.is_alive() for proc in procs):
+                    break
+            else:
+                if seq is None:
+                    finished.add(worker_id)
+                elif not self.ordered:
+                    yield seq, worker_id, rows
+                elif seq >= next_seq:
+                    # lower ones were given up on, their worker being dead
+                    pending[seq] = (seq, worker_id, rows)
+            if not self.ordered:
+                continue
+            while True:
+                owner = next_seq % self.workers
+                if next_seq in pending:
+                    yield pending.pop(next_seq)
+                elif next_seq < fed[0] and lost(owner):
+                    yield next_seq, owner, []
+                else:
+                    break
+                next_seq += 1
+
+        # the items a crashed worker took or was dealt never come back
+        feeder.join()
+        if self.ordered:
+            for seq in range(next_seq, fed[0]):
+                yield pending.pop(seq, (seq, seq % self.workers, []))
+
+        for proc in procs:
+            proc.join()
@@ -0,0 +1,203 @@
+"""Process tree inspection helpers shared by the load test scripts."""
+#################################################
+#
+# Description:  Helpers to inspect the process tree of a browser session
+#################################################
+import os
+import signal
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def tracking_available():
+    """Tell whether process trees can be read, through psutil or /proc.
+
+    Without either (e.g. MacOSX without psutil) every helper below finds
+    no process at all.
+    """
+    return psutil is not None or os.path.isdir('/proc')
+
+
+def _proc_ppid_map():
+    """Return a {pid: ppid} map read from /proc."""
+    ppids = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{0}/stat'.format(entry), 'r') as stat_file:
+                stat = stat_file.read()
+        except (IOError, OSError):
+            continue
+        # the command name may contain spaces, fields start after ')'
+        fields = stat[stat.rfind(')') + 2:].split()
+        ppids[int(entry)] = int(fields[1])
+    return ppids
+
+
+def descendants(pid):
+    """Return the pids of every process below pid (not pid itself)."""
+    if not pid:
+        return []
+    if psutil is not None:
+        try:
+            return [p.pid for p in psutil.Process(pid).children(recursive=True)]
+        except psutil.Error:
+            return []
+    if not os.path.isdir('/proc'):
+        return []
+
+    children = {}
+    for child, parent in _proc_ppid_map().items():
+        children.setdefault(parent, []).append(child)
+
+    found = []
+    pending = [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+
+def process_rss(pid):
+    """Return the resident set size of a single process in bytes."""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return 0
+    try:
+        with open('/proc/{0}/statm'.format(pid), 'r') as statm_file:
+            return int(statm_file.read().split()[1]) * _PAGE_SIZE
+    except (IOError, OSError, IndexError, ValueError):
+        return 0
+
+
+def tree_rss(pid):
+    """Return the summed RSS in bytes of pid and all its descendants."""
+    if not pid:
+        return 0
+    return sum(process_rss(p) for p in [pid] + descendants(pid))
+
+
+def driver_pid(driver):
+    """Return the pid of the chromedriver/geckodriver process of driver."""
+    try:
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+
+def _proc_stat_fields(pid):
+    """Return the /proc/<pid>/stat fields after the command name."""
+    with open('/proc/{0}/stat'.format(pid), 'r') as stat_file:
+        stat = stat_file.read()
+    return stat[stat.rfind(')') + 2:].split()
+
+
+def process_identity(pid):
+    """Return a token telling pid apart from a later process reusing it.
+
+    None means the process is gone.
+    """
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).create_time()
+        except psutil.Error:
+            return None
+    try:
+        # starttime, in clock ticks since boot
+        return int(_proc_stat_fields(pid)[19])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def process_cpu_time(pid):
+    """Return the user + system CPU seconds used by a process."""
+    if psutil is not None:
+        try:
+            times = psutil.Process(pid).cpu_times()
+            return times.user + times.system
+        except psutil.Error:
+            return 0.0
+    try:
+        fields = _proc_stat_fields(pid)
+        return (int(fields[11]) + int(fields[12])) / float(_CLOCK_TICKS)
+    except (IOError, OSError, IndexError, ValueError):
+        return 0.0
+
+
+def process_usage(pid):
+    """Return (CPU seconds, RSS bytes, threads) of a process, or None.
+
+    A single read of /proc/<pid>/stat, cheap enough to poll while a page
+    loads.
+    """
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            with process.oneshot():
+                times = process.cpu_times()
+                return (times.user + times.system,
+                        process.memory_info().rss, process.num_threads())
+        except psutil.Error:
+            return None
+    try:
+        fields = _proc_stat_fields(pid)
+        return ((int(fields[11]) + int(fields[12])) / float(_CLOCK_TICKS),
+                int(fields[21]) * _PAGE_SIZE, int(fields[17]))
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def tree_cpu_time(pid):
+    """Return the CPU seconds used by pid and all its descendants."""
+    if not pid:
+        return 0.0
+    return sum(process_cpu_time(p) for p in [pid] + descendants(pid))
+
+
+def kill_processes(pids, timeout=3.0):
+    """SIGTERM the pids, SIGKILL those still alive after timeout seconds.
+
+    Returns the pids that were alive when the kill started.
+    """
+    alive = []
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            alive.append(pid)
+        except OSError:
+            pass
+
+    deadline = time.time() + timeout
+    pending = list(alive)
+    while pending and time.time() < deadline:
+        time.sleep(0.1)
+        pending = [pid for pid in pending if is_running(pid)]
+    for pid in pending:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    return alive
+
+
+def is_running(pid):
+    """Check that pid exists and is not a zombie."""
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    try:
+        return _proc_stat_fields(pid)[0] != 'Z'
+    except (IOError, OSError, IndexError):
+        return True
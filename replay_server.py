@@ -0,0 +1,386 @@
+"""Record and replay the HTTP(S) traffic of page loads from a local archive."""
+#################################################
+#
+# Description:  A local HTTP/HTTPS server that, in record mode, proxies
+#               the browser to the live sites and appends every response
+#               to an on-disk archive and, in replay mode, serves the
+#               archived responses so page loads become deterministic.
+#
+#               Archive layout: <dir>/data.bin holds the response bodies
+#               back to back, <dir>/index.json maps "METHOD url" to the
+#               body offset/length, status and headers (O(1) lookups).
+#               Bodies are served with os.sendfile on plain connections
+#               and from an mmap of data.bin on TLS connections.
+#################################################
+import json
+import mmap
+import os
+import socket
+import ssl
+import subprocess
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from httplib import HTTPConnection, HTTPSConnection
+    from urlparse import urlsplit
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from http.client import HTTPConnection, HTTPSConnection
+    from urllib.parse import urlsplit
+
+HOP_BY_HOP_HEADERS = frozenset([
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'proxy-connection', 'te', 'trailers', 'transfer-encoding', 'upgrade',
+    'content-length'])
+UPSTREAM_TIMEOUT = 30
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def archive_key(method, url):
+    """Return the lookup key of a request: method plus normalised URL."""
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(parts.scheme):
+        host = "{0}:{1}".format(host, parts.port)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return "{0} {1}://{2}{3}".format(method.upper(), parts.scheme, host, path)
+
+
+def ensure_certificate(directory):
+    """Return (cert, key) paths of a self-signed cert, creating it once.
+
+    The browsers are started with certificate errors ignored, so one cert
+    serves every host.  Needs the openssl command line tool.
+    """
+    cert = os.path.join(directory, 'replay_cert.pem')
+    key = os.path.join(directory, 'replay_key.pem')
+    if not (os.path.exists(cert) and os.path.exists(key)):
+        try:
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call(
+                    ['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                     '-nodes', '-days', '3650',
+                     '-subj', '/CN=browser_pageloadspeed replay',
+                     '-keyout', key, '-out', cert],
+                    stdout=devnull, stderr=subprocess.STDOUT)
+        except OSError:
+            raise RuntimeError("openssl is needed to serve HTTPS replays")
+    return cert, key
+
+
+def server_ssl_context(cert, key):
+    """Return a server side TLS context for the cert and key files."""
+    protocol = getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23)
+    context = ssl.SSLContext(protocol)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+class HttpArchive(object):
+    """Response archive on disk with an in-memory index.
+
+    mode 'w' appends recorded responses, mode 'r' serves them.
+    """
+
+    def __init__(self, directory, mode='r'):
+        """Doc string."""
+        self.directory = directory
+        self.mode = mode
+        self.index_path = os.path.join(directory, 'index.json')
+        self.data_path = os.path.join(directory, 'data.bin')
+        self.index = {}
+        self._lock = threading.Lock()
+        self._mmap = None
+
+        if mode == 'w' and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as index_file:
+                self.index = json.load(index_file)
+        elif mode == 'r':
+            raise IOError("No archive index in {0}".format(directory))
+
+        if mode == 'w':
+            self._data = open(self.data_path, 'ab')
+        else:
+            self._data = open(self.data_path, 'rb')
+            if os.path.getsize(self.data_path):
+                self._mmap = mmap.mmap(self._data.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+
+    def add(self, key, status, reason, headers, body):
+        """Append a response to the archive."""
+        with self._lock:
+            offset = self._data.tell()
+            self._data.write(body)
+            self.index[key] = [offset, len(body), status, reason,
+                               [list(h) for h in headers]]
+
+    def lookup(self, key):
+        """Return [offset, length, status, reason, headers] or None."""
+        return self.index.get(key)
+
+    def body(self, entry):
+        """Return the body of an entry without copying it when possible."""
+        offset, length = entry[0], entry[1]
+        if self._mmap is None:
+            self._data.flush()
+            with open(self.data_path, 'rb') as data_file:
+                data_file.seek(offset)
+                return data_file.read(length)
+        try:
+            return memoryview(self._mmap)[offset:offset + length]
+        except TypeError:
+            return self._mmap[offset:offset + length]
+
+    def send_body(self, connection, wfile, entry):
+        """Write the body of an entry to a client connection.
+
+        Plain sockets get a zero-copy os.sendfile from data.bin, TLS
+        sockets a write straight from the mmap.
+        """
+        offset, length = entry[0], entry[1]
+        if length and self.mode == 'r' and hasattr(os, 'sendfile') and \
+                not isinstance(connection, ssl.SSLSocket):
+            wfile.flush()
+            sent = 0
+            while sent < length:
+                count = os.sendfile(connection.fileno(), self._data.fileno(),
+                                    offset + sent, length - sent)
+                if not count:
+                    break
+                sent += count
+            return
+        wfile.write(self.body(entry))
+
+    def save(self):
+        """Write the index next to the data file."""
+        with self._lock:
+            self._data.flush()
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as index_file:
+                json.dump(self.index, index_file)
+            os.rename(tmp_path, self.index_path)
+
+    def close(self):
+        """Save (in record mode) and release the archive files."""
+        if self.mode == 'w':
+            self.save()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._data.close()
+
+
+class _ArchiveHandler(BaseHTTPRequestHandler):
+    """Serves direct, proxied (absolute URL) and CONNECT tunnel requests."""
+
+    protocol_version = 'HTTP/1.1'
+    tunnel_host = None
+
+    def setup(self):
+        """Do the TLS handshake in the handler thread on HTTPS listeners."""
+        if self.server.ssl_context is not None:
+            self.request = self.server.ssl_context.wrap_socket(
+                self.request, server_side=True)
+        BaseHTTPRequestHandler.setup(self)
+
+    def log_message(self, format, *args):
+        """Keep the measurement output clean."""
+        pass
+
+    def do_CONNECT(self):
+        """Terminate the tunnel locally and serve the requests inside it."""
+        host, _, port = self.path.partition(':')
+        self.send_response(200, 'Connection Established')
+        self.end_headers()
+        self.wfile.flush()
+
+        self.connection = self.server.tunnel_context.wrap_socket(
+            self.connection, server_side=True)
+        self.rfile = self.connection.makefile('rb', self.rbufsize)
+        self.wfile = self.connection.makefile('wb', self.wbufsize)
+        self.tunnel_host = host if port in ('', '443') else self.path
+        self.close_connection = False
+        while not self.close_connection:
+            self.handle_one_request()
+        self.close_connection = True
+
+    def _target_url(self):
+        if self.path.startswith(('http://', 'https://')):
+            return self.path
+        if self.tunnel_host:
+            return 'https://' + self.tunnel_host + self.path
+        scheme = 'https' if self.server.ssl_context is not None else 'http'
+        return scheme + '://' + self.headers.get('Host', '') + self.path
+
+    def _serve(self):
+        url = self._target_url()
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        key = archive_key(self.command, url)
+        archive = self.server.archive
+
+        if self.server.recording:
+            try:
+                status, reason, headers, data = self._fetch(url, body)
+            except (socket.error, IOError, ValueError) as e:
+                self.send_error(502, str(e))
+                return
+            archive.add(key, status, reason, headers, data)
+            entry = [None, len(data), status, reason, headers]
+        else:
+            entry = archive.lookup(key)
+            if entry is None:
+                self.send_error(404, "Not in archive: " + key)
+                return
+
+        self.send_response(entry[2], entry[3])
+        for name, value in entry[4]:
+            if name.lower() not in HOP_BY_HOP_HEADERS:
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(entry[1]))
+        self.end_headers()
+        if self.command != 'HEAD':
+            if self.server.recording:
+                self.wfile.write(data)
+            else:
+                archive.send_body(self.connection, self.wfile, entry)
+        self.wfile.flush()
+
+    def _fetch(self, url, body):
+        """Forward the request to the live site, return the response."""
+        parts = urlsplit(url)
+        if parts.scheme == 'https':
+            conn = HTTPSConnection(parts.hostname, parts.port,
+                                   timeout=UPSTREAM_TIMEOUT)
+        else:
+            conn = HTTPConnection(parts.hostname, parts.port,
+                                  timeout=UPSTREAM_TIMEOUT)
+        headers = dict((name, value) for name, value in self.headers.items()
+                       if name.lower() not in HOP_BY_HOP_HEADERS)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        try:
+            conn.request(self.command, path, body, headers)
+            response = conn.getresponse()
+            data = response.read()
+            return (response.status, response.reason,
+                    response.getheaders(), data)
+        finally:
+            conn.close()
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = do_OPTIONS = \
+        do_PATCH = _serve
+
+
+class _ArchiveServer(ThreadingMixIn, HTTPServer):
+    """Threaded listener sharing one archive."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, archive, recording, tunnel_context,
+                 ssl_context=None):
+        """Doc string."""
+        HTTPServer.__init__(self, address, _ArchiveHandler)
+        self.archive = archive
+        self.recording = recording
+        self.tunnel_context = tunnel_context
+        self.ssl_context = ssl_context
+
+
+class ReplayServer(object):
+    """Local record/replay server for the load test browsers.
+
+    It listens on an HTTP port, which is also a forward proxy (absolute
+    URLs and CONNECT), and on an HTTPS port for browsers whose host
+    resolution is redirected to it (Chrome --host-resolver-rules).
+    """
+
+    def __init__(self, archive_dir, mode='replay', host='127.0.0.1',
+                 http_port=0, https_port=0):
+        """Doc string."""
+        if mode not in ('record', 'replay'):
+            raise ValueError("mode must be 'record' or 'replay'")
+        self.archive_dir = archive_dir
+        self.mode = mode
+        self.host = host
+        self.http_port = http_port
+        self.https_port = https_port
+        self.archive = None
+        self._servers = []
+
+    def start(self):
+        """Open the archive and start the listeners in daemon threads."""
+        recording = self.mode == 'record'
+        self.archive = HttpArchive(self.archive_dir,
+                                   'w' if recording else 'r')
+        context = server_ssl_context(*ensure_certificate(self.archive_dir))
+
+        http_server = _ArchiveServer((self.host, self.http_port),
+                                     self.archive, recording, context)
+        https_server = _ArchiveServer((self.host, self.https_port),
+                                      self.archive, recording, context,
+                                      ssl_context=context)
+        self.http_port = http_server.server_address[1]
+        self.https_port = https_server.server_address[1]
+
+        for server in (http_server, https_server):
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self._servers.append(server)
+        return self
+
+    def stop(self):
+        """Stop the listeners and save the archive."""
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    @property
+    def proxy_address(self):
+        """host:port of the forward proxy listener."""
+        return "{0}:{1}".format(self.host, self.http_port)
+
+    def chrome_args(self):
+        """Chrome switches routing the browser traffic to this server.
+
+        Replays use a host resolver override, recordings the proxy.
+        """
+        args = ["--ignore-certificate-errors"]
+        if self.mode == 'replay':
+            args.append(
+                "--host-resolver-rules=MAP *:80 {0}:{1},"
+                "MAP *:443 {0}:{2},EXCLUDE localhost".format(
+                    self.host, self.http_port, self.https_port))
+        else:
+            args.append("--proxy-server=" + self.proxy_address)
+            args.append("--proxy-bypass-list=<-loopback>")
+        return args
+
+    def firefox_prefs(self):
+        """Firefox preferences routing all traffic through this server."""
+        return {
+            "network.proxy.type": 1,
+            "network.proxy.http": self.host,
+            "network.proxy.http_port": self.http_port,
+            "network.proxy.ssl": self.host,
+            "network.proxy.ssl_port": self.http_port,
+            "network.proxy.no_proxies_on": "",
+            "network.proxy.allow_hijacking_localhost": True}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,231 @@
+"""Compact storage of Navigation Timing 2 and Resource Timing entries."""
+#################################################
+#
+# Description:  Keep the navigation entry and the resource entries of
+#               each page load in interned, array-backed columns, and
+#               write them out to waterfall files a batch of pages at a
+#               time, so memory does not grow with the run.
+#################################################
+import array
+import heapq
+
+from result_sink import ResultSink, TEXT_COLUMNS, file_extension
+
+NAVIGATION_FIELDS = [
+    "type", "nextHopProtocol", "redirectCount", "redirectStart",
+    "redirectEnd", "fetchStart", "domainLookupStart", "domainLookupEnd",
+    "connectStart", "connectEnd", "secureConnectionStart", "requestStart",
+    "responseStart", "responseEnd", "domInteractive",
+    "domContentLoadedEventStart", "domContentLoadedEventEnd", "domComplete",
+    "loadEventStart", "loadEventEnd", "duration", "transferSize",
+    "encodedBodySize", "decodedBodySize"]
+RESOURCE_FIELDS = [
+    "name", "initiatorType", "nextHopProtocol", "startTime", "duration",
+    "domainLookupStart", "domainLookupEnd", "connectStart", "connectEnd",
+    "secureConnectionStart", "requestStart", "responseStart", "responseEnd",
+    "transferSize", "encodedBodySize", "decodedBodySize"]
+# Navigation Timing 1, the epoch ms timestamps calc_timers works from
+TIMING_FIELDS = [
+    "navigationStart", "unloadEventStart", "unloadEventEnd",
+    "redirectStart", "redirectEnd", "fetchStart", "domainLookupStart",
+    "domainLookupEnd", "connectStart", "connectEnd", "secureConnectionStart",
+    "requestStart", "responseStart", "responseEnd", "domLoading",
+    "domInteractive", "domContentLoadedEventStart",
+    "domContentLoadedEventEnd", "domComplete", "loadEventStart",
+    "loadEventEnd"]
+STRING_FIELDS = frozenset(["type", "nextHopProtocol", "name",
+                           "initiatorType"])
+
+navigation_columns = ["url", "run"] + NAVIGATION_FIELDS
+waterfall_columns = ["url", "run"] + RESOURCE_FIELDS
+raw_timing_columns = ["url", "run"] + TIMING_FIELDS
+slowest_columns = ["url", "run", "rank", "name", "initiatorType",
+                   "nextHopProtocol", "startTime", "duration", "transferSize"]
+
+# pages held in the columns before they are written out
+PAGE_BATCH = 50
+
+RESOURCE_TIMING_KEY = "_resource_timing"
+RAW_TIMING_KEY = "_raw_timing"
+
+
+class StringTable(object):
+    """Interns the strings of the entries, stored once and referenced by id."""
+
+    def __init__(self):
+        """Doc string."""
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, value):
+        """Return the id of value, adding it on first sight."""
+        value = u'' if value is None else value
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+
+def _columns(fields):
+    """One typed array per field: string ids or doubles."""
+    return dict((f, array.array('i') if f in STRING_FIELDS
+                 else array.array('d')) for f in fields)
+
+
+class ResourceTimingStore(object):
+    """Columnar store of the timing entries of many page loads.
+
+    Strings are interned and numbers kept in typed arrays rather than one
+    dict per resource.  After open(), the pages held are written to the
+    _navigation, _waterfall and _slowest files every PAGE_BATCH pages and
+    on flush(), then dropped; without files every page is kept, for
+    format_slowest().
+    """
+
+    def __init__(self, slowest=10, batch=PAGE_BATCH):
+        """Doc string, slowest is the number of resources kept per page."""
+        self.slowest = slowest
+        self.batch = batch
+        self.pages = 0
+        self.resource_count = 0
+        self.sinks = None
+        self._clear()
+
+    def _clear(self):
+        self.strings = StringTable()
+        self.page_url = array.array('i')
+        self.page_run = array.array('i')
+        self.page_start = array.array('l')
+        self.navigation = _columns(NAVIGATION_FIELDS)
+        self.resources = _columns(RESOURCE_FIELDS)
+        self.held_resources = 0
+
+    def __len__(self):
+        return len(self.page_url)
+
+    def open(self, prefix, fmt='csv', **sink_options):
+        """Write the pages to <prefix>_navigation/_waterfall/_slowest."""
+        extension = file_extension(fmt)
+        self.sinks = [
+            ResultSink(prefix + suffix + extension, columns, fmt,
+                       text_columns=TEXT_COLUMNS | STRING_FIELDS,
+                       **sink_options)
+            for suffix, columns in (("_navigation", navigation_columns),
+                                    ("_waterfall", waterfall_columns),
+                                    ("_slowest", slowest_columns))]
+
+    def _append(self, columns, fields, values):
+        for field, value in zip(fields, values):
+            if field in STRING_FIELDS:
+                columns[field].append(self.strings.intern(value))
+            elif isinstance(value, (int, float)) and \
+                    not isinstance(value, bool):
+                columns[field].append(value)
+            else:
+                columns[field].append(float('nan'))
+
+    def add_page(self, url, run, payload):
+        """Store the payload of RESOURCE_TIMING_SCRIPT.
+
+        Returns the id of the page among those held, valid until they are
+        written out.
+        """
+        if self.sinks is not None and len(self) >= self.batch:
+            self._write_pages()
+        self.page_url.append(self.strings.intern(url))
+        self.page_run.append(self.strings.intern(u'{0}'.format(run)))
+        self.page_start.append(self.held_resources)
+        self._append(self.navigation, NAVIGATION_FIELDS,
+                     payload.get("navigation") or
+                     [None] * len(NAVIGATION_FIELDS))
+        for entry in payload.get("resources") or []:
+            self._append(self.resources, RESOURCE_FIELDS, entry)
+            self.held_resources += 1
+        self.resource_count += self.held_resources - self.page_start[-1]
+        self.pages += 1
+        return len(self) - 1
+
+    def _page_range(self, page):
+        start = self.page_start[page]
+        end = self.page_start[page + 1] if page + 1 < len(self) \
+            else self.held_resources
+        return start, end
+
+    def _row(self, columns, fields, index, page):
+        row = {"url": self.strings[self.page_url[page]],
+               "run": self.strings[self.page_run[page]]}
+        for field in fields:
+            value = columns[field][index]
+            row[field] = self.strings[value] if field in STRING_FIELDS \
+                else value
+        return row
+
+    def navigation_entry(self, page):
+        """Return the Navigation Timing 2 entry of a page as a dict."""
+        return self._row(self.navigation, NAVIGATION_FIELDS, page, page)
+
+    def waterfall(self, page):
+        """Return the resource entries of a page sorted by start time."""
+        start, end = self._page_range(page)
+        starts = self.resources["startTime"]
+        order = sorted(range(start, end), key=lambda i: starts[i])
+        return [self._row(self.resources, RESOURCE_FIELDS, i, page)
+                for i in order]
+
+    def slowest_resources(self, page):
+        """Return the slowest resources of a page, slowest first."""
+        start, end = self._page_range(page)
+        durations = self.resources["duration"]
+        # NaN (no duration) sorts below every real one
+        top = heapq.nlargest(
+            self.slowest, range(start, end),
+            key=lambda i: durations[i] if durations[i] == durations[i]
+            else float('-inf'))
+        rows = []
+        for rank, index in enumerate(top, 1):
+            row = self._row(self.resources, RESOURCE_FIELDS, index, page)
+            row["rank"] = rank
+            rows.append(row)
+        return rows
+
+    def format_slowest(self, page):
+        """Return the slowest resources of a page as printable lines."""
+        lines = [u"Slowest resources for {0} (run {1}):".format(
+            self.strings[self.page_url[page]],
+            self.strings[self.page_run[page]])]
+        for row in self.slowest_resources(page):
+            lines.append(u"  {rank:2d}. {duration:9.1f} ms {initiatorType:8.8}"
+                         u" {name:.90}".format(**row))
+        return "\n".join(lines)
+
+    def _write_pages(self):
+        """Write the pages held to the files and drop them."""
+        navigation, waterfall, slowest = self.sinks
+        for page in range(len(self)):
+            navigation.write(self.navigation_entry(page))
+            for row in self.waterfall(page):
+                waterfall.write(row)
+            for row in self.slowest_resources(page):
+                slowest.write(row)
+        self._clear()
+
+    def flush(self):
+        """Write out the pages held and the buffered rows of the files."""
+        if self.sinks is None:
+            return
+        self._write_pages()
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        """Write out the pages held and close the files."""
+        if self.sinks is None:
+            return
+        self._write_pages()
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = None
@@ -0,0 +1,130 @@
+"""CPU, memory and thread usage of the browser while a page loads."""
+#################################################
+#
+# Description:  Poll the process tree of a WebDriver session from a
+#               background thread during each load and summarise the CPU
+#               time, resident memory and thread count of the browser as
+#               average and peak values, to size how many browsers a host
+#               can run in parallel.
+#################################################
+import threading
+
+import proctree
+from harness_timers import monotonic
+
+DEFAULT_USAGE_INTERVAL = 100
+# ms, below this the sampler costs more than it tells
+MIN_USAGE_INTERVAL = 10
+# samples between two scans of /proc for new browser processes
+TREE_REFRESH = 5
+usage_columns = ["Browser CPU ms", "CPU Avg %", "CPU Peak %", "RSS Avg MB",
+                 "RSS Peak MB", "Threads Avg", "Threads Peak"]
+
+_MB = 1024.0 * 1024.0
+
+
+def _not_available():
+    return dict((column, "N/A") for column in usage_columns)
+
+
+class UsageSampler(object):
+    """Samples the browser processes below a driver every interval ms.
+
+    The driver server itself is left out.  CPU is the time the browser
+    processes used between start() and stop(), its percentages are of one
+    core; RSS is summed over the processes, so pages shared between them
+    count more than once.
+    """
+
+    def __init__(self, pid, interval=DEFAULT_USAGE_INTERVAL):
+        """Doc string, pid is the driver server's."""
+        self.pid = pid
+        self.interval = max(interval, MIN_USAGE_INTERVAL) / 1000.0
+        self._pids = []
+        # pid -> CPU seconds when first seen, and when last seen
+        self._base_cpu = {}
+        self._cpu = {}
+        self._samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def start(self):
+        """Take the baseline sample and start polling."""
+        self._started = monotonic()
+        if not self.pid:
+            return self
+        self._refresh(initial=True)
+        self._sample()
+        self._thread = threading.Thread(target=self._poll)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _refresh(self, initial=False):
+        self._pids = proctree.descendants(self.pid)
+        if initial:
+            for pid in self._pids:
+                usage = proctree.process_usage(pid)
+                if usage is not None:
+                    self._base_cpu[pid] = usage[0]
+
+    def _sample(self):
+        """Record (time, tree CPU seconds, RSS bytes, threads)."""
+        rss = threads = 0
+        for pid in self._pids:
+            usage = proctree.process_usage(pid)
+            if usage is None:
+                continue
+            # processes born during the load count from zero
+            self._base_cpu.setdefault(pid, 0.0)
+            self._cpu[pid] = usage[0]
+            rss += usage[1]
+            threads += usage[2]
+        cpu = sum(self._cpu[pid] - self._base_cpu[pid] for pid in self._cpu)
+        self._samples.append((monotonic(), cpu, rss, threads))
+
+    def _poll(self):
+        count = 0
+        while not self._stop.wait(self.interval):
+            count += 1
+            if count % TREE_REFRESH == 0:
+                self._refresh()
+            self._sample()
+
+    def stop(self):
+        """Stop polling, return the usage_columns of the load.
+
+        They are all "N/A" when no browser process could be read.
+        """
+        if self._thread is None:
+            return _not_available()
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._refresh()
+        self._sample()
+        if not self._cpu:
+            return _not_available()
+        return self.columns()
+
+    def columns(self):
+        """Summarise the samples taken as usage_columns."""
+        samples = self._samples[1:]
+        elapsed = self._samples[-1][0] - self._started
+        cpu = self._samples[-1][1]
+        peak = 0.0
+        for (t0, cpu0, _, _), (t1, cpu1, _, _) in zip(self._samples,
+                                                       samples):
+            if t1 > t0:
+                peak = max(peak, 100.0 * (cpu1 - cpu0) / (t1 - t0))
+        rss = [sample[2] for sample in samples]
+        threads = [sample[3] for sample in samples]
+        return {"Browser CPU ms": int(round(cpu * 1000)),
+                "CPU Avg %": round(100.0 * cpu / elapsed, 1)
+                if elapsed > 0 else "N/A",
+                "CPU Peak %": round(peak, 1),
+                "RSS Avg MB": round(sum(rss) / len(rss) / _MB, 1),
+                "RSS Peak MB": round(max(rss) / _MB, 1),
+                "Threads Avg": round(float(sum(threads)) / len(threads), 1),
+                "Threads Peak": max(threads)}
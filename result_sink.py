@@ -0,0 +1,284 @@
+"""Long-lived, batched writer for the measurement result rows."""
+#################################################
+#
+# Description:  Open the output once and write the rows in batches as
+#               CSV, JSON Lines or a compact binary columnar format
+#               (Parquet when pyarrow is installed, else a stdlib array
+#               based format readable with read_columnar).
+#################################################
+import array
+import csv
+import json
+import math
+import os
+import struct
+import sys
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('csv', 'jsonl', 'columnar')
+FSYNC_POLICIES = ('never', 'batch', 'close')
+
+# stdlib columnar layout: magic, then one block per batch
+COLUMNAR_MAGIC = b'PLTCOL1\n'
+_NUMBER = b'd'
+_STRING = b's'
+# columns the columnar formats store as text, every other one as doubles
+TEXT_COLUMNS = frozenset(["url", "metric", "View", "Network"])
+
+
+def file_extension(fmt):
+    """Return the file extension used for an output format."""
+    if fmt == 'columnar':
+        return '.parquet' if pyarrow is not None else '.cols'
+    return '.' + fmt
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _to_float(value):
+    """Map a cell to a float, missing values ("N/A", None) become NaN."""
+    if _is_number(value):
+        return float(value)
+    try:
+        # e.g. a run number passed on as text
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def _to_text(value):
+    if value is None:
+        return u''
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return u'{0}'.format(value)
+
+
+class ResultSink(object):
+    """Writes result rows to one file kept open for the whole run.
+
+    Rows are buffered and flushed every batch_size rows.  fsync is one of
+    'never' (leave it to the OS), 'batch' (fsync after every flush) or
+    'close' (fsync once when the sink is closed).  The columnar formats
+    store the text_columns as strings and every other column as doubles,
+    whatever the values of the first rows, with NaN for "N/A" and None.
+    """
+
+    def __init__(self, path, columns, fmt='csv', batch_size=100,
+                 fsync='never', text_columns=TEXT_COLUMNS):
+        """Doc string."""
+        if fmt not in FORMATS:
+            raise ValueError("Unknown output format {0}".format(fmt))
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy {0}".format(fsync))
+        self.path = path
+        self.columns = list(columns)
+        self.fmt = fmt
+        self.batch_size = max(1, int(batch_size))
+        self.fsync = fsync
+        self.text_columns = frozenset(text_columns)
+        self.rows_written = 0
+        self._buffer = []
+        self._file = None
+        self._writer = None
+        self._open()
+
+    def _open(self):
+        if self.fmt == 'columnar' and pyarrow is not None:
+            # the ParquetWriter is created on the first batch
+            return
+
+        if self.fmt == 'csv':
+            if sys.version_info[0] < 3:
+                self._file = open(self.path, 'wb')
+            else:
+                self._file = open(self.path, 'w', newline='')
+            self._writer = csv.DictWriter(
+                self._file, fieldnames=self.columns, extrasaction='ignore')
+            self._writer.writeheader()
+        elif self.fmt == 'jsonl':
+            self._file = open(self.path, 'w')
+        else:
+            self._file = open(self.path, 'wb')
+            self._file.write(COLUMNAR_MAGIC)
+            names = json.dumps(self.columns).encode('utf-8')
+            self._file.write(struct.pack('<I', len(names)) + names)
+
+    def write(self, row):
+        """Queue a row, flushing when a full batch is buffered."""
+        self._buffer.append(row)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write out the buffered rows and apply the fsync policy."""
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+
+        if self.fmt == 'csv':
+            self._writer.writerows(rows)
+        elif self.fmt == 'jsonl':
+            self._file.write(''.join(
+                json.dumps(dict((c, row.get(c)) for c in self.columns)) +
+                '\n' for row in rows))
+        elif pyarrow is not None:
+            self._write_parquet(rows)
+        else:
+            self._write_columnar_block(rows)
+        self.rows_written += len(rows)
+
+        if self._file is not None:
+            self._file.flush()
+            if self.fsync == 'batch':
+                os.fsync(self._file.fileno())
+
+    def _write_columnar_block(self, rows):
+        block = [struct.pack('<I', len(rows))]
+        for column in self.columns:
+            values = [row.get(column) for row in rows]
+            if column not in self.text_columns:
+                data = array.array('d', [_to_float(v) for v in values])
+                raw = data.tobytes() if hasattr(data, 'tobytes') \
+                    else data.tostring()
+                block.append(_NUMBER + raw)
+            else:
+                encoded = [_to_text(v).encode('utf-8') for v in values]
+                lengths = array.array('I', [len(e) for e in encoded])
+                raw = lengths.tobytes() if hasattr(lengths, 'tobytes') \
+                    else lengths.tostring()
+                block.append(_STRING + raw + b''.join(encoded))
+        self._file.write(b''.join(block))
+
+    def _write_parquet(self, rows):
+        arrays = []
+        for column in self.columns:
+            values = [row.get(column) for row in rows]
+            if column not in self.text_columns:
+                numbers = [_to_float(v) for v in values]
+                arrays.append(pyarrow.array(
+                    [None if math.isnan(n) else n for n in numbers],
+                    type=pyarrow.float64()))
+            else:
+                arrays.append(pyarrow.array(
+                    [None if v is None else _to_text(v) for v in values],
+                    type=pyarrow.string()))
+        table = pyarrow.Table.from_arrays(arrays, names=self.columns)
+        if self._writer is None:
+            self._writer = pyarrow.parquet.ParquetWriter(
+                self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        """Flush the remaining rows and close the output."""
+        self.flush()
+        if self.fmt == 'columnar' and pyarrow is not None:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            return
+        if self._file is not None:
+            if self.fsync in ('batch', 'close'):
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_columnar(data):
+    """Parse a stdlib columnar file held in data (bytes or an mmap).
+
+    Returns the column names and an iterator over the blocks, each a
+    (nrows, {column: chunk}) pair.  A chunk locates its values in data
+    instead of copying them: (_NUMBER, offset) for nrows doubles, or
+    (_STRING, offset, payload) for nrows 'I' lengths followed at payload
+    by the concatenated UTF-8 strings.
+    """
+    if data[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC:
+        raise ValueError("not a columnar results file")
+    pos = len(COLUMNAR_MAGIC)
+    (size,) = struct.unpack_from('<I', data, pos)
+    pos += 4
+    columns = json.loads(data[pos:pos + size].decode('utf-8'))
+    return columns, _columnar_blocks(data, columns, pos + size)
+
+
+def _columnar_blocks(data, columns, pos):
+    length_size = array.array('I').itemsize
+    while pos < len(data):
+        (nrows,) = struct.unpack_from('<I', data, pos)
+        pos += 4
+        chunks = {}
+        for column in columns:
+            kind = data[pos:pos + 1]
+            pos += 1
+            if kind == _NUMBER:
+                chunks[column] = (kind, pos)
+                pos += 8 * nrows
+            else:
+                payload = pos + length_size * nrows
+                lengths = array.array('I')
+                chunk = data[pos:payload]
+                if hasattr(lengths, 'frombytes'):
+                    lengths.frombytes(chunk)
+                else:
+                    lengths.fromstring(chunk)
+                chunks[column] = (kind, pos, payload)
+                pos = payload + sum(lengths)
+        yield nrows, chunks
+
+
+def read_columnar(path):
+    """Load a stdlib columnar file into {column: array('d') or list}.
+
+    Numeric columns come back as array('d') with NaN for missing values,
+    string columns as lists of unicode strings.
+    """
+    with open(path, 'rb') as col_file:
+        data = col_file.read()
+    try:
+        columns, blocks = iter_columnar(data)
+    except ValueError:
+        raise ValueError("{0} is not a columnar results file".format(path))
+
+    result = dict((column, None) for column in columns)
+    for nrows, chunks in blocks:
+        for column in columns:
+            chunk = chunks[column]
+            if chunk[0] == _NUMBER:
+                values = array.array('d')
+                raw = data[chunk[1]:chunk[1] + 8 * nrows]
+                if hasattr(values, 'frombytes'):
+                    values.frombytes(raw)
+                else:
+                    values.fromstring(raw)
+                if result[column] is None:
+                    result[column] = array.array('d')
+                result[column].extend(values)
+            else:
+                lengths = array.array('I')
+                raw = data[chunk[1]:chunk[2]]
+                if hasattr(lengths, 'frombytes'):
+                    lengths.frombytes(raw)
+                else:
+                    lengths.fromstring(raw)
+                if result[column] is None:
+                    result[column] = []
+                pos = chunk[2]
+                for length in lengths:
+                    result[column].append(
+                        data[pos:pos + length].decode('utf-8'))
+                    pos += length
+    return result
@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+"""Historical results store in SQLite and regression check between runs."""
+#################################################
+#
+# Description:  Keep every measured value keyed by url, browser, run
+#               timestamp and metric in an indexed SQLite database, and
+#               compare a run against a baseline with a one-sided
+#               Mann-Whitney U test, and the timeout rates with a
+#               two-proportion test, exiting non-zero on a regression.
+#               Repeat views are stored and compared apart from first
+#               views.
+#
+#   results_db.py runs --db=results.db
+#   results_db.py compare --db=results.db --baseline=<run id or label>
+#################################################
+import math
+import sqlite3
+import sys
+import time
+from optparse import OptionParser
+
+DEFAULT_BATCH_SIZE = 500
+GATE_METRICS = ["Page Load", "Backend Time"]
+# a load timed out when it has no Page Load value
+TIMEOUT_METRIC = "Page Load"
+TIMEOUT_RATE = "Timeout %"
+# rows of --repeat-views carry their view, see view_metric
+VIEW_COLUMN = "View"
+FIRST_VIEW = "first-view"
+NON_METRICS = ("url", "run", "Repeat")
+DEFAULT_ALPHA = 0.05
+DEFAULT_MIN_CHANGE = 0.05
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    browser TEXT NOT NULL,
+    started INTEGER NOT NULL,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS urls (
+    url_id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    metric_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL,
+    url_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    iteration INTEGER NOT NULL,
+    value REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS loads (
+    run_id INTEGER NOT NULL,
+    url_id INTEGER NOT NULL,
+    iteration INTEGER NOT NULL,
+    view TEXT NOT NULL,
+    timed_out INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_browser ON runs (browser, started);
+CREATE INDEX IF NOT EXISTS runs_label ON runs (label);
+CREATE INDEX IF NOT EXISTS samples_key
+    ON samples (url_id, metric_id, run_id);
+CREATE INDEX IF NOT EXISTS samples_run ON samples (run_id);
+CREATE INDEX IF NOT EXISTS loads_run ON loads (run_id, url_id);
+"""
+
+
+def _text(value):
+    """sqlite3 on Python 2 refuses 8-bit byte strings."""
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) \
+        and not math.isnan(value)
+
+
+def _is_sample(value):
+    # a negative timing is measured against a timer a timeout left unset
+    return _is_number(value) and value >= 0
+
+
+def view_metric(metric, view):
+    """Return the stored name of a metric measured on a view.
+
+    First views keep the plain metric name, others read "<metric> [<view>]"
+    so that first and repeat views are never pooled.
+    """
+    if not view or view == FIRST_VIEW:
+        return metric
+    return "{0} [{1}]".format(metric, view)
+
+
+class ResultsDB(object):
+    """SQLite store of the measured values of many runs.
+
+    URLs and metric names are interned in their own tables; each numeric
+    cell of a result row becomes one samples row, under its view_metric
+    name, and each row one loads row recording whether the load timed
+    out, whose values are then left out.  Rows are buffered and inserted
+    batch_size values at a time in a single transaction.
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        """Doc string."""
+        self.path = path
+        self.batch_size = max(1, int(batch_size))
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.run_id = None
+        self._ids = {'urls': {}, 'metrics': {}}
+        self._buffer = []
+        self._loads = []
+
+    def start_run(self, browser, started=None, label=None):
+        """Register a new run, return its id."""
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (browser, started, label) VALUES (?, ?, ?)",
+                (browser, int(started or time.time()), _text(label)))
+        self.run_id = cursor.lastrowid
+        return self.run_id
+
+    def _intern(self, table, value):
+        ids = self._ids[table]
+        value = _text(value)
+        if value not in ids:
+            key, column = ('url_id', 'url') if table == 'urls' \
+                else ('metric_id', 'name')
+            self.conn.execute("INSERT OR IGNORE INTO {0} ({1}) VALUES (?)"
+                              .format(table, column), (value,))
+            ids[value] = self.conn.execute(
+                "SELECT {0} FROM {1} WHERE {2} = ?".format(
+                    key, table, column), (value,)).fetchone()[0]
+        return ids[value]
+
+    def add(self, row):
+        """Queue the numeric values of a result row of the current run."""
+        url_id = self._intern('urls', row["url"].strip())
+        iteration = int(row["run"])
+        view = row.get(VIEW_COLUMN) or FIRST_VIEW
+        timed_out = TIMEOUT_METRIC in row and \
+            not _is_sample(row[TIMEOUT_METRIC])
+        self._loads.append((self.run_id, url_id, iteration, _text(view),
+                            int(timed_out)))
+        if not timed_out:
+            for metric, value in row.items():
+                if metric in NON_METRICS or not _is_sample(value):
+                    continue
+                self._buffer.append((
+                    self.run_id, url_id,
+                    self._intern('metrics', view_metric(metric, view)),
+                    iteration, value))
+        if len(self._buffer) + len(self._loads) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Insert the queued values in one transaction."""
+        if not self._buffer and not self._loads:
+            return
+        rows, self._buffer = self._buffer, []
+        loads, self._loads = self._loads, []
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO samples (run_id, url_id, metric_id, iteration, "
+                "value) VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.executemany(
+                "INSERT INTO loads (run_id, url_id, iteration, view, "
+                "timed_out) VALUES (?, ?, ?, ?, ?)", loads)
+
+    def close(self):
+        """Flush and close the database."""
+        if self.conn is not None:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+    def runs(self, browser=None, limit=20):
+        """Return the latest runs as (run_id, browser, started, label, n)."""
+        query = "SELECT r.run_id, r.browser, r.started, r.label, " \
+            "(SELECT COUNT(DISTINCT url_id) FROM samples s " \
+            "WHERE s.run_id = r.run_id) FROM runs r"
+        args = ()
+        if browser:
+            query += " WHERE r.browser = ?"
+            args = (browser,)
+        query += " ORDER BY r.run_id DESC LIMIT ?"
+        return self.conn.execute(query, args + (limit,)).fetchall()
+
+    def resolve_runs(self, selector, browser=None):
+        """Return the run ids matching a run id or a label."""
+        if selector is None:
+            latest = self.runs(browser, 1)
+            return [latest[0][0]] if latest else []
+        if str(selector).isdigit():
+            return [int(selector)]
+        query = "SELECT run_id FROM runs WHERE label = ?"
+        args = (_text(selector),)
+        if browser:
+            query += " AND browser = ?"
+            args += (browser,)
+        return [r[0] for r in self.conn.execute(query, args)]
+
+    def run_browser(self, run_id):
+        row = self.conn.execute("SELECT browser FROM runs WHERE run_id = ?",
+                                (run_id,)).fetchone()
+        return row[0] if row else None
+
+    def previous_run(self, run_id):
+        """Return the id of the run before run_id on the same browser."""
+        row = self.conn.execute(
+            "SELECT run_id FROM runs WHERE browser = ? AND run_id < ? "
+            "ORDER BY run_id DESC LIMIT 1",
+            (self.run_browser(run_id), run_id)).fetchone()
+        return row[0] if row else None
+
+    def metric_names(self, metric):
+        """Return the stored names of a metric, one per view."""
+        prefix = metric + " ["
+        return [r[0] for r in self.conn.execute(
+            "SELECT name FROM metrics WHERE name = ? OR "
+            "substr(name, 1, ?) = ? ORDER BY name",
+            (metric, len(prefix), prefix))]
+
+    def samples(self, run_ids, metric):
+        """Return {url: [values]} of a metric over some runs."""
+        if not run_ids:
+            return {}
+        query = ("SELECT u.url, s.value FROM samples s "
+                 "JOIN urls u ON u.url_id = s.url_id "
+                 "JOIN metrics m ON m.metric_id = s.metric_id "
+                 "WHERE m.name = ? AND s.run_id IN ({0})").format(
+                     ", ".join("?" * len(run_ids)))
+        values = {}
+        for url, value in self.conn.execute(query, [metric] + run_ids):
+            values.setdefault(url, []).append(value)
+        return values
+
+    def timeouts(self, run_ids):
+        """Return {(url, view): (timed out loads, loads)} over some runs."""
+        if not run_ids:
+            return {}
+        query = ("SELECT u.url, l.view, SUM(l.timed_out), COUNT(*) "
+                 "FROM loads l JOIN urls u ON u.url_id = l.url_id "
+                 "WHERE l.run_id IN ({0}) GROUP BY u.url, l.view").format(
+                     ", ".join("?" * len(run_ids)))
+        return dict(((url, view), (timed_out, loads))
+                    for url, view, timed_out, loads in
+                    self.conn.execute(query, run_ids))
+
+    def history(self, url, metric, browser=None, since=None):
+        """Return (started, iteration, value) of a url and metric."""
+        query = ("SELECT r.started, s.iteration, s.value FROM samples s "
+                 "JOIN runs r ON r.run_id = s.run_id "
+                 "WHERE s.url_id = (SELECT url_id FROM urls WHERE url = ?) "
+                 "AND s.metric_id = "
+                 "(SELECT metric_id FROM metrics WHERE name = ?)")
+        args = [_text(url), metric]
+        if browser:
+            query += " AND r.browser = ?"
+            args.append(browser)
+        if since:
+            query += " AND r.started >= ?"
+            args.append(int(since))
+        return self.conn.execute(query + " ORDER BY r.started", args) \
+            .fetchall()
+
+
+def mann_whitney(current, baseline):
+    """One-sided Mann-Whitney U test that current tends to be larger.
+
+    Uses the normal approximation with tie and continuity corrections,
+    fine from about 8 samples per side. Returns (U, p-value).
+    """
+    n1, n2 = len(current), len(baseline)
+    if not n1 or not n2:
+        return float('nan'), float('nan')
+    values = sorted([(v, 0) for v in current] + [(v, 1) for v in baseline])
+    n = n1 + n2
+    rank_sum = 0.0
+    tie_term = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and values[j + 1][0] == values[i][0]:
+            j += 1
+        # average of the 1-based ranks i+1 .. j+1
+        rank = (i + j) / 2.0 + 1
+        ties = j - i + 1
+        tie_term += ties ** 3 - ties
+        rank_sum += rank * sum(1 for k in range(i, j + 1)
+                               if values[k][1] == 0)
+        i = j + 1
+
+    u = rank_sum - n1 * (n1 + 1) / 2.0
+    mean = n1 * n2 / 2.0
+    variance = n1 * n2 / 12.0 * ((n + 1) - tie_term / (n * (n - 1.0))) \
+        if n > 1 else 0.0
+    if variance <= 0:
+        return u, 1.0
+    z = (u - mean - 0.5) / math.sqrt(variance)
+    return u, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def proportion_test(current, baseline):
+    """One-sided two-proportion z-test that the current rate is larger.
+
+    current and baseline are (events, trials). Returns the p-value.
+    """
+    (x1, n1), (x2, n2) = current, baseline
+    if not n1 or not n2:
+        return float('nan')
+    pooled = float(x1 + x2) / (n1 + n2)
+    if pooled in (0.0, 1.0):
+        return 1.0
+    z = (float(x1) / n1 - float(x2) / n2) / \
+        math.sqrt(pooled * (1 - pooled) * (1.0 / n1 + 1.0 / n2))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def compare(db, current_runs, baseline_runs, metrics=GATE_METRICS,
+            alpha=DEFAULT_ALPHA, min_change=DEFAULT_MIN_CHANGE):
+    """Compare two sets of runs, return one result dict per url and metric.
+
+    A url regressed on a metric when the current values are significantly
+    larger (p < alpha) and the median grew by more than min_change.  It
+    also regressed when its share of timed-out loads is significantly
+    larger and grew by more than min_change (reported as TIMEOUT_RATE,
+    in percent, the change then being the difference of the rates).
+    """
+    results = []
+    names = [name for metric in metrics for name in db.metric_names(metric)]
+    for metric in names:
+        current = db.samples(current_runs, metric)
+        baseline = db.samples(baseline_runs, metric)
+        for url in sorted(set(current) & set(baseline)):
+            u, p_value = mann_whitney(current[url], baseline[url])
+            base_median = _median(baseline[url])
+            cur_median = _median(current[url])
+            change = (cur_median - base_median) / base_median \
+                if base_median else float('nan')
+            results.append({
+                "url": url, "metric": metric,
+                "baseline": base_median, "current": cur_median,
+                "change": change, "U": u, "p": p_value,
+                "samples": (len(baseline[url]), len(current[url])),
+                "regression": p_value < alpha and change > min_change})
+
+    current = db.timeouts(current_runs)
+    baseline = db.timeouts(baseline_runs)
+    for key in sorted(set(current) & set(baseline)):
+        p_value = proportion_test(current[key], baseline[key])
+        base_rate = float(baseline[key][0]) / baseline[key][1]
+        cur_rate = float(current[key][0]) / current[key][1]
+        change = cur_rate - base_rate
+        results.append({
+            "url": key[0], "metric": view_metric(TIMEOUT_RATE, key[1]),
+            "baseline": 100 * base_rate, "current": 100 * cur_rate,
+            "change": change, "U": float('nan'), "p": p_value,
+            "samples": (baseline[key][1], current[key][1]),
+            "regression": p_value < alpha and change > min_change})
+    return results
+
+
+def format_comparison(results):
+    """Return the comparison as a printable table."""
+    header = "| {0:30.25} | {1:25} | {2:>9} | {3:>9} | {4:>7} | {5:>6} " \
+        "| {6:10} |".format("URL", "Metric", "Baseline", "Current",
+                            "Change", "p", "Verdict")
+    line = "=" * len(header)
+    lines = [line, header, line]
+    for r in results:
+        lines.append(
+            "| {url:30.25} | {metric:25.25} | {baseline:9.0f} | "
+            "{current:9.0f} | {change:7.1%} | {p:6.3f} | {0:10} |".format(
+                "REGRESSION" if r["regression"] else "ok", **r))
+    lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+
+    parser = OptionParser(
+        usage="Usage: %prog runs|compare --db=<file> "
+              "[--baseline=<run id|label>] [--current=<run id|label>]")
+    parser.add_option("--db",
+                      dest="db",
+                      help="SQLite results database")
+    parser.add_option("--browser",
+                      dest="browser",
+                      help="only consider runs of this browser")
+    parser.add_option("--baseline",
+                      dest="baseline",
+                      help="baseline run id or label, default the run "
+                           "before the current one")
+    parser.add_option("--current",
+                      dest="current",
+                      help="current run id or label, default the latest")
+    parser.add_option("--metric",
+                      dest="metrics",
+                      action='append',
+                      help="metric to gate on, repeatable, default "
+                           "Page Load and Backend Time")
+    parser.add_option("--alpha",
+                      dest="alpha",
+                      help="significance level of the test",
+                      default=str(DEFAULT_ALPHA))
+    parser.add_option("--min-change",
+                      dest="min_change",
+                      help="smallest relative growth of the median that "
+                           "counts as a regression",
+                      default=str(DEFAULT_MIN_CHANGE))
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1 or args[0] not in ('runs', 'compare'):
+        parser.error('command must be runs or compare')
+    if not options.db:
+        parser.error('--db not given')
+
+    db = ResultsDB(options.db)
+    if args[0] == 'runs':
+        for run_id, browser, started, label, urls in db.runs(options.browser):
+            print("{0:6d}  {1:8}  {2}  {3:4d} urls  {4}".format(
+                run_id, browser, time.strftime(
+                    "%Y-%m-%d %H:%M:%S", time.localtime(started)),
+                urls, label or ""))
+        sys.exit(0)
+
+    current_runs = db.resolve_runs(options.current, options.browser)
+    if not current_runs:
+        parser.error('no current run found')
+    if options.baseline:
+        baseline_runs = db.resolve_runs(
+            options.baseline,
+            options.browser or db.run_browser(current_runs[0]))
+    else:
+        previous = db.previous_run(current_runs[0])
+        baseline_runs = [previous] if previous else []
+    baseline_runs = [r for r in baseline_runs if r not in current_runs]
+    if not baseline_runs:
+        parser.error('no baseline run found')
+
+    results = compare(db, current_runs, baseline_runs,
+                      options.metrics or GATE_METRICS,
+                      float(options.alpha), float(options.min_change))
+    print("Runs {0} against baseline {1}".format(current_runs, baseline_runs))
+    print(format_comparison(results))
+    regressions = [r for r in results if r["regression"]]
+    if regressions:
+        print("{0} regression(s) found".format(len(regressions)))
+        sys.exit(1)
+    sys.exit(0)
@@ -0,0 +1,212 @@
+"""Constant-memory per-URL statistics over the measurement results."""
+#################################################
+#
+# Description:  Streaming mean/stddev/min/max (Welford) and P-square
+#               quantile estimates for every metric of every URL, so a
+#               summary can be produced whatever the number of loads.
+#################################################
+import math
+
+SUMMARY_QUANTILES = (50, 90, 99)
+summary_columns = ["url", "metric", "count", "mean", "stddev", "min", "max"] + \
+    ["p{0}".format(q) for q in SUMMARY_QUANTILES]
+
+
+class P2Quantile(object):
+    """P-square estimate of one quantile using five markers.
+
+    Jain & Chlamtac, "The P2 algorithm for dynamic calculation of
+    quantiles and histograms without storing observations" (1985).
+    """
+
+    def __init__(self, quantile):
+        """Doc string, quantile is in [0, 1]."""
+        p = quantile
+        self.p = p
+        self.heights = []
+        self.positions = [0.0, 1.0, 2.0, 3.0, 4.0]
+        self.desired = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]
+        self.increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def add(self, x):
+        """Add an observation."""
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or \
+                    (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) /
+                    (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) /
+                    (n[i] - n[i - 1]))
+                if not q[i - 1] < candidate < q[i + 1]:
+                    # parabolic guess out of order, fall back to linear
+                    candidate = q[i] + d * (q[i + d] - q[i]) / \
+                        (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    def value(self):
+        """Return the current estimate (exact below six observations)."""
+        q = self.heights
+        if not q:
+            return float('nan')
+        if len(q) < 5 or self.positions[4] < 5:
+            return q[int(round(self.p * (len(q) - 1)))]
+        return q[2]
+
+
+class MetricStats(object):
+    """Running count, mean, stddev, min, max and quantiles of a metric."""
+
+    def __init__(self, quantiles=SUMMARY_QUANTILES):
+        """Doc string, quantiles are percentages."""
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.quantiles = [(q, P2Quantile(q / 100.0)) for q in quantiles]
+
+    def add(self, value):
+        """Add an observation (Welford's online update)."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        for _, estimator in self.quantiles:
+            estimator.add(value)
+
+    @property
+    def variance(self):
+        """Sample variance."""
+        if self.count < 2:
+            return 0.0
+        return self._m2 / (self.count - 1)
+
+    @property
+    def stddev(self):
+        """Sample standard deviation."""
+        return math.sqrt(self.variance)
+
+    def quantile(self, q):
+        """Return the estimate of the q percentile tracked by this object."""
+        for tracked, estimator in self.quantiles:
+            if tracked == q:
+                return estimator.value()
+        raise KeyError(q)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_sample(value):
+    # timings and counters are never negative, a negative value is the
+    # difference against an unset (0) timer of a load that timed out
+    return _is_number(value) and value >= 0
+
+
+class ResultAggregator(object):
+    """Keeps MetricStats per (url, metric) for the result rows of a run.
+
+    With group_by, rows are also split on that column, the url of the
+    summary rows then reads "<url> [<value>]".
+    """
+
+    def __init__(self, metrics, group_by=None):
+        """Doc string, metrics are the row columns to aggregate."""
+        self.metrics = list(metrics)
+        self.group_by = group_by
+        self.stats = {}
+        self.urls = []
+
+    def add(self, row):
+        """Fold the numeric metrics of a result row into the statistics."""
+        url = row.get("url")
+        if self.group_by and row.get(self.group_by) is not None:
+            url = "{0} [{1}]".format(url, row[self.group_by])
+        per_url = self.stats.get(url)
+        if per_url is None:
+            per_url = self.stats[url] = {}
+            self.urls.append(url)
+        for metric in self.metrics:
+            value = row.get(metric)
+            if not _is_sample(value):
+                continue
+            if metric not in per_url:
+                per_url[metric] = MetricStats()
+            per_url[metric].add(value)
+
+    def get(self, url, metric):
+        """Return the MetricStats of a url and metric, or None."""
+        return self.stats.get(url, {}).get(metric)
+
+    def summary_rows(self):
+        """Yield one summary row (see summary_columns) per url and metric."""
+        for url in self.urls:
+            for metric in self.metrics:
+                stats = self.stats[url].get(metric)
+                if stats is None:
+                    continue
+                row = {"url": url, "metric": metric, "count": stats.count,
+                       "mean": round(stats.mean, 1),
+                       "stddev": round(stats.stddev, 1),
+                       "min": stats.min, "max": stats.max}
+                for q in SUMMARY_QUANTILES:
+                    row["p{0}".format(q)] = round(stats.quantile(q), 1)
+                yield row
+
+    def format(self, metrics=None):
+        """Return the summary as a printable table."""
+        return format_summary(self.summary_rows(), metrics or self.metrics)
+
+
+def format_summary(rows, metrics=None, group_by="url"):
+    """Return summary rows as a printable table, only those of metrics.
+
+    group_by is the column holding the label of each row.
+    """
+    header = "| {0:30.25} | {1:15} | {2:>5} | {3:>8} | {4:>8} | " \
+        "{5:>7} | {6:>7} | {7:>7} | {8:>7} | {9:>7} |".format(
+            "URL" if group_by == "url" else group_by, "Metric", "Count",
+            "Mean", "Stddev", "Min", "p50", "p90", "p99", "Max")
+    line = "=" * len(header)
+    lines = [line, header, line]
+    for row in rows:
+        if metrics is not None and row["metric"] not in metrics:
+            continue
+        lines.append(
+            "| {0:30.25} | {metric:15.15} | {count:5d} | {mean:8.1f} | "
+            "{stddev:8.1f} | {min:7} | {p50:7.1f} | {p90:7.1f} | "
+            "{p99:7.1f} | {max:7} |".format(row[group_by], **row))
+    lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,112 @@
+"""Student t quantiles and the stop rule of the adaptive scheduler."""
+import math
+import random
+import unittest
+
+from adaptive_sampling import AdaptiveScheduler, t_value
+
+# scipy.stats.t.ppf(1 - (1 - confidence) / 2, df)
+T_QUANTILES = [
+    (0.90, 1, 6.3138), (0.90, 30, 1.6973), (0.90, 60, 1.6706),
+    (0.95, 1, 12.7062), (0.95, 2, 4.3027), (0.95, 10, 2.2281),
+    (0.95, 30, 2.0423), (0.95, 31, 2.0395), (0.95, 60, 2.0003),
+    (0.95, 120, 1.9799), (0.99, 5, 4.0321), (0.99, 30, 2.7500),
+    (0.99, 40, 2.7045), (0.99, 200, 2.6006)]
+
+
+def _relative_ci(values, confidence):
+    """Half width of the CI of the mean over the mean, computed apart."""
+    n = len(values)
+    mean = sum(values) / float(n)
+    stddev = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+    return t_value(confidence, n - 1) * stddev / math.sqrt(n) / mean
+
+
+def _drain(scheduler, measure):
+    """Run the scheduler to the end, return the items it handed out."""
+    items = []
+    item = scheduler.next_item()
+    while item:
+        items.append(item)
+        scheduler.record(item[0], measure(item[0]))
+        item = scheduler.next_item()
+    return items
+
+
+class TValueTest(unittest.TestCase):
+
+    def test_quantiles(self):
+        for confidence, df, expected in T_QUANTILES:
+            self.assertAlmostEqual(t_value(confidence, df), expected,
+                                   delta=0.001,
+                                   msg=(confidence, df))
+
+    def test_no_degree_of_freedom_is_infinitely_uncertain(self):
+        self.assertTrue(math.isinf(t_value(0.95, 0)))
+
+    def test_decreasing_across_the_end_of_the_table(self):
+        for confidence in (0.90, 0.95, 0.99):
+            values = [t_value(confidence, df) for df in range(1, 100)]
+            self.assertEqual(values, sorted(values, reverse=True))
+
+
+class AdaptiveSchedulerTest(unittest.TestCase):
+
+    def test_stops_once_the_ci_is_below_the_target(self):
+        rng = random.Random(11)
+        samples = []
+
+        def measure(url):
+            samples.append(rng.gauss(1000, 60))
+            return samples[-1]
+        scheduler = AdaptiveScheduler(["http://a.example/"],
+                                      target_ci=0.03, min_samples=3,
+                                      max_samples=100)
+        items = _drain(scheduler, measure)
+
+        n = len(items)
+        self.assertLess(n, 100)
+        self.assertTrue(scheduler.converged("http://a.example/"))
+        self.assertLessEqual(_relative_ci(samples, 0.95), 0.03)
+        # one sample earlier it was still too wide
+        self.assertGreater(_relative_ci(samples[:-1], 0.95), 0.03)
+        self.assertEqual([run for _, run in items], list(range(n)))
+
+    def test_stops_at_min_samples_without_variance(self):
+        scheduler = AdaptiveScheduler(["http://a.example/"], min_samples=4)
+        self.assertEqual(len(_drain(scheduler, lambda url: 500)), 4)
+
+    def test_stops_at_max_samples_when_it_never_converges(self):
+        values = iter([100, 900] * 50)
+        scheduler = AdaptiveScheduler(["http://a.example/"],
+                                      target_ci=0.01, max_samples=12)
+        items = _drain(scheduler, lambda url: next(values))
+        self.assertEqual(len(items), 12)
+        self.assertFalse(scheduler.converged("http://a.example/"))
+
+    def test_failed_loads_are_attempts_not_samples(self):
+        scheduler = AdaptiveScheduler(["http://a.example/"], min_samples=3,
+                                      max_samples=5)
+        items = _drain(scheduler, lambda url: "N/A")
+        self.assertEqual(len(items), 5)
+        self.assertEqual(scheduler.state["http://a.example/"].stats.count, 0)
+
+    def test_samples_go_to_the_widest_ci(self):
+        rng = random.Random(2)
+        spread = {"http://steady.example/": 5,
+                  "http://noisy.example/": 100}
+        scheduler = AdaptiveScheduler(sorted(spread), target_ci=0.02,
+                                      max_samples=200)
+        items = _drain(scheduler,
+                       lambda url: rng.gauss(1000, spread[url]))
+        loads = dict((url, 0) for url in spread)
+        for url, _ in items:
+            loads[url] += 1
+        self.assertGreater(loads["http://noisy.example/"],
+                           loads["http://steady.example/"])
+        for url in spread:
+            self.assertTrue(scheduler.converged(url), url)
+
+
+if __name__ == '__main__':
+    unittest.main()
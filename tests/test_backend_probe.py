@@ -0,0 +1,63 @@
+"""Backend probe against the fixture server with known TTFB delays."""
+import ssl
+import unittest
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+from fixture_server import FixtureServer, FixturePage
+
+try:
+    import backend_probe
+except SyntaxError:
+    # asyncio, Python 3 only
+    backend_probe = None
+
+DELAYS = [50, 200, 400]
+# scheduling and loopback overhead allowed on top of the delay, in ms
+SLACK = 150
+
+
+@unittest.skipIf(backend_probe is None, "backend_probe needs Python 3")
+class BackendProbeTest(unittest.TestCase):
+
+    def probe(self, https):
+        with FixtureServer(https=https) as server:
+            pages = [FixturePage(ttfb=delay, size=1000) for delay in DELAYS]
+            urls = [server.url(page, https=https) for page in pages]
+            prober = backend_probe.BackendProber(
+                concurrency=10, per_host=2,
+                ssl_context=ssl._create_unverified_context())
+            rows = prober.run(urls, run_number=3)
+        self.assertEqual([row["url"] for row in rows], urls)
+        for page, row in zip(pages, rows):
+            self.assertEqual(set(row), set(backend_probe.csv_columns))
+            self.assertEqual(row["run"], "3")
+            self.assertGreaterEqual(row["Backend Time"],
+                                    page.expected_backend())
+            self.assertLess(row["Backend Time"],
+                            page.expected_backend() + SLACK)
+            for column in backend_probe.BROWSER_ONLY_COLUMNS:
+                self.assertEqual(row[column], "N/A")
+        return rows
+
+    def test_http_backend_time_tracks_ttfb(self):
+        for row in self.probe(https=False):
+            self.assertEqual(row["SSL Handshake"], 0)
+
+    @unittest.skipIf(which('openssl') is None,
+                     "the HTTPS fixture needs openssl")
+    def test_https_backend_time_tracks_ttfb(self):
+        self.probe(https=True)
+
+    def test_timeout_drops_the_row(self):
+        with FixtureServer() as server:
+            url = server.url(FixturePage(ttfb=1000))
+            prober = backend_probe.BackendProber(timeout=0.2)
+            self.assertEqual(prober.run([url]), [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
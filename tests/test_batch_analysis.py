@@ -0,0 +1,191 @@
+"""Whole-column metrics and summaries against the per-row code paths."""
+import math
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from resource_timing import TIMING_FIELDS, raw_timing_columns
+from result_sink import ResultSink
+from streaming_stats import ResultAggregator
+
+try:
+    import numpy
+    import batch_analysis
+except ImportError:
+    numpy = batch_analysis = None
+
+try:
+    import chrome_loadtest
+except (ImportError, SyntaxError):
+    # needs selenium, and the print statements of Python 2
+    chrome_loadtest = None
+
+START = 1500000000000
+
+
+def _record(url, run, **timers):
+    """A raw timing record, timers in ms after navigationStart or 0."""
+    record = dict((field, START + 10) for field in TIMING_FIELDS)
+    record.update(url=url, run=run, navigationStart=START)
+    for field, value in timers.items():
+        record[field] = START + value if value else 0
+    return record
+
+
+RECORDS = [
+    # complete HTTPS load
+    _record(u"http://a.example/", 0, secureConnectionStart=4,
+            responseStart=120, domLoading=130, domComplete=900,
+            loadEventEnd=950),
+    # timed out before the load event, over plain HTTP
+    _record(u"http://a.example/", 1, secureConnectionStart=0,
+            responseStart=200, domLoading=210, domComplete=0,
+            loadEventEnd=0),
+    # timed out before the first byte
+    _record(u"http://b.example/", 0, secureConnectionStart=0,
+            responseStart=0, domLoading=0, domComplete=0, loadEventEnd=0),
+]
+NAN = float('nan')
+# what calc_timers gives, "N/A" and negative times as NaN
+EXPECTED = {
+    "DNS Resolution": [0, 0, 0],
+    "TCP Connection": [0, 0, 0],
+    "SSL Handshake": [6, 0, 0],
+    "Backend Time": [120, 200, NAN],
+    "DOM Loading": [130, 210, NAN],
+    "DOM Ready": [900, NAN, NAN],
+    "Frontend Time": [830, NAN, NAN],
+    "Page Load": [950, NAN, NAN],
+}
+
+
+def _as_float(value):
+    if not isinstance(value, (int, float)) or value < 0:
+        return NAN
+    return float(value)
+
+
+def _same(expected, actual):
+    if math.isnan(expected):
+        return math.isnan(actual)
+    return abs(expected - actual) < 1e-9
+
+
+@unittest.skipIf(numpy is None, "batch analysis needs NumPy")
+class BatchAnalysisTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, columns, rows, fmt='csv'):
+        path = os.path.join(self.directory, name)
+        with ResultSink(path, columns, fmt, batch_size=2) as sink:
+            for row in rows:
+                sink.write(row)
+        return path
+
+    def test_derived_metrics_match_calc_timers(self):
+        for name, fmt in (("raw.csv", 'csv'), ("raw.cols", 'columnar')):
+            path = self.write(name, raw_timing_columns, RECORDS, fmt)
+            metrics = batch_analysis.derive_metrics(
+                batch_analysis.load(path, set(TIMING_FIELDS)))
+            for metric, expected in EXPECTED.items():
+                for want, got in zip(expected, metrics[metric].tolist()):
+                    self.assertTrue(_same(want, got), (fmt, metric, got))
+
+    @unittest.skipIf(chrome_loadtest is None,
+                     "calc_timers needs selenium and Python 2")
+    def test_expectations_are_those_of_calc_timers(self):
+        pt = chrome_loadtest.PerfTimings()
+        for index, record in enumerate(RECORDS):
+            pt.calc_timers(dict(record))
+            for metric, expected in EXPECTED.items():
+                self.assertTrue(_same(expected[index],
+                                      _as_float(pt.calc_timings[metric])),
+                                (index, metric))
+
+    def test_columnar_urls_factorize_like_csv(self):
+        rng = random.Random(7)
+        urls = [u"http://a.example/", u"", u"http://b.example/\u00fcn",
+                u"http://c.example/" + u"x" * 300, u"d"]
+        rows = [{"url": rng.choice(urls), "run": run}
+                for run in range(500)]
+        csv_path = self.write("urls.csv", ["url", "run"], rows)
+        cols_path = self.write("urls.cols", ["url", "run"], rows,
+                               'columnar')
+        packed_bytes = batch_analysis.PACKED_BYTES
+        try:
+            # several numpy.unique slices per block
+            batch_analysis.PACKED_BYTES = 700
+            columnar = batch_analysis.load(cols_path, set(["run"]))
+        finally:
+            batch_analysis.PACKED_BYTES = packed_bytes
+        codes, labels = columnar.strings["url"]
+        self.assertEqual([labels[code] for code in codes.tolist()],
+                         [row["url"] for row in rows])
+        self.assertEqual(labels,
+                         batch_analysis.load(csv_path).strings["url"][1])
+
+    def test_group_summary_matches_the_streaming_statistics(self):
+        rng = random.Random(3)
+        rows = []
+        for run in range(5):
+            for url in (u"http://a.example/", u"http://b.example/"):
+                rows.append({"url": url, "run": run,
+                             "View": u"first" if run % 2 else u"repeat",
+                             "Page Load": rng.randint(100, 5000)})
+        rows.append({"url": u"http://b.example/", "run": 5,
+                     "View": u"first", "Page Load": "N/A"})
+        path = self.write("results.csv", ["url", "run", "View", "Page Load"],
+                          rows)
+        columns = batch_analysis.load(path, set(["Page Load"]),
+                                      ["url", "View"])
+        values = columns.numbers["Page Load"]
+        codes, labels = columns.strings["url"]
+        summary = batch_analysis.group_summary(codes, labels, values,
+                                               "Page Load")
+
+        aggregator = ResultAggregator(["Page Load"])
+        for row in rows:
+            aggregator.add(row)
+        streamed = list(aggregator.summary_rows())
+        self.assertEqual(len(summary), len(streamed))
+        for batch, stream in zip(summary, streamed):
+            self.assertEqual(batch["url"], stream["url"])
+            # five values each: P-square is exact, the median too
+            for column in ("count", "mean", "stddev", "min", "max", "p50"):
+                self.assertAlmostEqual(batch[column], stream[column],
+                                       places=6, msg=column)
+
+        codes, labels = columns.strings["View"]
+        by_view = batch_analysis.group_summary(codes, labels, values,
+                                               "Page Load", group_by="View")
+        self.assertEqual(sorted(row["View"] for row in by_view),
+                         [u"first", u"repeat"])
+        self.assertNotIn("url", by_view[0])
+
+    def test_histogram_counts_every_value_once(self):
+        rng = random.Random(5)
+        values = numpy.array([rng.uniform(0, 20000) for _ in range(300)] +
+                             [NAN, 50.0, 100.0])
+        codes = numpy.array([i % 3 for i in range(len(values))],
+                            numpy.int32)
+        bounds = [100, 1000, 10000]
+        counts = batch_analysis.group_histogram(codes, ["a", "b", "c"],
+                                                values, bounds)
+        for group in range(3):
+            expected = [0] * (len(bounds) + 1)
+            for code, value in zip(codes.tolist(), values.tolist()):
+                if code != group or math.isnan(value):
+                    continue
+                expected[sum(1 for bound in bounds if value > bound)] += 1
+            self.assertEqual(counts[group].tolist(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
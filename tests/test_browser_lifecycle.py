@@ -0,0 +1,128 @@
+"""Teardown, leak sweep and watchdog of BrowserLifecycle on real processes."""
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+import proctree
+from browser_lifecycle import BrowserLifecycle
+
+# a "driver server" with a "browser" below it, outliving its browser
+DRIVER_COMMAND = [sys.executable, "-c", "import subprocess, time; "
+                  "subprocess.Popen(['sleep', '60']); time.sleep(60)"]
+
+
+class FakeService(object):
+
+    def __init__(self):
+        self.process = subprocess.Popen(DRIVER_COMMAND)
+
+
+class FakeDriver(object):
+    """Driver whose quit() ends the server only, the browser leaks.
+
+    With hang set, quit() blocks until released, like a hung browser.
+    """
+
+    def __init__(self, hang=False):
+        self.service = FakeService()
+        self.hang = threading.Event() if hang else None
+
+    def quit(self):
+        if self.hang is not None:
+            self.hang.wait(30)
+        self.service.process.terminate()
+        self.service.process.wait()
+
+    def browser_pids(self):
+        # the server starts the browser once it runs, give it the time
+        pid = self.service.process.pid
+        if not _wait(lambda: proctree.descendants(pid)):
+            raise AssertionError("the fake browser never started")
+        return proctree.descendants(pid)
+
+
+def _wait(condition, seconds=5):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _gone(pids):
+    return _wait(lambda: not any(proctree.is_running(pid) for pid in pids))
+
+
+@unittest.skipIf(not proctree.tracking_available(),
+                 "process tracking needs psutil or /proc")
+class BrowserLifecycleTest(unittest.TestCase):
+
+    def tearDown(self):
+        for driver in getattr(self, 'drivers', []):
+            if driver.hang is not None:
+                driver.hang.set()
+            if driver.service.process.poll() is None:
+                driver.service.process.kill()
+                driver.service.process.wait()
+
+    def new_driver(self, lifecycle, hang=False):
+        driver = FakeDriver(hang)
+        self.drivers = getattr(self, 'drivers', []) + [driver]
+        browser = driver.browser_pids()
+        lifecycle.track(driver)
+        return driver, browser
+
+    def test_teardown_kills_the_processes_that_outlive_quit(self):
+        torn_down = []
+        lifecycle = BrowserLifecycle(on_teardown=torn_down.append)
+        driver, browser = self.new_driver(lifecycle)
+        lifecycle.teardown(driver)
+        self.assertTrue(_gone(browser))
+        self.assertEqual(lifecycle.stats['leaked'], len(browser))
+        self.assertEqual(lifecycle.stats['quit_timeouts'], 0)
+        self.assertEqual(torn_down, [driver])
+        lifecycle.close()
+
+    def test_teardown_gives_a_hung_quit_bounded_time(self):
+        lifecycle = BrowserLifecycle(quit_timeout=0.5)
+        driver, browser = self.new_driver(lifecycle, hang=True)
+        started = time.time()
+        lifecycle.teardown(driver)
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual(lifecycle.stats['quit_timeouts'], 1)
+        # the driver server and the browser are both swept
+        self.assertTrue(_gone(browser + [driver.service.process.pid]))
+        self.assertGreaterEqual(lifecycle.stats['leaked'], 2)
+        self.assertIn("1 quit timeouts", lifecycle.format_report())
+        lifecycle.close()
+
+    def test_watchdog_kills_the_browser_of_a_hung_step(self):
+        lifecycle = BrowserLifecycle(grace=0, interval=0.05)
+        driver, browser = self.new_driver(lifecycle)
+        with lifecycle.watch(driver, 0.1):
+            self.assertTrue(_gone(browser))
+        self.assertEqual(lifecycle.kill_reason(driver), "hung load")
+        # counted once the kill is over
+        self.assertTrue(_wait(lambda: lifecycle.stats['watchdog_kills']))
+        self.assertEqual(lifecycle.stats['watchdog_kills'], 1)
+        # the driver server is left to fail the pending command
+        self.assertIsNone(driver.service.process.poll())
+        lifecycle.teardown(driver)
+        lifecycle.close()
+
+    def test_no_kill_within_the_deadline(self):
+        lifecycle = BrowserLifecycle(grace=0, interval=0.05)
+        driver, browser = self.new_driver(lifecycle)
+        with lifecycle.watch(driver, 5):
+            time.sleep(0.3)
+        self.assertIsNone(lifecycle.kill_reason(driver))
+        self.assertTrue(all(proctree.is_running(pid) for pid in browser))
+        lifecycle.close()
+        self.assertTrue(_gone(browser))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Coordinator and worker agents on localhost, with an agent killed."""
+import multiprocessing
+import threading
+import time
+import unittest
+
+from distributed import Coordinator, WorkerAgent
+
+URLS = ["http://a.example/", "http://b.example/", "http://c.example/"]
+RUNS = 3
+
+
+class FakeWorker(object):
+    """Measures instantly, or hangs when told to (then gets killed)."""
+
+    def __init__(self, hang=None):
+        self.hang = hang
+
+    def measure(self, url, run_number):
+        if self.hang is not None:
+            self.hang.set()
+            time.sleep(3600)
+        return [{"url": url, "run": run_number, "Page Load": 100}]
+
+    def close(self):
+        pass
+
+
+class HangingFactory(object):
+    """Picklable worker factory of the agent that gets killed."""
+
+    def __init__(self, leased):
+        self.leased = leased
+
+    def __call__(self):
+        return FakeWorker(self.leased)
+
+
+def _victim_main(address, leased):
+    WorkerAgent(address, HangingFactory(leased), name="victim").run()
+
+
+class CoordinatorTest(unittest.TestCase):
+
+    def test_killed_agent_lease_is_handed_out_again(self):
+        coordinator = Coordinator("127.0.0.1:0", lease_seconds=1)
+        coordinator.start()
+        address = "127.0.0.1:{0}".format(coordinator.port)
+        items = [(url, run) for run in range(RUNS) for url in URLS]
+        results = []
+        consumer = threading.Thread(
+            target=lambda: results.extend(coordinator.run(iter(items))))
+        consumer.start()
+
+        leased = multiprocessing.Event()
+        victim = multiprocessing.Process(target=_victim_main,
+                                         args=(address, leased))
+        victim.start()
+        try:
+            self.assertTrue(leased.wait(10), "victim never got a lease")
+            victim.terminate()
+        finally:
+            victim.join(10)
+
+        agents = [threading.Thread(target=WorkerAgent(
+            address, FakeWorker, name="agent-{0}".format(i)).run)
+            for i in range(2)]
+        for agent in agents:
+            agent.daemon = True
+            agent.start()
+        consumer.join(60)
+        self.assertFalse(consumer.is_alive(), "coordinator never finished")
+        for agent in agents:
+            agent.join(10)
+
+        # the victim's item came back from a live agent after its lease
+        self.assertGreaterEqual(coordinator.stats['retried'], 1)
+        self.assertEqual(coordinator.stats['failed'], 0)
+        self.assertEqual(set(worker for _, worker, _ in results),
+                         set(["agent-0", "agent-1"]))
+        merged = [(row["url"], row["run"])
+                  for _, _, rows in results for row in rows]
+        self.assertEqual(sorted(merged), sorted(items))
+        self.assertEqual([seq for seq, _, _ in results],
+                         list(range(len(items))))
+
+    def test_agents_started_first_wait_for_the_work(self):
+        coordinator = Coordinator("127.0.0.1:0")
+        reply = coordinator.lease({"worker": "early"})
+        self.assertEqual(reply["items"], [])
+        self.assertFalse(reply["done"])
+
+
+if __name__ == '__main__':
+    unittest.main()
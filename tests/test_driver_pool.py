@@ -0,0 +1,135 @@
+"""Recycle policy and savings report of the driver pool, on fake drivers."""
+import itertools
+import time
+import unittest
+
+import proctree
+from driver_pool import DriverPool
+
+LAUNCH_SECONDS = 0.02
+_pids = itertools.count(100000)
+
+
+class FakeProcess(object):
+
+    def __init__(self):
+        self.pid = next(_pids)
+
+
+class FakeService(object):
+
+    def __init__(self):
+        self.process = FakeProcess()
+
+
+class FakeDriver(object):
+    """A session whose memory footprint the test sets through rss."""
+
+    def __init__(self):
+        self.service = FakeService()
+        self.rss = 100 * 1024 * 1024
+        self.resets = 0
+        self.quit_calls = 0
+
+    def quit(self):
+        self.quit_calls += 1
+
+
+class DriverPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.drivers = {}
+        self._tree_rss = proctree.tree_rss
+        proctree.tree_rss = lambda pid: self.drivers[pid].rss
+
+    def tearDown(self):
+        proctree.tree_rss = self._tree_rss
+
+    def launch(self):
+        time.sleep(LAUNCH_SECONDS)
+        driver = FakeDriver()
+        self.drivers[driver.service.process.pid] = driver
+        return driver
+
+    @staticmethod
+    def reset(driver):
+        driver.resets += 1
+
+    def test_recycles_after_max_loads(self):
+        pool = DriverPool(self.launch, self.reset, max_loads=3)
+        used = []
+        for _ in range(7):
+            driver = pool.acquire()
+            used.append(driver)
+            pool.release(driver)
+        pool.close()
+
+        self.assertEqual(pool.stats['launches'], 3)
+        self.assertEqual(pool.stats['recycles'], 2)
+        self.assertEqual(pool.stats['loads'], 7)
+        self.assertEqual(sorted(len([d for d in used if d is driver])
+                                for driver in self.drivers.values()),
+                         [1, 3, 3])
+        # a session is reset before every reuse, never before its first
+        self.assertEqual(sum(d.resets for d in self.drivers.values()), 4)
+        self.assertTrue(all(d.quit_calls == 1
+                            for d in self.drivers.values()))
+
+    def test_recycles_on_rss_growth(self):
+        pool = DriverPool(self.launch, self.reset, max_loads=0,
+                          max_rss_growth_mb=50)
+        driver = pool.acquire()
+        driver.rss += 40 * 1024 * 1024
+        pool.release(driver)
+        self.assertIs(pool.acquire(), driver)
+        driver.rss += 20 * 1024 * 1024
+        pool.release(driver)
+        self.assertEqual(driver.quit_calls, 1)
+        self.assertIsNot(pool.acquire(), driver)
+        self.assertEqual(pool.stats['recycles'], 1)
+
+    def test_failed_loads_and_failed_resets_get_a_new_session(self):
+        pool = DriverPool(self.launch, self.reset)
+        first = pool.acquire()
+        pool.release(first, failed=True)
+        self.assertEqual(first.quit_calls, 1)
+
+        def broken_reset(driver):
+            raise RuntimeError("browser gone")
+        pool.reset = broken_reset
+        second = pool.acquire()
+        pool.release(second)
+        third = pool.acquire()
+        self.assertIsNot(third, second)
+        self.assertEqual(second.quit_calls, 1)
+        self.assertEqual(pool.stats['launches'], 3)
+
+    def test_teardown_replaces_quit(self):
+        ended = []
+        pool = DriverPool(self.launch, self.reset, max_loads=1,
+                          teardown=ended.append)
+        driver = pool.acquire()
+        pool.release(driver)
+        self.assertEqual(ended, [driver])
+        self.assertEqual(driver.quit_calls, 0)
+
+    def test_savings_report(self):
+        pool = DriverPool(self.launch, self.reset, max_loads=5)
+        for _ in range(10):
+            pool.release(pool.acquire())
+        pool.close()
+        report = pool.savings_report()
+        self.assertEqual(report['launches'], 2)
+        self.assertAlmostEqual(report['baseline_time'],
+                               10 * (report['avg_launch'] +
+                                     report['avg_quit']))
+        self.assertAlmostEqual(report['saved_time'],
+                               report['baseline_time'] -
+                               report['pooled_time'])
+        # launch-per-load would have paid 8 more launches
+        self.assertGreater(report['saved_time'], 7 * LAUNCH_SECONDS)
+        self.assertIn("10 loads, 2 launches", pool.format_savings_report())
+
+
+if __name__ == '__main__':
+    unittest.main()
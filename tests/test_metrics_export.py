@@ -0,0 +1,120 @@
+"""Metrics export: Prometheus scrape endpoint and StatsD datagrams."""
+import socket
+import unittest
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+from metrics_export import MetricsExporter, MS_BUCKETS, MB_BUCKETS
+
+METRICS = ["Page Load", "Cache Hits %", "RSS Peak MB"]
+PAGE_LOADS = [40, 120, 120, 700, 45000]
+
+
+def _rows():
+    for run, page_load in enumerate(PAGE_LOADS):
+        yield {"url": "http://a.example/", "run": run,
+               "Page Load": page_load, "Cache Hits %": "N/A",
+               "RSS Peak MB": 300 + run}
+
+
+class MetricsExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.statsd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.statsd.bind(("127.0.0.1", 0))
+        self.statsd.settimeout(5)
+        self.exporter = MetricsExporter(
+            METRICS, listen="127.0.0.1:0",
+            statsd="127.0.0.1:{0}".format(self.statsd.getsockname()[1]),
+            flush_interval=60).start()
+
+    def tearDown(self):
+        self.exporter.close()
+        self.statsd.close()
+
+    def scrape(self, exporter=None):
+        response = urlopen("http://{0}/metrics".format(
+            (exporter or self.exporter).address), timeout=5)
+        try:
+            return response.read().decode('utf-8').splitlines()
+        finally:
+            response.close()
+
+    def test_scrape_histograms(self):
+        for row in _rows():
+            self.exporter.observe(row)
+        self.exporter.flush()
+        lines = self.scrape()
+        series = 'url="http://a.example/"'
+
+        buckets = [line for line in lines
+                   if line.startswith("plt_page_load_milliseconds_bucket")]
+        self.assertEqual(len(buckets), len(MS_BUCKETS) + 1)
+        counts = dict((line.split('le="')[1].split('"')[0],
+                       int(line.rsplit(' ', 1)[1])) for line in buckets)
+        self.assertEqual(counts["50"], 1)
+        self.assertEqual(counts["250"], 3)
+        self.assertEqual(counts["1000"], 4)
+        self.assertEqual(counts["30000"], 4)
+        self.assertEqual(counts["+Inf"], 5)
+        self.assertIn("plt_page_load_milliseconds_sum{%s} %s" % (
+            series, float(sum(PAGE_LOADS))), lines)
+        self.assertIn("plt_page_load_milliseconds_count{%s} 5" % series,
+                      lines)
+
+        self.assertIn("# TYPE plt_rss_peak_megabytes histogram", lines)
+        self.assertEqual(len([line for line in lines if line.startswith(
+            "plt_rss_peak_megabytes_bucket")]), len(MB_BUCKETS) + 1)
+        self.assertIn("plt_rss_peak_megabytes_count{%s} 5" % series, lines)
+        # N/A values are not observed, so there is no such family
+        self.assertFalse([line for line in lines
+                          if line.startswith("plt_cache_hits_percent")])
+        self.assertIn("plt_exporter_dropped_rows_total 0", lines)
+
+    def test_scrape_leaves_the_queue_to_the_export_thread(self):
+        for row in _rows():
+            self.exporter.observe(row)
+        lines = self.scrape()
+        self.assertFalse([line for line in lines
+                          if line.startswith("plt_page_load")])
+        self.assertEqual(self.exporter.stats['rows'], 0)
+        self.assertEqual(self.exporter.stats['datagrams'], 0)
+
+    def test_export_thread_folds_and_pushes(self):
+        exporter = MetricsExporter(
+            METRICS, listen="127.0.0.1:0",
+            statsd="127.0.0.1:{0}".format(self.statsd.getsockname()[1]),
+            flush_interval=0.05).start()
+        try:
+            exporter.observe(next(_rows()))
+            self.assertIn("plt.http_a_example.page_load:40|ms",
+                          self.statsd.recv(65536).decode('utf-8'))
+            self.assertEqual(exporter.stats['rows'], 1)
+            self.assertIn('plt_page_load_milliseconds_count'
+                          '{url="http://a.example/"} 1',
+                          self.scrape(exporter))
+        finally:
+            exporter.close()
+
+    def test_statsd_datagrams(self):
+        for row in _rows():
+            self.exporter.observe(row)
+        self.exporter.flush()
+        received = []
+        while len(received) < 2 * len(PAGE_LOADS):
+            received.extend(self.statsd.recv(65536).decode('utf-8')
+                            .split('\n'))
+        self.assertEqual(
+            sorted(received),
+            sorted(["plt.http_a_example.page_load:{0}|ms".format(value)
+                    for value in PAGE_LOADS] +
+                   ["plt.http_a_example.rss_peak_mb:{0}|h".format(300 + run)
+                    for run in range(len(PAGE_LOADS))]))
+        self.assertEqual(self.exporter.stats['send_errors'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
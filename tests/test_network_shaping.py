@@ -0,0 +1,88 @@
+"""Profile parsing and the delay, pacing and loss of the emulated link."""
+import random
+import time
+import unittest
+
+import network_shaping
+from network_shaping import MIN_RTO, SEGMENT_SIZE, _Link, parse_profile
+
+
+class ParseProfileTest(unittest.TestCase):
+
+    def test_presets_ignore_case(self):
+        profile = parse_profile("3gfast")
+        self.assertIs(profile, network_shaping.PROFILES["3gfast"])
+        self.assertEqual(profile.name, "3GFast")
+        self.assertEqual(profile.rtt_ms, 150)
+
+    def test_custom_profiles(self):
+        profile = parse_profile("1000/500/40")
+        self.assertEqual((profile.down_kbps, profile.up_kbps,
+                          profile.rtt_ms, profile.loss),
+                         (1000, 500, 40, 0.0))
+        self.assertEqual(str(profile), "1000/500/40")
+        self.assertEqual(parse_profile("0/0/10/2.5").loss, 2.5)
+
+    def test_bad_profiles(self):
+        for text in ("", "fast", "1000/500", "1000/500/40/1/2",
+                     "1000/-1/40", "1000/500/40/100", "a/b/c"):
+            self.assertRaises(ValueError, parse_profile, text)
+
+    def test_devtools_conditions(self):
+        conditions = parse_profile("8000/0/30").devtools_conditions()
+        self.assertEqual(conditions["download_throughput"], 1000000)
+        self.assertEqual(conditions["upload_throughput"], -1)
+        self.assertEqual(conditions["latency"], 30)
+
+
+class LinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random_state = random.getstate()
+        random.seed(16)
+
+    def tearDown(self):
+        random.setstate(self.random_state)
+
+    def test_delay_without_a_bandwidth_limit(self):
+        link = _Link(0, 0.05, 0)
+        sent, delivered = link.schedule(100000)
+        self.assertAlmostEqual(delivered - sent, 0.05)
+
+    def test_chunks_queue_behind_the_bottleneck(self):
+        # 8000 kbit/s moves 10000 bytes in 10 ms
+        link = _Link(8000, 0.02, 0)
+        times = [link.schedule(10000) for _ in range(10)]
+        first = times[0][0]
+        for index, (sent, delivered) in enumerate(times):
+            self.assertAlmostEqual(sent - first, index * 0.01, places=6)
+            self.assertAlmostEqual(delivered - sent, 0.02, places=6)
+
+    def test_loss_applies_per_segment(self):
+        link = _Link(0, 0.01, 5)
+        chunks = 4000
+        late = 0
+        for _ in range(chunks):
+            sent, delivered = link.schedule(10 * SEGMENT_SIZE)
+            if delivered - sent > 0.011:
+                late += 1
+        # a chunk of ten segments keeps none of them lost 0.95 ** 10
+        self.assertAlmostEqual(late / float(chunks), 1 - 0.95 ** 10,
+                               delta=0.03)
+
+    def test_lost_segments_are_resent_and_wait_a_timeout(self):
+        link = _Link(8000, 0.01, 50)
+        lossy = 0
+        for _ in range(200):
+            start = max(link.free_at, time.time())
+            sent, delivered = link.schedule(SEGMENT_SIZE)
+            if delivered - sent > 0.011:
+                lossy += 1
+                self.assertAlmostEqual(delivered - sent, 0.01 + MIN_RTO)
+                # the retransmission takes the bottleneck a second time
+                self.assertGreater(sent - start, 1.5 * SEGMENT_SIZE / 1e6)
+        self.assertTrue(50 < lossy < 150, lossy)
+
+
+if __name__ == '__main__':
+    unittest.main()
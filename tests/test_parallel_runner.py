@@ -0,0 +1,79 @@
+"""Ordered results of the parallel runner, with a worker process killed."""
+import os
+import signal
+import time
+import unittest
+
+import parallel_runner
+from parallel_runner import ParallelRunner
+
+CRASH_URL = "http://crash.example/"
+ITEMS = 30
+
+
+class FakeWorker(object):
+    """Measures in a few ms, kills its own process on CRASH_URL."""
+
+    def measure(self, url, run_number):
+        if url == CRASH_URL:
+            os.kill(os.getpid(), signal.SIGKILL)
+        time.sleep(0.05)
+        return [{"url": url, "run": run_number, "Page Load": 100}]
+
+    def close(self):
+        pass
+
+
+def _items(crash_at):
+    for seq in range(ITEMS):
+        url = CRASH_URL if seq == crash_at else "http://a.example/"
+        yield url, seq
+
+
+class ParallelRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lost_grace = parallel_runner.LOST_GRACE
+        parallel_runner.LOST_GRACE = 0.1
+
+    def tearDown(self):
+        parallel_runner.LOST_GRACE = self.lost_grace
+
+    def run_items(self, crash_at, mode='process', ordered=True):
+        runner = ParallelRunner(FakeWorker, workers=2, mode=mode,
+                                ordered=ordered, queue_depth=2)
+        results = []
+        for seq, worker, rows in runner.run(_items(crash_at)):
+            results.append((time.time(), seq, worker, rows))
+        return results
+
+    def test_all_items_in_order_without_a_crash(self):
+        results = self.run_items(None, mode='thread')
+        self.assertEqual([seq for _, seq, _, _ in results],
+                         list(range(ITEMS)))
+        self.assertTrue(all(rows for _, _, _, rows in results))
+
+    def test_items_of_a_killed_worker_are_yielded_as_failures(self):
+        # seq 1 goes to worker 1, which dies on it
+        results = self.run_items(1)
+        self.assertEqual([seq for _, seq, _, _ in results],
+                         list(range(ITEMS)))
+        for _, seq, worker, rows in results:
+            self.assertEqual(worker, seq % 2)
+            if worker == 1:
+                self.assertEqual(rows, [])
+            else:
+                self.assertEqual(rows[0]["run"], seq)
+
+        # the survivor's results kept coming, not all at the end
+        yielded = dict((seq, when) for when, seq, _, _ in results)
+        self.assertGreater(yielded[ITEMS - 2] - yielded[6], 0.3)
+
+    def test_unordered_results_skip_the_killed_worker(self):
+        results = self.run_items(1, ordered=False)
+        self.assertEqual(sorted(seq for _, seq, _, _ in results),
+                         list(range(0, ITEMS, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Resource timing entries held in columns and written out by batches."""
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from resource_timing import ResourceTimingStore, NAVIGATION_FIELDS, \
+    RESOURCE_FIELDS
+
+PAGES = 5
+RESOURCES = 4
+
+
+def _payload(page):
+    """RESOURCE_TIMING_SCRIPT result with the slowest resource last."""
+    navigation = [{"type": u"navigate", "nextHopProtocol": u"h2"}.get(
+        field, 0) for field in NAVIGATION_FIELDS]
+    resources = []
+    for index in range(RESOURCES):
+        entry = dict((field, 10.0 * index) for field in RESOURCE_FIELDS)
+        entry.update(name=u"http://a.example/{0}.js".format(index),
+                     initiatorType=u"script", nextHopProtocol=u"h2",
+                     startTime=100.0 - index, duration=page + index)
+        resources.append([entry[field] for field in RESOURCE_FIELDS])
+    # a resource without a duration, the browser did not expose it
+    resources[0][RESOURCE_FIELDS.index("duration")] = None
+    return {"navigation": navigation, "resources": resources}
+
+
+def _read(path):
+    with open(path) as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+class ResourceTimingStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.directory, "run")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pages_are_written_out_by_batches(self):
+        store = ResourceTimingStore(slowest=2, batch=2)
+        store.open(self.prefix)
+        for page in range(PAGES):
+            store.add_page(u"http://a.example/", page, _payload(page))
+            self.assertLessEqual(len(store), 2)
+            # url, runs, names, types and protocols, once per batch
+            self.assertLessEqual(len(store.strings.strings),
+                                 RESOURCES + 6)
+        store.close()
+
+        self.assertEqual(store.pages, PAGES)
+        self.assertEqual(store.resource_count, PAGES * RESOURCES)
+        navigation = _read(self.prefix + "_navigation.csv")
+        self.assertEqual([row["run"] for row in navigation],
+                         [str(page) for page in range(PAGES)])
+        waterfall = _read(self.prefix + "_waterfall.csv")
+        self.assertEqual(len(waterfall), PAGES * RESOURCES)
+        # sorted by start time within each page
+        self.assertEqual([row["name"] for row in waterfall[:RESOURCES]],
+                         [u"http://a.example/{0}.js".format(index)
+                          for index in reversed(range(RESOURCES))])
+        slowest = _read(self.prefix + "_slowest.csv")
+        self.assertEqual(len(slowest), PAGES * 2)
+        self.assertEqual([(row["run"], row["rank"], row["name"])
+                          for row in slowest[:2]],
+                         [("0", "1", u"http://a.example/3.js"),
+                          ("0", "2", u"http://a.example/2.js")])
+
+    def test_pages_are_kept_for_the_console_without_files(self):
+        store = ResourceTimingStore(slowest=3, batch=2)
+        for page in range(PAGES):
+            self.assertEqual(store.add_page(u"http://a.example/", page,
+                                            _payload(page)), page)
+        store.close()
+        self.assertEqual(len(store), PAGES)
+        lines = store.format_slowest(4).splitlines()
+        self.assertEqual(lines[0],
+                         u"Slowest resources for http://a.example/ (run 4):")
+        self.assertEqual(len(lines), 4)
+        self.assertIn(u"7.0 ms", lines[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
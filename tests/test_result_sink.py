@@ -0,0 +1,115 @@
+"""Result rows written by ResultSink read back unchanged."""
+import csv
+import json
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+from result_sink import ResultSink, FORMATS, file_extension, pyarrow, \
+    read_columnar
+
+COLUMNS = ["url", "run", "Page Load", "Backend Time"]
+ROWS = [{"url": u"http://a.example/", "run": run,
+         "Page Load": 1000 + run, "Backend Time": "N/A" if run == 2 else 0.5}
+        for run in range(5)] + \
+    [{"url": u"http://b.example/?q=\"a,b\"", "run": 5,
+      "Page Load": 2000, "Backend Time": 20, "extra": "ignored"}]
+
+
+def _read(path, fmt):
+    """Return the rows of a file as {column: text or float} dicts."""
+    if fmt == 'csv':
+        with open(path, 'rb') as csv_file:
+            lines = csv_file.read().decode('utf-8').splitlines()
+        return [dict((k, v) for k, v in row.items())
+                for row in csv.DictReader(lines)]
+    if fmt == 'jsonl':
+        with open(path) as jsonl_file:
+            return [json.loads(line) for line in jsonl_file]
+    if pyarrow is not None:
+        columns = pyarrow.parquet.read_table(path).to_pydict()
+    else:
+        columns = read_columnar(path)
+    return [dict((c, columns[c][i]) for c in COLUMNS)
+            for i in range(len(columns["url"]))]
+
+
+def _same(expected, actual):
+    if expected in ("N/A", None):
+        return actual in ("N/A", "", None) or \
+            (isinstance(actual, float) and math.isnan(actual))
+    if isinstance(expected, (int, float)):
+        return float(actual) == float(expected)
+    return actual == expected
+
+
+class ResultSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        for fmt in FORMATS:
+            path = os.path.join(self.directory,
+                                'results' + file_extension(fmt))
+            with ResultSink(path, COLUMNS, fmt, batch_size=4) as sink:
+                for row in ROWS:
+                    sink.write(row)
+            rows = _read(path, fmt)
+            self.assertEqual(len(rows), len(ROWS), fmt)
+            for expected, actual in zip(ROWS, rows):
+                self.assertEqual(sorted(actual), sorted(COLUMNS), fmt)
+                for column in COLUMNS:
+                    self.assertTrue(
+                        _same(expected[column], actual[column]),
+                        "{0} {1}: {2!r} != {3!r}".format(
+                            fmt, column, expected[column], actual[column]))
+
+    def test_columnar_kinds_come_from_the_declared_columns(self):
+        # the first batch times out, the run number comes as text
+        rows = [{"url": u"http://a.example/", "run": "0",
+                 "Page Load": "N/A", "Backend Time": None},
+                {"url": u"http://a.example/", "run": "1",
+                 "Page Load": "N/A", "Backend Time": "N/A"},
+                {"url": 42, "run": 2, "Page Load": 900, "Backend Time": 80}]
+        path = os.path.join(self.directory,
+                            'timeouts' + file_extension('columnar'))
+        with ResultSink(path, COLUMNS, 'columnar', batch_size=2) as sink:
+            for row in rows:
+                sink.write(row)
+        read = _read(path, 'columnar')
+        self.assertEqual([row["url"] for row in read],
+                         [u"http://a.example/", u"http://a.example/",
+                          u"42"])
+        self.assertEqual([row["run"] for row in read], [0.0, 1.0, 2.0])
+        for column, last in (("Page Load", 900.0), ("Backend Time", 80.0)):
+            values = [row[column] for row in read]
+            self.assertEqual(values[2], last)
+            self.assertTrue(all(value is None or math.isnan(value)
+                                for value in values[:2]), column)
+
+    def test_declared_text_columns(self):
+        path = os.path.join(self.directory,
+                            'text' + file_extension('columnar'))
+        with ResultSink(path, COLUMNS, 'columnar',
+                        text_columns=["url", "run"]) as sink:
+            sink.write({"url": u"http://a.example/", "run": 7,
+                        "Page Load": "slow", "Backend Time": 3})
+        read = _read(path, 'columnar')[0]
+        self.assertEqual(read["run"], u"7")
+        self.assertTrue(read["Page Load"] is None or
+                        math.isnan(read["Page Load"]))
+        self.assertEqual(read["Backend Time"], 3.0)
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, ResultSink,
+                          os.path.join(self.directory, 'x'), COLUMNS, 'xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Mann-Whitney regression gate and the SQLite results history."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from results_db import ResultsDB, compare, mann_whitney, proportion_test
+
+# p-values of an exact permutation test over every split of the samples,
+# the normal approximation must stay close to them
+NO_TIES = ([12, 15, 17, 19, 21, 23, 25, 28],
+           [10, 11, 13, 14, 16, 18, 20, 22])
+NO_TIES_EXACT_P = 0.05245
+TIES = ([3, 5, 5, 7, 9, 9, 9, 11, 14], [2, 3, 4, 5, 5, 6, 8, 9])
+TIES_EXACT_P = 0.04290
+
+
+class MannWhitneyTest(unittest.TestCase):
+
+    def test_without_ties(self):
+        u, p_value = mann_whitney(*NO_TIES)
+        self.assertEqual(u, 48)
+        self.assertAlmostEqual(p_value, NO_TIES_EXACT_P, delta=0.005)
+
+    def test_with_ties(self):
+        u, p_value = mann_whitney(*TIES)
+        self.assertEqual(u, 54)
+        self.assertAlmostEqual(p_value, TIES_EXACT_P, delta=0.005)
+
+    def test_one_sided(self):
+        u, p_value = mann_whitney(NO_TIES[1], NO_TIES[0])
+        self.assertEqual(u, 8 * 8 - 48)
+        self.assertGreater(p_value, 0.9)
+
+    def test_proportion_test(self):
+        self.assertLess(proportion_test((10, 30), (0, 30)), 0.01)
+        self.assertEqual(proportion_test((0, 30), (0, 30)), 1.0)
+
+
+class ResultsDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = ResultsDB(os.path.join(self.directory, 'results.db'),
+                            batch_size=7)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+    def add_run(self, page_loads, view="first-view"):
+        run_id = self.db.start_run("chrome")
+        for iteration, page_load in enumerate(page_loads):
+            self.db.add({"url": "http://a.example/", "run": iteration,
+                         "View": view, "Repeat": 0,
+                         "Page Load": page_load, "Backend Time": 100})
+        self.db.flush()
+        return run_id
+
+    def test_regression_and_timeouts(self):
+        baseline = self.add_run(NO_TIES[1] * 2)
+        current = self.add_run(NO_TIES[0] * 2 + ["N/A"] * 8)
+        results = dict((r["metric"], r) for r in compare(
+            self.db, [current], [baseline], ["Page Load"]))
+        self.assertTrue(results["Page Load"]["regression"])
+        # timed-out loads store no values, but count in the timeout rate
+        self.assertEqual(results["Page Load"]["samples"], (16, 16))
+        self.assertAlmostEqual(results["Timeout %"]["current"], 100 * 8 / 24.0)
+        self.assertTrue(results["Timeout %"]["regression"])
+
+    def test_views_are_compared_apart(self):
+        baseline = self.add_run(NO_TIES[1] * 2)
+        self.add_run(NO_TIES[1] * 2, view="repeat-view")
+        current = self.add_run(NO_TIES[0] * 2, view="repeat-view")
+        metrics = set(r["metric"] for r in compare(
+            self.db, [current], [baseline], ["Page Load"]))
+        # the current run has repeat views only, the baseline first views
+        self.assertFalse(metrics & set(["Page Load",
+                                        "Page Load [repeat-view]"]))
+        self.assertEqual(self.db.metric_names("Page Load"),
+                         ["Page Load", "Page Load [repeat-view]"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""P-square quantiles and the per-URL aggregator."""
+import random
+import unittest
+
+from streaming_stats import MetricStats, P2Quantile, ResultAggregator
+
+
+def exact_quantile(values, q):
+    """Nearest rank quantile of a sample."""
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+class P2QuantileTest(unittest.TestCase):
+
+    def test_matches_exact_quantiles_on_a_seeded_sample(self):
+        rng = random.Random(1234)
+        # page loads are right skewed, like a lognormal
+        sample = [rng.lognormvariate(7, 0.5) for _ in range(20000)]
+        for q in (0.5, 0.9, 0.99):
+            estimator = P2Quantile(q)
+            for value in sample:
+                estimator.add(value)
+            exact = exact_quantile(sample, q)
+            self.assertAlmostEqual(estimator.value() / exact, 1.0, delta=0.02)
+
+    def test_exact_below_six_values(self):
+        estimator = P2Quantile(0.5)
+        for value in (5, 1, 4):
+            estimator.add(value)
+        self.assertEqual(estimator.value(), 4)
+
+
+class MetricStatsTest(unittest.TestCase):
+
+    def test_welford_mean_and_stddev(self):
+        stats = MetricStats()
+        for value in (2, 4, 4, 4, 5, 5, 7, 9):
+            stats.add(value)
+        self.assertEqual(stats.count, 8)
+        self.assertAlmostEqual(stats.mean, 5.0)
+        self.assertAlmostEqual(stats.variance, 32 / 7.0)
+        self.assertEqual((stats.min, stats.max), (2, 9))
+
+
+class ResultAggregatorTest(unittest.TestCase):
+
+    def test_timed_out_loads_are_not_samples(self):
+        aggregator = ResultAggregator(["Page Load", "Frontend Time"])
+        aggregator.add({"url": "u", "run": 0, "Page Load": 900,
+                        "Frontend Time": 400})
+        # a load that never reached loadEventEnd
+        aggregator.add({"url": "u", "run": 1, "Page Load": "N/A",
+                        "Frontend Time": -1700000000000})
+        self.assertEqual(aggregator.get("u", "Page Load").count, 1)
+        self.assertEqual(aggregator.get("u", "Frontend Time").min, 400)
+
+    def test_group_by_splits_the_urls(self):
+        aggregator = ResultAggregator(["Page Load"], group_by="View")
+        aggregator.add({"url": "u", "View": "first-view", "Page Load": 900})
+        aggregator.add({"url": "u", "View": "repeat-view", "Page Load": 300})
+        rows = list(aggregator.summary_rows())
+        self.assertEqual([(r["url"], r["mean"]) for r in rows],
+                         [("u [first-view]", 900.0),
+                          ("u [repeat-view]", 300.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Timers and console output of a load whose load event never fired."""
+import importlib
+import sys
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from harness_timers import PhaseTimer
+
+LOADTESTS = []
+for _name in ("chrome_loadtest", "ff_loadtest"):
+    try:
+        LOADTESTS.append(importlib.import_module(_name))
+    except (ImportError, SyntaxError):
+        # needs selenium, and the print statements of Python 2
+        pass
+
+URL = "http://timeout.example/"
+START = 1500000000000
+# navigationStart onwards of a page that was still loading at the timeout
+TIMINGS = dict(
+    navigationStart=START, fetchStart=START + 1,
+    domainLookupStart=START + 1, domainLookupEnd=START + 5,
+    connectStart=START + 5, connectEnd=START + 9, secureConnectionStart=0,
+    requestStart=START + 9, responseStart=START + 120,
+    responseEnd=START + 130, domLoading=START + 140, domComplete=0,
+    domContentLoadedEventStart=0, loadEventEnd=0)
+
+
+class TimedOutDriver(object):
+    """Reports the timings of a page that never finished loading."""
+
+    def get(self, url):
+        pass
+
+    def execute_script(self, script, *args):
+        if "readyState" in script:
+            return "complete"
+        return dict(TIMINGS)
+
+
+@unittest.skipIf(not LOADTESTS, "the load tests need selenium and Python 2")
+class TimedOutLoadTest(unittest.TestCase):
+
+    def test_calc_timers_reports_unset_timers_as_na(self):
+        for loadtest in LOADTESTS:
+            pt = loadtest.PerfTimings()
+            pt.calc_timers(dict(TIMINGS, url=URL, run="0"))
+            self.assertEqual(pt.calc_timings["Backend Time"], 120)
+            for metric in ("Page Load", "Frontend Time", "DOM Ready"):
+                self.assertEqual(pt.calc_timings[metric], "N/A",
+                                 (loadtest.__name__, metric))
+
+    def test_measure_view_and_console_row_survive_the_timeout(self):
+        for loadtest in LOADTESTS:
+            pt = loadtest.PerfTimings()
+            pt.current_url = URL
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                measured = pt.measure_view(TimedOutDriver(), 0, PhaseTimer())
+                pt.print_output()
+                printed = sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+            self.assertTrue(measured, loadtest.__name__)
+            self.assertEqual(pt.calc_timings["Harness Overhead"], "N/A")
+            self.assertIn("N/A ms", printed)
+            pt.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Resuming a run from its checkpoint."""
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from result_sink import ResultSink
+from url_source import Checkpoint
+
+URLS = ["http://a.example/", "http://b.example/", "http://c.example/"]
+ITEMS = [(url, run) for run in range(4) for url in URLS]
+COLUMNS = ["url", "run", "Page Load"]
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'run.ckp')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def measure(self, session, stop_after=None):
+        """Measure the pending items like the scripts do, maybe crash."""
+        checkpoint = Checkpoint(self.path)
+        sink = ResultSink(os.path.join(self.directory,
+                                       '{0}.csv'.format(session)),
+                          COLUMNS, batch_size=3)
+        measured = []
+        for url, run in ITEMS:
+            if checkpoint.done(url, run):
+                continue
+            if stop_after is not None and len(measured) == stop_after:
+                # crash: unflushed rows and uncommitted marks are lost
+                sink._file.close()
+                checkpoint._file.close()
+                return measured
+            measured.append((url, run))
+            sink.write({"url": url, "run": run, "Page Load": 100})
+            checkpoint.mark(url, run)
+            # only checkpoint loads whose rows reached the results file
+            if checkpoint.pending >= sink.batch_size:
+                sink.flush()
+                checkpoint.commit()
+        sink.close()
+        checkpoint.close()
+        return measured
+
+    def rows(self, session):
+        path = os.path.join(self.directory, '{0}.csv'.format(session))
+        with open(path) as csv_file:
+            return [(row["url"], int(row["run"]))
+                    for row in csv.DictReader(csv_file)]
+
+    def test_resume_measures_every_item_once(self):
+        first = self.measure(1, stop_after=7)
+        self.assertEqual(len(first), 7)
+        # the 7th row was never flushed, so it is measured again
+        self.assertEqual(len(self.rows(1)), 6)
+        second = self.measure(2)
+        self.assertEqual(second, ITEMS[6:])
+        self.assertEqual(sorted(self.rows(1) + self.rows(2)), sorted(ITEMS))
+        self.assertEqual(self.measure(3), [])
+
+    def test_torn_record_is_dropped(self):
+        checkpoint = Checkpoint(self.path)
+        checkpoint.mark(*ITEMS[0])
+        checkpoint.close()
+        with open(self.path, 'ab') as checkpoint_file:
+            checkpoint_file.write(b'\x01\x02\x03')
+        checkpoint = Checkpoint(self.path)
+        try:
+            self.assertEqual(len(checkpoint), 1)
+            self.assertTrue(checkpoint.done(*ITEMS[0]))
+            self.assertFalse(checkpoint.done(*ITEMS[1]))
+        finally:
+            checkpoint.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
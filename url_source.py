@@ -0,0 +1,180 @@
+"""Streaming URL input and resumable run checkpoints."""
+#################################################
+#
+# Description:  Read very large URL lists without loading them in
+#               memory: shuffle them in bounded chunks, keep only one
+#               shard of them, and remember the completed (url, run)
+#               pairs on disk so an interrupted run can be resumed.
+#################################################
+import array
+import bisect
+import hashlib
+import os
+import random
+import struct
+import zlib
+
+DEFAULT_SHUFFLE_CHUNK = 10000
+
+CHECKPOINT_MAGIC = b'PLTCKP1\n'
+_KEY = struct.Struct('<Q')
+# 8 byte unsigned, 'Q' is missing from the Python 2 array module
+_KEY_TYPECODE = 'L' if array.array('L').itemsize == 8 else 'Q'
+
+
+def parse_shard(text):
+    """Parse "i/N" into (i, N), raise ValueError when malformed."""
+    try:
+        index, count = [int(part) for part in text.split('/')]
+    except ValueError:
+        raise ValueError("shard must look like i/N, got {0!r}".format(text))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("shard index must be in [0, N), got {0}".format(
+            text))
+    return index, count
+
+
+def _to_bytes(url):
+    return url if isinstance(url, bytes) else url.encode('utf-8')
+
+
+class UrlSource(object):
+    """Re-iterable stream over the URLs of a file, one per line.
+
+    Every pass re-reads the file and shuffles it shuffle_chunk URLs at a
+    time, so memory stays bounded whatever the list size; 0 keeps the
+    file order.  With shard=(i, N) only the URLs whose CRC32 is i modulo N
+    are kept, so N machines can split one list without coordination.
+    """
+
+    def __init__(self, path, shard=None, shuffle_chunk=DEFAULT_SHUFFLE_CHUNK,
+                 seed=None):
+        """Doc string."""
+        self.path = path
+        self.shard = shard
+        self.shuffle_chunk = shuffle_chunk
+        self.seed = seed
+        self._passes = 0
+        # fail early on a missing or unreadable file
+        open(path, 'r').close()
+
+    def _in_shard(self, url):
+        if not self.shard:
+            return True
+        index, count = self.shard
+        return (zlib.crc32(_to_bytes(url)) & 0xffffffff) % count == index
+
+    def _urls(self):
+        with open(self.path, 'r') as url_file:
+            for line in url_file:
+                url = line.strip()
+                if url and self._in_shard(url):
+                    yield url
+
+    def __iter__(self):
+        if self.seed is None:
+            rng = random.Random()
+        else:
+            rng = random.Random(self.seed * 1000003 + self._passes)
+        self._passes += 1
+        if not self.shuffle_chunk:
+            return self._urls()
+        return self._shuffled(rng)
+
+    def _shuffled(self, rng):
+        chunk = []
+        for url in self._urls():
+            chunk.append(url)
+            if len(chunk) >= self.shuffle_chunk:
+                rng.shuffle(chunk)
+                for item in chunk:
+                    yield item
+                chunk = []
+        rng.shuffle(chunk)
+        for item in chunk:
+            yield item
+
+
+def checkpoint_key(url, run):
+    """Return the 64 bit key stored for a (url, run) pair."""
+    digest = hashlib.sha1(_to_bytes(url) + b'\n' +
+                          _to_bytes(u'{0}'.format(run))).digest()
+    return _KEY.unpack(digest[:8])[0]
+
+
+class Checkpoint(object):
+    """Append-only file of the (url, run) pairs already measured.
+
+    Each pair is stored as an 8 byte hash, so a million completed loads
+    take 8 MB on disk and in memory.  mark() only queues a pair; commit()
+    appends the queued pairs, and must be called once their rows are
+    safely in the results file, so a crash never loses a row that the
+    checkpoint claims is done.
+    """
+
+    def __init__(self, path):
+        """Doc string."""
+        self.path = path
+        self._loaded = array.array(_KEY_TYPECODE)
+        self._new = set()
+        self._pending = []
+
+        valid = 0
+        if os.path.exists(path):
+            with open(path, 'rb') as checkpoint_file:
+                data = checkpoint_file.read()
+            if not data.startswith(CHECKPOINT_MAGIC):
+                raise ValueError("{0} is not a checkpoint file".format(path))
+            # a torn last record from a crash is dropped
+            valid = len(CHECKPOINT_MAGIC) + \
+                (len(data) - len(CHECKPOINT_MAGIC)) // _KEY.size * _KEY.size
+            count = (valid - len(CHECKPOINT_MAGIC)) // _KEY.size
+            keys = struct.unpack_from('<{0}Q'.format(count), data,
+                                      len(CHECKPOINT_MAGIC))
+            self._loaded = array.array(_KEY_TYPECODE, sorted(set(keys)))
+
+        self._file = open(path, 'r+b' if valid else 'wb')
+        if valid:
+            self._file.truncate(valid)
+            self._file.seek(valid)
+        else:
+            self._file.write(CHECKPOINT_MAGIC)
+            self._file.flush()
+
+    def __len__(self):
+        return len(self._loaded) + len(self._new)
+
+    @property
+    def pending(self):
+        """Number of marked pairs not committed yet."""
+        return len(self._pending)
+
+    def done(self, url, run):
+        """Check whether a (url, run) pair was already measured."""
+        key = checkpoint_key(url, run)
+        if key in self._new:
+            return True
+        index = bisect.bisect_left(self._loaded, key)
+        return index < len(self._loaded) and self._loaded[index] == key
+
+    def mark(self, url, run):
+        """Queue a measured (url, run) pair for the next commit."""
+        key = checkpoint_key(url, run)
+        self._new.add(key)
+        self._pending.append(key)
+
+    def commit(self):
+        """Append the queued pairs to the file."""
+        if not self._pending or self._file is None:
+            return
+        self._file.write(b''.join(_KEY.pack(key) for key in self._pending))
+        self._file.flush()
+        self._pending = []
+
+    def close(self):
+        """Commit and close the checkpoint file."""
+        self.commit()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
@@ -0,0 +1,37 @@
+"""Core Web Vitals columns of the result rows."""
+#################################################
+#
+# Description:  Output columns and conversion of the payload returned by
+#               VITALS_COLLECT_SCRIPT (First Contentful Paint, Largest
+#               Contentful Paint, Cumulative Layout Shift, Total Blocking
+#               Time and long tasks).
+#################################################
+
+FCP = "First Contentful Paint"
+LCP = "Largest Contentful Paint"
+CLS = "Cumulative Layout Shift"
+TBT = "Total Blocking Time"
+LONG_TASKS = "Long Tasks"
+vitals_columns = [FCP, LCP, CLS, TBT, LONG_TASKS]
+
+# observation window: give up waiting after DEFAULT_VITALS_WINDOW ms, stop
+# earlier once no new entry came for DEFAULT_VITALS_QUIET ms
+DEFAULT_VITALS_WINDOW = 3000
+DEFAULT_VITALS_QUIET = 500
+
+
+def vitals_values(payload):
+    """Map a VITALS_COLLECT_SCRIPT payload to result row columns.
+
+    Times are in ms; missing or unsupported metrics are "N/A".
+    """
+    payload = payload or {}
+
+    def value(key, digits=None):
+        raw = payload.get(key)
+        if raw is None:
+            return "N/A"
+        return round(raw, digits) if digits else int(round(raw))
+
+    return {FCP: value("fcp"), LCP: value("lcp"), CLS: value("cls", 4),
+            TBT: value("tbt"), LONG_TASKS: value("longTasks")}